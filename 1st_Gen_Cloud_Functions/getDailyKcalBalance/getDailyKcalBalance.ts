@@ -2,6 +2,7 @@
 // @aandreu7
 
 import * as functions from 'firebase-functions/v1';
+import { FieldValue } from 'firebase-admin/firestore';
 import { db } from './firebase';
 
 /*
@@ -21,29 +22,26 @@ export const getDailyKcalBalance = functions.https.onCall(async (data, context)
     // Get current date in YYYY-MM-DD format
     const todayDate = new Date().toISOString().slice(0, 10);
 
-    // List all subcollections under the user's document
-    const userCollections = await userDocRef.listCollections();
-
-    // Find today's collection (named starting with the date string)
-    const todayCollection = userCollections.find(col => col.id.startsWith(todayDate));
-
-    let consumedKcal = 0;
-    let burntKcal = 0;
-
-    if (todayCollection) {
-      // Retrieve the 'nutrients' document inside today's collection
-      const nutrientsDoc = await todayCollection.doc('nutrients').get();
-      if (nutrientsDoc.exists) {
-        // Extract consumed and burnt kcal from the document, defaulting to 0 if missing
-        consumedKcal = nutrientsDoc.data()?.kcal ?? 0;
-        burntKcal = nutrientsDoc.data()?.burnt_kcal ?? 0;
-      }
+    // Read today's summary document (users/{uid}/days/{YYYY-MM-DD}), kept up to date by the writers
+    const todayRef = userDocRef.collection('days').doc(todayDate);
+    const todayDoc = await todayRef.get();
+    const today = todayDoc.exists ? todayDoc.data() ?? {} : {};
+
+    // Extract consumed and burnt kcal from the document, defaulting to 0 if missing
+    const consumedKcal = today.kcal ?? 0;
+    const burntKcal = today.burnt_kcal ?? 0;
+
+    // The kcal target is copied from the user document into the summary on its first read
+    let kcalTarget = today.kcal_target;
+    if (kcalTarget === undefined) {
+      const userDoc = await userDocRef.get();
+      kcalTarget = userDoc.exists ? userDoc.data()?.kcal_target ?? 0 : 0;
+      await todayRef.set(
+        { date: todayDate, kcal_target: kcalTarget, updated_at: FieldValue.serverTimestamp() },
+        { merge: true }
+      );
     }
 
-    // Get user's kcal target from the user document
-    const userDoc = await userDocRef.get();
-    const kcalTarget = userDoc.exists ? userDoc.data()?.kcal_target ?? 0 : 0;
-
     // Return the kcal balance info
     return { burntKcal, kcalTarget, consumedKcal };
   } catch (error) {
@@ -1,14 +1,12 @@
 import json
-import time
-import datetime
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from flask import Request, make_response
-from google.cloud import firestore
-
-# Initialize Firestore client
-db = firestore.Client()
+import google_fit
+import instrumentation
+import upstream
+import clients
 
+@instrumentation.traced
 def activity_tracker(request: Request):
     # Handle CORS preflight request
     if request.method == 'OPTIONS':
@@ -32,78 +30,31 @@ def activity_tracker(request: Request):
 
         # Use the access_token to create Google credentials and initialize the Fitness API client
         creds = Credentials(token=access_token)
-        fitness_service = build('fitness', 'v1', credentials=creds)
-
-        # Get current time and midnight (00:00) of today in local time
-        now = datetime.datetime.now()
-        midnight = datetime.datetime.combine(now.date(), datetime.time.min)
-
-        # Convert both to milliseconds since epoch
-        start_time_millis = int(midnight.timestamp() * 1000)
-        end_time_millis = int(time.time() * 1000)
-
-        # Build the request body for the Google Fit API
-        request_body = {
-            "aggregateBy": [
-                {"dataTypeName": "com.google.step_count.delta"},
-                {"dataTypeName": "com.google.distance.delta"},
-                {"dataTypeName": "com.google.calories.expended"},
-                {"dataTypeName": "com.google.heart_rate.bpm"}
-            ],
-            "bucketByTime": {"durationMillis": 86400000},
-            "startTimeMillis": start_time_millis,
-            "endTimeMillis": end_time_millis
-        }
-
-        # Send the request to Google Fit to aggregate the data
-        response_data = fitness_service.users().dataset().aggregate(userId='me', body=request_body).execute()
-        
-        # Extract burnt_kcal
-        burnt_kcal = 0
-        for bucket in response_data.get("bucket", []):
-            for dataset in bucket.get("dataset", []):
-                if "calories.expended" in dataset.get("dataSourceId", ""):
-                    points = dataset.get("point", [])
-                    if points:
-                        for point in points:
-                            values = point.get("value", [])
-                            if values:
-                                burnt_kcal = values[0].get("fpVal", 0)
-                                
-        burnt_kcal = round(burnt_kcal, 1)
+        # (built from the bundled discovery document, so no discovery fetch per request)
+        fitness_service = clients.fitness_service(creds, timeout=upstream.provider("fit").timeout)
 
-        # Store burnt_kcal in Firestore
-        user_ref = db.collection("users").document(user_id)
-        today_date = datetime.datetime.now().date()
-        existing_collections = list(user_ref.collections())
-        updated = False
+        # Add the activity since the last sync to today's totals (burnt_kcal included)
+        summary = google_fit.sync_user(clients.firestore_client(), fitness_service, user_id)
 
-        # Try to update today's existing collection if it exists
-        for col in existing_collections:
-            try:
-                col_date = datetime.datetime.strptime(col.id, "%Y-%m-%dT%H:%M:%S").date()
-                if col_date == today_date:
-                    doc_ref = col.document("nutrients")
-                    doc_ref.set({"burnt_kcal": burnt_kcal}, merge=True)
-                    updated = True
-                    break
-            except ValueError:
-                continue
-
-        # If no collection for today exists, create a new one with a timestamp
-        if not updated:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-            doc_ref = user_ref.collection(timestamp).document("nutrients")
-            doc_ref.set({"burnt_kcal": burnt_kcal})
+        # Return a compact summary of today's activity
+        response = make_response(json.dumps(summary), 200)
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
 
-        # Return the full response data from Google Fit as JSON
-        response = make_response(json.dumps(response_data), 200)
+    except upstream.UpstreamUnavailable as e:
+        # Google Fit is overloaded or failing: ask the app to retry later
+        instrumentation.log("activity_tracker rejected", severity="WARNING", error=str(e))
+        body, status, headers = upstream.unavailable_response(e)
+        response = make_response(json.dumps(body), status)
         response.headers['Content-Type'] = 'application/json'
+        response.headers['Retry-After'] = headers['Retry-After']
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response
 
     except Exception as e:
-        # Catch any unexpected errors and return a 500 Internal Server Error
+        # Catch any unexpected errors, log them and return a 500 Internal Server Error
+        instrumentation.log("activity_tracker failed", severity="ERROR", error=str(e))
         response = make_response(f"Error: {str(e)}", 500)
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response
\ No newline at end of file
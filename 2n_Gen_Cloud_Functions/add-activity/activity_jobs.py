@@ -0,0 +1,69 @@
+"""
+Background jobs of add-activity: the upload is accepted right away and transcription +
+kcal estimation run in a worker pool, so the slow upstream calls don't hold a request.
+
+Job state lives in Firestore (one document per job), so any instance can answer a status
+request; set a Firestore TTL policy on `expire_at` to drop old jobs. Workers run after the
+response has been sent: deploy the function with CPU always allocated (gen2
+`--no-cpu-throttling`) so they are not starved between requests.
+"""
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import instrumentation
+
+JOBS_COLLECTION = "activity_jobs"
+ACTIVITY_WORKERS = int(os.environ.get("ACTIVITY_WORKERS", "4"))
+JOB_RETENTION = timedelta(days=1)
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobQueue:
+    """
+    Runs `process(user_id, audio_bytes)` for each submitted job in a worker pool and
+    records its status and result (or error) in the job document.
+    """
+
+    def __init__(self, db, process, workers=ACTIVITY_WORKERS):
+        self.collection = db.collection(JOBS_COLLECTION)
+        self.process = process
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="activity")
+
+    def submit(self, user_id, audio_bytes):
+        """
+        Queues a job and returns its id. The audio is handed over in memory.
+        """
+        job_id = uuid.uuid4().hex
+        self.collection.document(job_id).set({
+            "user_id": user_id,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "expire_at": datetime.now(timezone.utc) + JOB_RETENTION,
+        })
+        # (the job keeps the request id of its upload in its logs)
+        instrumentation.submit(self.executor, self._run, job_id, user_id, audio_bytes)
+        return job_id
+
+    def _run(self, job_id, user_id, audio_bytes):
+        job_ref = self.collection.document(job_id)
+        try:
+            job_ref.update({"status": RUNNING, "started_at": time.time()})
+            result = self.process(user_id, audio_bytes)
+        except Exception as e:
+            instrumentation.log("Activity job failed", severity="ERROR", job_id=job_id, error=str(e))
+            job_ref.update({"status": FAILED, "error": str(e), "finished_at": time.time()})
+            return
+        job_ref.update({"status": DONE, "result": result, "finished_at": time.time()})
+
+    def get(self, job_id):
+        """
+        Returns the job document as a dict, or None if there is no such job.
+        """
+        doc = self.collection.document(job_id).get()
+        return doc.to_dict() if doc.exists else None
@@ -0,0 +1,145 @@
+"""
+Kcal estimation of activities with Gemini, several activities per call.
+
+The model is asked (through llm_gateway) for a JSON array with one integer per activity,
+in order. The answer is validated strictly: an array of the wrong length is rejected and
+retried by the gateway, and activities whose value is not a plausible estimate are asked
+again on their own. Estimates are cached by normalized description and profile bucket
+(age, height and weight rounded to 10, sex), so repeated activities of similar users skip
+the model.
+"""
+import os
+import re
+import instrumentation
+import llm_gateway
+from ttl_cache import TTLCache
+
+# Largest plausible estimate for a single logged activity
+MAX_KCAL = int(os.environ.get("MAX_ACTIVITY_KCAL", "5000"))
+
+# Estimate cache settings
+KCAL_CACHE_SIZE = int(os.environ.get("KCAL_CACHE_SIZE", "2048"))
+KCAL_CACHE_TTL = int(os.environ.get("KCAL_CACHE_TTL", str(7 * 86400)))
+
+# Estimates by (description, profile bucket), shared by every request of the instance
+kcal_cache = TTLCache(maxsize=KCAL_CACHE_SIZE, ttl=KCAL_CACHE_TTL)
+
+def normalize_description(description):
+    """
+    Lowercase, no punctuation, single spaces.
+    """
+    text = re.sub(r"[^\w\s]", " ", str(description).lower())
+    return " ".join(text.split())
+
+def profile_bucket(profile):
+    """
+    Groups similar users: age, height and weight rounded down to tens, and sex.
+    """
+    def bucket(value):
+        try:
+            return str(int(float(value)) // 10 * 10)
+        except (TypeError, ValueError):
+            return "-"
+    sex = profile.get("sex")
+    sex = "-" if sex is None else ("m" if sex else "f")
+    return f"a{bucket(profile.get('age'))}/h{bucket(profile.get('height'))}/w{bucket(profile.get('weight'))}/{sex}"
+
+def describe_profile(profile):
+    """
+    Returns the physical data of a profile (age, height, weight, sex) as prompt text.
+    """
+    info_parts = []
+    if profile.get("age"): info_parts.append(f"Age: {profile['age']}")
+    if profile.get("height"): info_parts.append(f"Height: {profile['height']} cm")
+    if profile.get("weight"): info_parts.append(f"Weight: {profile['weight']} kg")
+    if profile.get("sex") is not None: info_parts.append(f"Sex: {'male' if profile['sex'] else 'female'}")
+    return ", ".join(info_parts)
+
+def build_prompt(descriptions, physical_data):
+    prompt_parts = [
+        "You are a fitness expert.",
+        "You need to make a realistic estimate of the calories the user burned performing each of the following activities.",
+        "Take their physical data into account if it exists.",
+        f"Answer solely with a JSON array of {len(descriptions)} integers, one per activity and in the same order, with nothing else.",
+    ]
+    if physical_data:
+        prompt_parts.append(f"Physical data: {physical_data}")
+    prompt_parts += [f"Activity {i + 1}: {description}" for i, description in enumerate(descriptions)]
+    return "\n".join(prompt_parts)
+
+def valid_kcal(value):
+    """
+    Returns the estimate as an int if it is a plausible kcal count, else None.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if value != value or not 0 <= value <= MAX_KCAL:
+        return None
+    return int(round(value))
+
+# JSON schema of the model answer
+ESTIMATES_SCHEMA = {"type": "array", "items": {"type": "integer"}}
+
+def estimates_validator(count):
+    """
+    Validator of the model answer: a JSON array of `count` values, turned into estimates
+    (None where a value is not a plausible kcal count).
+    """
+    def validate(values):
+        if not isinstance(values, list) or len(values) != count:
+            raise ValueError(f"expected an array of {count} estimates")
+        return [valid_kcal(value) for value in values]
+    return validate
+
+def ask_model(descriptions, physical_data):
+    """
+    One Gemini call for a list of activities. Returns one estimate (or None) per activity.
+    Identical prompts in flight share the call.
+    """
+    prompt = build_prompt(descriptions, physical_data)
+    return llm_gateway.generate_json(
+        "estimate_kcal",
+        [{"role": "user", "parts": prompt}],
+        ESTIMATES_SCHEMA,
+        estimates_validator(len(descriptions)),
+        key=prompt,
+    )
+
+def estimate_activities(descriptions, profile):
+    """
+    Returns the kcal estimate of each activity for a user profile (None for the activities
+    that couldn't be estimated). Cached activities skip the model; the others are asked in a
+    single call, and the ones it answers invalidly are asked again one by one.
+    """
+    bucket = profile_bucket(profile)
+    keys = [f"{bucket}|{normalize_description(description)}" for description in descriptions]
+    estimates = [kcal_cache.get(key) for key in keys]
+
+    # Unique uncached activities, each asked once
+    pending = {}
+    for i, key in enumerate(keys):
+        if estimates[i] is None:
+            pending.setdefault(key, descriptions[i])
+    if not pending:
+        return estimates
+
+    physical_data = describe_profile(profile)
+    results = {}
+    try:
+        results = dict(zip(pending, ask_model(list(pending.values()), physical_data)))
+    except llm_gateway.LLMError as e:
+        instrumentation.log("Gemini API error", severity="WARNING", error=str(e))
+
+    # Per-item fallback (a batch of one is just the single activity)
+    if len(pending) > 1:
+        for key, description in pending.items():
+            if results.get(key) is None:
+                try:
+                    results[key] = ask_model([description], physical_data)[0]
+                except llm_gateway.LLMError as e:
+                    instrumentation.log("Gemini API error", severity="WARNING", error=str(e))
+
+    for key, kcal in results.items():
+        if kcal is not None:
+            kcal_cache.set(key, kcal)
+    return [estimate if estimate is not None else results.get(key) for key, estimate in zip(keys, estimates)]
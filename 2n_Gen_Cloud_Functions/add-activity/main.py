@@ -1,27 +1,210 @@
 import functions_framework
-import os
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from google.cloud import firestore
-import google.generativeai as genai
-import assemblyai as aai
-import datetime
+import daily_tracking
+import instrumentation
+import upstream
+import clients
+from activity_jobs import JobQueue, DONE, FAILED
+import kcal_estimation
+
+# Runs the I/O stages that don't depend on each other concurrently
+stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="stage")
+
+class ActivityError(Exception):
+    """
+    Raised when a step of the activity processing fails, with the message returned to the app.
+    """
+
+def get_job_queue():
+    """
+    Returns the background queue of activity jobs (see activity_jobs).
+    """
+    db = clients.firestore_client()
+    return clients.get("activity_jobs", lambda: JobQueue(db, process_activity))
+
+def transcribe(audio_bytes):
+    """
+    Transcribes an audio file (in memory) using AssemblyAI, waiting at most the provider
+    timeout for the transcript.
+    """
+    try:
+        aai = clients.assemblyai()
+        config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.best)
+        transcript = upstream.provider("assemblyai").call("transcribe", lambda timeout: aai.Transcriber(
+            config=config
+        ).transcribe_async(io.BytesIO(audio_bytes)).result(timeout=timeout))
+        if transcript.status == "error":
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+        instrumentation.log("transcription", text=transcript.text)
+        return transcript.text
+    except upstream.UpstreamUnavailable:
+        raise
+    except Exception as e:
+        instrumentation.log("Speech-to-text failed", severity="ERROR", error=str(e))
+        raise ActivityError("Speech recognition failed") from e
+
+def read_profile(db, user_id):
+    """
+    Retrieves physical data (age, height, weight, sex) and the kcal target from Firestore.
+    """
+    with instrumentation.upstream("firestore_read", "user"):
+        user_doc = db.collection("users").document(user_id).get()
+    if not user_doc.exists:
+        return {}
+    data = user_doc.to_dict()
+    return {field: data.get(field) for field in ("age", "height", "weight", "sex", daily_tracking.KCAL_TARGET_FIELD)}
+
+def summary_fields(profile):
+    """
+    Fields of today's summary known from the profile read (the kcal target), written
+    together with the burnt kcal.
+    """
+    target = profile.get(daily_tracking.KCAL_TARGET_FIELD)
+    return {daily_tracking.KCAL_TARGET_FIELD: target} if target is not None else {}
+
+def estimate_kcal(description, profile):
+    """
+    Asks Gemini (or the estimate cache) for a realistic estimate of the kcal burnt by an activity.
+    """
+    kcal = kcal_estimation.estimate_activities([description], profile)[0]
+    if kcal is None:
+        raise ActivityError("Failed to estimate kcal with Gemini")
+    return kcal
+
+def timed(timings, stage, function, *args, **kwargs):
+    """
+    Calls `function(*args, **kwargs)` and records its duration in `timings[stage]` (seconds).
+    """
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 3)
 
-# Configures Generative AI client
-aai.settings.api_key = os.environ['ASSEMBLYAI_API_KEY']
+def read_profile_or_empty(db, user_id):
+    """
+    Profile read that never fails the request: without it the estimate is just less precise.
+    """
+    try:
+        return read_profile(db, user_id)
+    except Exception as e:
+        instrumentation.log("Profile read failed", severity="WARNING", error=str(e))
+        return {}
+
+def process_activity(user_id, audio_bytes):
+    """
+    Transcribes a voice description of an activity, estimates its kcal and adds them to
+    today's burnt_kcal. Returns the estimate and the transcribed description.
+
+    Stages:  transcribe ---+
+                           +--> estimate --> write (one increment)
+             profile ------+
+    The profile read runs while the audio is transcribed; today's day document needs no
+    read, its id is the date and the write is a single merge increment.
+    """
+    timings = {}
+    start = time.perf_counter()
+    db = clients.firestore_client()
+
+    profile = instrumentation.submit(stage_executor, timed, timings, "profile", read_profile_or_empty, db, user_id)
+    description = timed(timings, "transcribe", transcribe, audio_bytes)
+    profile = profile.result()
+    kcal_int = timed(timings, "estimate", estimate_kcal, description, profile)
 
-# Initialize Firestore client
-db = firestore.Client()
+    try:
+        # Add the new kcal to today's burnt_kcal in the user's tracking document
+        timed(
+            timings, "write", daily_tracking.increment_day, db, user_id, {"burnt_kcal": kcal_int},
+            fields=summary_fields(profile)
+        )
+    except Exception as e:
+        instrumentation.log("Firestore error", severity="ERROR", error=str(e))
+        raise ActivityError("Failed to estimate kcal with Gemini") from e
+
+    # Critical path: the slower of transcription and profile read, then estimate and write
+    timings["critical_path"] = round(
+        max(timings["transcribe"], timings["profile"]) + timings["estimate"] + timings["write"], 3
+    )
+    timings["total"] = round(time.perf_counter() - start, 3)
+    instrumentation.log("activity added", user_id=user_id, kcal=kcal_int, timings_s=timings)
+
+    return {
+        "kcal_estimated": kcal_int,
+        "activity_description": description
+    }
+
+def estimate_batch(user_id, activities, record=True):
+    """
+    Estimates a list of activity descriptions in a single Gemini call and, unless `record`
+    is false (e.g. backfills), adds their total to today's burnt_kcal in one increment.
+    """
+    db = clients.firestore_client()
+    profile = read_profile_or_empty(db, user_id)
+    kcal_estimates = kcal_estimation.estimate_activities(activities, profile)
+    if all(kcal is None for kcal in kcal_estimates):
+        return "Failed to estimate kcal with Gemini", 500
+
+    total_kcal = sum(kcal for kcal in kcal_estimates if kcal is not None)
+    if record and total_kcal:
+        daily_tracking.increment_day(db, user_id, {"burnt_kcal": total_kcal}, fields=summary_fields(profile))
+        instrumentation.log("activities added", user_id=user_id, kcal=total_kcal, activities=len(activities))
+
+    return jsonify({
+        "estimates": [
+            {"activity_description": description, "kcal_estimated": kcal}
+            for description, kcal in zip(activities, kcal_estimates)
+        ],
+        "total_kcal": total_kcal
+    })
+
+def job_status(job_id, user_id):
+    """
+    Returns the status of a background job, and its result once done.
+    """
+    job = get_job_queue().get(job_id)
+    if job is None or job.get("user_id") != user_id:
+        return "Unknown job", 404
+
+    response = {"job_id": job_id, "status": job["status"]}
+    if job["status"] == DONE:
+        response.update(job["result"])
+    elif job["status"] == FAILED:
+        response["error"] = job.get("error")
+    return jsonify(response)
 
 # Cloud Function HTTP entry point
 @functions_framework.http
+@instrumentation.traced
 def add_activity(request):
+    # Status of a background job: GET ?job_id=...&userId=...
+    if request.method == "GET":
+        job_id = request.args.get("job_id")
+        if not job_id or not request.args.get("userId"):
+            return "Missing job_id or userId", 400
+        return job_status(job_id, request.args["userId"])
+
+    # Batch of activity descriptions: JSON {"userId", "activities": [...], "record": true}
+    data = request.get_json(silent=True)
+    if data and "activities" in data:
+        activities = data["activities"]
+        if not data.get("userId"):
+            return "Missing userId", 400
+        if not isinstance(activities, list) or not activities or not all(isinstance(a, str) and a.strip() for a in activities):
+            return "'activities' must be a non-empty list of descriptions", 400
+        try:
+            return estimate_batch(data["userId"], activities, data.get("record", True) is not False)
+        except upstream.UpstreamUnavailable as e:
+            instrumentation.log("add_activity rejected", severity="WARNING", error=str(e))
+            return upstream.unavailable_response(e)
+
     # Extract userId from the request form data
     user_id = request.form.get('userId')
     if not user_id:
         return "Missing userId", 400
 
-    print("Starting description processing...")
-
     # Ensure an audio file is provided in the request
     if 'file' not in request.files:
         return "No file (audio) part", 400
@@ -31,122 +214,25 @@ def add_activity(request):
     if file.filename == '':
         return "File has no name or is void", 400
 
-    # Saves the audio file to the current working directory with the name "last_request"
-    filename = file.filename
-    _, ext = os.path.splitext(filename)
-    save_path = os.path.join(os.getcwd(), f"last_request{ext}")
-    file.save(save_path)
-    print("File saved")
+    # Keep the audio in memory: nothing is written to the working directory
+    audio_bytes = file.read()
+    if not audio_bytes:
+        return "File has no name or is void", 400
 
-    # Transcribe audio using AssemblyAI
-    try:
-        config = aai.TranscriptionConfig(speech_model=aai.SpeechModel.best)
-        transcript = aai.Transcriber(config=config).transcribe(save_path)
-        if transcript.status == "error":
-            raise RuntimeError(f"Transcription failed: {transcript.error}")
-        print("Transcription:", transcript.text)
-    except Exception as e:
-        print("Speech-to-text failed:", str(e))
-        return "Speech recognition failed", 500
-    finally:
-        # Clean up the saved file
-        if os.path.exists(save_path):
-            os.remove(save_path)
-
-    # Retrieve physical data (age, height, weight, sex) from Firestore
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    physical_data = ""
-    if user_doc.exists:
-        data = user_doc.to_dict()
-        age = data.get("age")
-        height = data.get("height")
-        weight = data.get("weight")
-        sex = data.get("sex")
-        info_parts = []
-        if age: info_parts.append(f"Age: {age}")
-        if height: info_parts.append(f"Height: {height} cm")
-        if weight: info_parts.append(f"Weight: {weight} kg")
-        if sex is not None: info_parts.append(f"Sex: {'male' if sex else 'female'}")
-        physical_data = ", ".join(info_parts)
-
-    # Create the prompt for Gemini AI model
-    prompt_parts = [
-        "You are a fitness expert.",
-        "You need to make a realistic estimate of the calories the user burned performing the following activity.",
-        "Take their physical data into account if it exists.",
-        "Your answer must be solely and exclusively an integer number, with nothing else.",
-    ]
-
-    # Append physical data to the activity description if available
-    user_input = transcript.text
-    if physical_data:
-        user_input += f" ({physical_data})"
-
-    # Initialize Gemini model
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    # Job mode: return a job id right away and process the audio in the background
+    mode = request.form.get("mode") or request.args.get("mode")
+    if mode == "async":
+        job_id = get_job_queue().submit(user_id, audio_bytes)
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
 
     try:
-        # Send prompt to Gemini to estimate burnt calories
-        response = model.generate_content([
-            {"role": "user", "parts": "\n".join(prompt_parts) + f"\nActivity: {user_input}"},
-        ])
-        
-        print("LLM response: ", response.text)
-        
-        kcal_response = response.text.strip()
-
-        # Validate that the response is a valid integer
-        if not kcal_response.isdigit():
-            raise ValueError("LLM did not answer with an integer number.")
-        
-        kcal_int = int(kcal_response)
-
-        # Get current UTC timestamp and format date
-        now = datetime.datetime.utcnow()
-        today_str = now.strftime("%Y-%m-%d")  
-
-        # Search for today's collection in Firestore for the user
-        user_ref = db.collection("users").document(user_id)
-        collections = user_ref.collections()
-        today_collection_ref = None
-
-        for col in collections:
-            col_name = col.id  # Format: "2025-05-28T20:56:45"
-            col_day = col_name.split("T")[0]
-            if col_day == today_str:
-                today_collection_ref = col
-                break
-
-        # Create new collection if one doesn't already exist for today
-        if today_collection_ref is None:
-            timestamp_full = now.strftime("%Y-%m-%dT%H:%M:%S")
-            today_collection_ref = user_ref.collection(timestamp_full)
-
-        # Access the "nutrients" document within the day's collection
-        nutrients_doc_ref = today_collection_ref.document("nutrients")
-        nutrients_doc = nutrients_doc_ref.get()
-
-        if nutrients_doc.exists:
-            # If nutrients doc exists, update the burnt_kcal field by adding the new kcal
-            current_data = nutrients_doc.to_dict()
-            current_burnt = current_data.get("burnt_kcal", 0)
-            new_burnt = current_burnt + kcal_int
-            nutrients_doc_ref.update({"burnt_kcal": new_burnt})
-            print(f"Updated burnt_kcal from {current_burnt} to {new_burnt}")
-        else:
-            # If nutrients doc does not exist, create it with the new kcal value
-            nutrients_doc_ref.set({"burnt_kcal": kcal_int})
-            print(f"Created nutrients doc with burnt_kcal = {kcal_int}")
-
-        # Return JSON response with estimated kcal and original activity description
-        return jsonify({
-            "kcal_estimated": kcal_int,
-            "activity_description": transcript.text
-        })
-
-    except Exception as e:
-        # Handle any errors from the Gemini API or Firestore
-        print("Gemini API error:", str(e))
-        return "Failed to estimate kcal with Gemini", 500
\ No newline at end of file
+        result = process_activity(user_id, audio_bytes)
+    except upstream.UpstreamUnavailable as e:
+        # Overloaded or failing upstream: ask the app to retry later (or use async mode)
+        instrumentation.log("add_activity rejected", severity="WARNING", error=str(e))
+        return upstream.unavailable_response(e)
+    except ActivityError as e:
+        return str(e), 500
+
+    # Return JSON response with estimated kcal and original activity description
+    return jsonify(result)
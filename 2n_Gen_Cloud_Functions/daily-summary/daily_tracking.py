@@ -0,0 +1,144 @@
+"""
+Daily tracking data layer shared by the Python Cloud Functions.
+
+Each function is deployed from its own directory, so this module is copied into every
+function that uses it: keep all the copies identical.
+
+A user's daily totals live in a single document with a deterministic path,
+`users/{uid}/days/{YYYY-MM-DD}`, holding the consumed nutrients, `burnt_kcal` and the
+`date` itself (used by range queries). Accumulated fields are changed with `increment_day`,
+which applies the deltas server-side in one write, so concurrent scans or activity logs of
+the same user never lose updates. Deltas computed from a read of the document (e.g. the Fit
+sync) pass that snapshot as `read=`: the write only applies if the document hasn't changed
+since, else DayChanged is raised and the caller reads again.
+
+The day document is also the user's "today" summary read by the dashboard: every write
+stamps `updated_at`, and `kcal_target` (copied from the user document) is kept next to the
+totals, so the balance is a single document read (see `read_summary`).
+
+Older data lives in timestamp-named subcollections
+(`users/{uid}/{YYYY-MM-DDTHH:MM:SS}/nutrients`), see migrate_daily_tracking.py.
+"""
+from datetime import datetime, timezone
+import instrumentation
+
+USERS_COLLECTION = "users"
+DAYS_COLLECTION = "days"
+DATE_FIELD = "date"
+UPDATED_AT_FIELD = "updated_at"
+KCAL_TARGET_FIELD = "kcal_target"
+
+# Legacy layout: one subcollection per day holding a "nutrients" document
+LEGACY_NUTRIENTS_DOCUMENT = "nutrients"
+LEGACY_COLLECTION_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+class DayChanged(Exception):
+    """
+    Raised by a conditional write when the day document changed since it was read.
+    """
+
+def today():
+    """
+    Returns the current (UTC) date.
+    """
+    return datetime.now(timezone.utc).date()
+
+def day_id(day=None):
+    """
+    Returns the document id of a day (today by default): "YYYY-MM-DD".
+    """
+    return (day or today()).isoformat()
+
+def days_collection(db, user_id):
+    """
+    Returns the collection holding all the day documents of a user.
+    """
+    return db.collection(USERS_COLLECTION).document(user_id).collection(DAYS_COLLECTION)
+
+def day_ref(db, user_id, day=None):
+    """
+    Returns the reference of a user's day document (today by default).
+    """
+    return days_collection(db, user_id).document(day_id(day))
+
+def get_day_snapshot(db, user_id, day=None):
+    """
+    Reads the snapshot of a user's day document (today by default), for `increment_day(read=)`.
+    """
+    with instrumentation.upstream("firestore_read", "day"):
+        return day_ref(db, user_id, day).get()
+
+def get_day(db, user_id, day=None):
+    """
+    Reads a user's day document (today by default), returning {} if it doesn't exist.
+    """
+    return get_day_snapshot(db, user_id, day).to_dict() or {}
+
+def set_day_fields(db, user_id, fields, day=None):
+    """
+    Merges `fields` into a user's day document (today by default), creating it if needed.
+    """
+    from google.cloud import firestore
+
+    day = day or today()
+    fields = {**fields, DATE_FIELD: day_id(day), UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP}
+    with instrumentation.upstream("firestore_write", "day"):
+        day_ref(db, user_id, day).set(fields, merge=True)
+
+def increment_day(db, user_id, deltas, day=None, batch=None, fields=None, read=None):
+    """
+    Atomically adds `deltas` ({field: amount}) to a user's day document (today by default)
+    with a single write, creating the document and fields if needed. `fields` are set (not
+    added) in the same write. When `batch` is given the write is only added to it, to be
+    committed by the caller with other writes. When `read` (the snapshot the deltas were
+    computed from) is given, the write raises DayChanged if the document changed since.
+    """
+    from google.api_core import exceptions
+    from google.cloud import firestore
+
+    day = day or today()
+    fields = {**(fields or {}), DATE_FIELD: day_id(day), UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP}
+    for key, amount in deltas.items():
+        fields[key] = firestore.Increment(round(amount, 1))
+
+    ref = day_ref(db, user_id, day)
+    if batch is not None:
+        batch.set(ref, fields, merge=True)
+    elif read is not None:
+        try:
+            with instrumentation.upstream("firestore_write", "day"):
+                if read.exists:
+                    ref.update(fields, option=db.write_option(last_update_time=read.update_time))
+                else:
+                    ref.create(fields)
+        except (exceptions.FailedPrecondition, exceptions.AlreadyExists, exceptions.NotFound) as e:
+            raise DayChanged(f"{ref.path} changed since it was read") from e
+    else:
+        with instrumentation.upstream("firestore_write", "day"):
+            ref.set(fields, merge=True)
+
+def read_summary(db, user_id, day=None):
+    """
+    Returns a user's day document (today by default) as the dashboard summary. The kcal
+    target is copied from the user document the first time it is missing, so the next
+    reads only fetch the day document.
+    """
+    day = day or today()
+    summary = get_day(db, user_id, day)
+    if KCAL_TARGET_FIELD not in summary:
+        with instrumentation.upstream("firestore_read", "user"):
+            user = db.collection(USERS_COLLECTION).document(user_id).get().to_dict() or {}
+        summary[KCAL_TARGET_FIELD] = user.get(KCAL_TARGET_FIELD) or 0
+        set_day_fields(db, user_id, {KCAL_TARGET_FIELD: summary[KCAL_TARGET_FIELD]}, day)
+    return summary
+
+def parse_legacy_collection_date(collection_id):
+    """
+    Returns the date of a legacy timestamp-named collection, or None for other collections.
+    """
+    for fmt in LEGACY_COLLECTION_FORMATS:
+        try:
+            return datetime.strptime(collection_id, fmt).date()
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,39 @@
+import functions_framework
+from flask import Request, jsonify
+import hashlib
+import json
+import daily_tracking
+import instrumentation
+import clients
+
+@functions_framework.http
+@instrumentation.traced
+def daily_summary(request: Request):
+    # The user can be passed as a query parameter or in a JSON body
+    user_id = request.args.get("user_id") or (request.get_json(silent=True) or {}).get("user_id")
+    if not user_id:
+        return jsonify({"error": "Missing 'user_id'"}), 400
+
+    # Today's summary is a single document (the kcal target is copied into it on first read)
+    try:
+        summary = daily_tracking.read_summary(clients.firestore_client(), user_id)
+    except Exception as e:
+        instrumentation.log("Summary read failed", severity="ERROR", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+    updated_at = summary.get(daily_tracking.UPDATED_AT_FIELD)
+    body = {
+        "date": summary.get(daily_tracking.DATE_FIELD, daily_tracking.day_id()),
+        "consumed_kcal": summary.get("kcal", 0),
+        "burnt_kcal": summary.get("burnt_kcal", 0),
+        "kcal_target": summary.get(daily_tracking.KCAL_TARGET_FIELD, 0),
+        "updated_at": updated_at.isoformat() if updated_at else None,
+    }
+
+    # Clients polling with If-None-Match get an empty 304 while the figures haven't changed
+    # (updated_at is left out of the tag, the first read's target copy moves it)
+    figures = {key: value for key, value in body.items() if key != "updated_at"}
+    response = jsonify(body)
+    response.set_etag(hashlib.sha1(json.dumps(figures, sort_keys=True).encode("utf-8")).hexdigest())
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
@@ -0,0 +1,266 @@
+"""
+Food detection in meal images with Gemini: prompt, model call and output parsing.
+
+Used by extract-food-from-image (its HTTP handler is a thin adapter over this module) and
+run in-process by extract-nutrients and get-recipe, which saves them a whole HTTP hop per
+scan. Each function is deployed from its own directory, so this module is copied into
+every function that uses it: keep all the copies identical.
+
+FOOD_EXTRACTION_MODE picks where the detection runs: "local" (in-process, needs
+GOOGLE_API_KEY) or "remote" (POST to EXTRACT_FOOD_FROM_IMAGE_URL).
+
+Images are accepted as raw bytes or base64 and go through image_preprocessing (resolution
+cap, metadata stripped, size budget) before being uploaded. Results are cached by a hash of
+the original image bytes, so repeat scans skip the LLM: in-process first, then in a
+Firestore collection shared by every instance of every function (FOOD_CACHE_SHARED, best
+effort), so the same meal sent to extract-nutrients and then to get-recipe is detected once.
+With FOOD_CACHE_PHASH, results are also cached in-process by a perceptual hash of the
+preprocessed image, so re-encodes of the same photo hit too; it is off by default because
+the cache is shared by every user, and two similar looking plates of different food would
+get each other's foods.
+"""
+import hashlib
+import os
+import threading
+import time
+import clients
+import instrumentation
+import llm_gateway
+import upstream
+from ttl_cache import TTLCache
+from image_preprocessing import decode_image, preprocess_image, perceptual_hash
+
+FOOD_EXTRACTION_MODE = os.environ.get("FOOD_EXTRACTION_MODE", "local")
+EXTRACT_FOOD_URL = os.environ.get("EXTRACT_FOOD_FROM_IMAGE_URL")
+EXTRACT_FOOD_TIMEOUT = float(os.environ.get("EXTRACT_FOOD_TIMEOUT", "60"))
+
+# Detection result cache settings
+FOOD_CACHE_SIZE = int(os.environ.get("FOOD_CACHE_SIZE", "512"))
+FOOD_CACHE_TTL = int(os.environ.get("FOOD_CACHE_TTL", "3600"))
+FOOD_CACHE_PHASH = os.environ.get("FOOD_CACHE_PHASH", "false").lower() == "true"
+FOOD_CACHE_PHASH_DISTANCE = int(os.environ.get("FOOD_CACHE_PHASH_DISTANCE", "4"))  # Max differing bits
+FOOD_CACHE_SHARED = os.environ.get("FOOD_CACHE_SHARED", "firestore")  # firestore | none
+FOOD_CACHE_COLLECTION = os.environ.get("FOOD_CACHE_COLLECTION", "food_detection_cache")
+FOOD_CACHE_SHARED_TTL = int(os.environ.get("FOOD_CACHE_SHARED_TTL", str(7 * 86400)))
+
+# Instructional prompt for the LLM
+PROMPT = (
+    "Your task is to return only the specific names of foods that are clearly visible in the image. "
+    "Do not explain. Do not add context. Do not say things like 'It looks like'. "
+    "Just return a JSON array of food names, such as: [\"Pizza\", \"Sushi\"].\n"
+    "If no food is visible, return an empty array []."
+)
+
+# JSON schema of the model answer
+FOOD_ITEMS_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+class FoodExtractionError(Exception):
+    """
+    Raised when the food extraction (local or remote) fails.
+    """
+
+# Parsed food_items by image hash, shared by every image -> foods call of the instance
+food_cache = TTLCache(maxsize=FOOD_CACHE_SIZE, ttl=FOOD_CACHE_TTL)
+
+class PhashIndex:
+    """
+    Finds the cached perceptual hashes within `distance` bits of a hash without scanning
+    the cache: the 64 bits are split into `distance + 1` bands, and two hashes that close
+    share at least one whole band, so only the hashes sharing a band are compared.
+    Entries the cache has evicted are dropped as they are met (and on rebuilds).
+    """
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.width = -(-64 // (distance + 1))
+        self._buckets = {}
+        self._hashes = set()
+        self._lock = threading.Lock()
+
+    def _bands(self, phash):
+        return [(start, (phash >> start) & ((1 << self.width) - 1)) for start in range(0, 64, self.width)]
+
+    def add(self, phash):
+        with self._lock:
+            if len(self._hashes) > 2 * FOOD_CACHE_SIZE:
+                # Mostly evicted entries: start over from the live ones
+                self._buckets.clear()
+                self._hashes.clear()
+                for key, _ in food_cache.items():
+                    if key.startswith("dhash:"):
+                        self._insert(int(key[6:], 16))
+            self._insert(phash)
+
+    def _insert(self, phash):
+        self._hashes.add(phash)
+        for band in self._bands(phash):
+            self._buckets.setdefault(band, set()).add(phash)
+
+    def _remove(self, phash):
+        self._hashes.discard(phash)
+        for band in self._bands(phash):
+            self._buckets.get(band, set()).discard(phash)
+
+    def find(self, phash):
+        """
+        Returns the cached food_items of the nearest close enough hash, or None.
+        """
+        with self._lock:
+            candidates = set().union(*(self._buckets.get(band, ()) for band in self._bands(phash)))
+        for candidate in sorted(candidates, key=lambda c: bin(c ^ phash).count("1")):
+            if bin(candidate ^ phash).count("1") > self.distance:
+                break
+            food_items = food_cache.get(f"dhash:{candidate:016x}")
+            if food_items is not None:
+                return food_items
+            with self._lock:
+                self._remove(candidate)
+        return None
+
+phash_index = PhashIndex(max(FOOD_CACHE_PHASH_DISTANCE, 0))
+
+def shared_food_items(digest):
+    """
+    Reads the food_items of an image (by sha256 hex digest) from the shared tier. Best
+    effort: a failure is a miss.
+    """
+    if FOOD_CACHE_SHARED != "firestore":
+        return None
+    try:
+        with instrumentation.upstream("food_store", "get"):
+            doc = clients.firestore_client().collection(FOOD_CACHE_COLLECTION).document(digest).get()
+    except Exception as e:
+        instrumentation.log("Food cache store read failed", severity="WARNING", key=digest, error=str(e))
+        return None
+    data = doc.to_dict() if doc.exists else None
+    if not data or data.get("expires_at", 0) < time.time():
+        return None
+    return data.get("food_items")
+
+def store_shared_food_items(digest, food_items):
+    if FOOD_CACHE_SHARED != "firestore":
+        return
+    try:
+        with instrumentation.upstream("food_store", "set"):
+            clients.firestore_client().collection(FOOD_CACHE_COLLECTION).document(digest).set(
+                {"food_items": list(food_items), "expires_at": time.time() + FOOD_CACHE_SHARED_TTL}
+            )
+    except Exception as e:
+        instrumentation.log("Food cache store write failed", severity="WARNING", key=digest, error=str(e))
+
+def validate_food_items(food_items):
+    """
+    Checks the parsed model answer: a list of non-empty food names.
+    """
+    if not isinstance(food_items, list) or not all(isinstance(item, str) for item in food_items):
+        raise ValueError("expected a list of food names")
+    return [item.strip() for item in food_items if item.strip()]
+
+def extract_food_items_local(jpeg_bytes):
+    """
+    Detects the foods of a (preprocessed) JPEG image with Gemini, in-process.
+    """
+    # Generate a JSON list of foods using the prompt and the image
+    contents = [
+        {
+            "role": "user",
+            "parts": [
+                {"text": PROMPT},
+                {"inline_data": {"mime_type": "image/jpeg", "data": jpeg_bytes}}
+            ]
+        }
+    ]
+    try:
+        # (the same photo scanned by several users at once is sent to the model once)
+        return llm_gateway.generate_json(
+            "extract_food", contents, FOOD_ITEMS_SCHEMA, validate_food_items, key=hashlib.sha256(jpeg_bytes).hexdigest()
+        )
+    except llm_gateway.LLMError as e:
+        raise FoodExtractionError(str(e)) from e
+
+def extract_food_items_remote(jpeg_bytes):
+    """
+    Detects the foods of a (preprocessed) JPEG image by calling the extract-food-from-image
+    function. The image is sent as a multipart file, without base64 inflation, with the
+    request id so both functions log the scan under the same id.
+    """
+    with instrumentation.upstream("extract_food", "remote"):
+        resp = clients.http_session("extract_food").post(
+            EXTRACT_FOOD_URL,
+            files={"image": ("image.jpg", jpeg_bytes, "image/jpeg")},
+            headers=instrumentation.outgoing_headers(),
+            timeout=EXTRACT_FOOD_TIMEOUT,
+        )
+    if resp.status_code == 503:
+        # The remote end is shedding load: pass its Retry-After on
+        raise upstream.UpstreamUnavailable("extract_food", "busy", int(resp.headers.get("Retry-After", 1)))
+    if resp.status_code != 200:
+        raise FoodExtractionError(f"extract_food_from_image cloud function error: {resp.status_code} - {resp.text}")
+    return resp.json().get("food_items", [])
+
+def cached_food_items(keys):
+    """
+    Looks an image up in the cache: exact keys first, then perceptual hashes
+    within FOOD_CACHE_PHASH_DISTANCE bits (through phash_index). Returns None on a miss.
+    """
+    for key in keys:
+        food_items = food_cache.get(key)
+        if food_items is not None:
+            return list(food_items)
+
+    phashes = [int(key[6:], 16) for key in keys if key.startswith("dhash:")]
+    if not phashes or FOOD_CACHE_PHASH_DISTANCE <= 0:
+        return None
+    food_items = phash_index.find(phashes[0])
+    return list(food_items) if food_items is not None else None
+
+def extract_food_items(image, mode=None):
+    """
+    Returns the list of food names visible in an image (raw bytes or base64 string),
+    from the cache when the same (or a nearly identical) image has been seen before.
+    """
+    with instrumentation.span("decode"):
+        image_bytes = decode_image(image)
+
+    # Exact repeat of an image: no need to decode it
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    keys = ["sha256:" + digest]
+    food_items = cached_food_items(keys)
+    if food_items is not None:
+        instrumentation.count("food_cache.hits")
+        return food_items
+
+    # Seen by another instance or function
+    food_items = shared_food_items(digest)
+    if food_items is not None:
+        instrumentation.count("food_cache.shared_hits")
+        food_cache.set(keys[0], list(food_items))
+        return list(food_items)
+
+    with instrumentation.span("decode"):
+        jpeg_bytes = preprocess_image(image_bytes)
+        phash = perceptual_hash(jpeg_bytes) if FOOD_CACHE_PHASH else None
+
+    if phash is not None:
+        keys.append("dhash:" + phash)
+        food_items = cached_food_items(keys[1:])
+        if food_items is not None:
+            instrumentation.count("food_cache.hits")
+            food_cache.set(keys[0], list(food_items))
+            return food_items
+    instrumentation.count("food_cache.misses")
+
+    mode = mode or FOOD_EXTRACTION_MODE
+    if mode == "remote":
+        food_items = extract_food_items_remote(jpeg_bytes)
+    elif mode == "local":
+        food_items = extract_food_items_local(jpeg_bytes)
+    else:
+        raise ValueError(f"Unknown FOOD_EXTRACTION_MODE: {mode}")
+
+    for key in keys:
+        food_cache.set(key, list(food_items))
+    if phash is not None:
+        phash_index.add(int(phash, 16))
+    store_shared_food_items(digest, food_items)
+    return food_items
@@ -0,0 +1,235 @@
+"""
+Request tracing, structured logs and upstream call metrics shared by the Python functions.
+
+`traced` wraps an entry point: the request gets an id (the caller's X-Request-Id, so a scan
+keeps the same id across the extract-nutrients -> extract-food-from-image hop, or a new
+one), the id is returned in the response headers, and one JSON line per request logs its
+status, latency and the time spent in each stage. Stages are timed with `span(stage)`, and
+upstream calls with `upstream(provider, operation)`, which also counts them and records
+their latency in the instance metrics (logged every METRICS_LOG_INTERVAL seconds).
+
+`log` writes one JSON line (the format Cloud Logging parses into severity, message and
+fields) with long strings, byte strings and lists truncated, so payloads never flood the
+logs.
+
+Each function is deployed from its own directory, so this module is copied into every
+function: keep all the copies identical.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# Log settings (characters per string value, items per list, seconds between metric logs)
+LOG_VALUE_CHARS = int(os.environ.get("LOG_VALUE_CHARS", "300"))
+LOG_LIST_ITEMS = int(os.environ.get("LOG_LIST_ITEMS", "20"))
+METRICS_LOG_INTERVAL = float(os.environ.get("METRICS_LOG_INTERVAL", "60"))
+
+# Upper bounds (ms) of the latency histogram buckets, the last one takes the rest
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Trace:
+    """
+    Stages of one request: total milliseconds and calls per stage. Stages may run in
+    parallel, so their sum can exceed the request latency.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + ms, calls + 1)
+
+    def stages_ms(self):
+        with self._lock:
+            return {stage: round(total, 1) for stage, (total, _) in self.stages.items()}
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+def request_id():
+    """
+    Returns the id of the current request (None outside a traced request).
+    """
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+def outgoing_headers():
+    """
+    Headers carrying the request id to another function.
+    """
+    current = request_id()
+    return {REQUEST_ID_HEADER: current} if current else {}
+
+def submit(executor, function, *args, **kwargs):
+    """
+    `executor.submit` running the call in a copy of the current context, so the spans and
+    logs of worker threads belong to the request that submitted them.
+    """
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+def truncate(value, limit=LOG_VALUE_CHARS):
+    """
+    Returns a loggable copy of `value`: long strings cut to `limit` characters, byte strings
+    replaced by their size and lists cut to LOG_LIST_ITEMS items, at any depth.
+    """
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}... (+{len(value) - limit} chars)"
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return {str(key): truncate(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [truncate(item, limit) for item in list(value)[:LOG_LIST_ITEMS]]
+        if len(value) > LOG_LIST_ITEMS:
+            items.append(f"... (+{len(value) - LOG_LIST_ITEMS} items)")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(str(value), limit)
+
+def log(message, severity="INFO", **fields):
+    """
+    Writes a structured log line with the request id and the (truncated) fields.
+    """
+    entry = {"severity": severity, "message": truncate(message)}
+    current = request_id()
+    if current:
+        entry["request_id"] = current
+    entry.update(truncate(fields))
+    print(json.dumps(entry))
+
+# Instance metrics: counters and latency histograms, shared by every request
+_counters = {}
+_histograms = {}
+_metrics_lock = threading.Lock()
+_metrics_logged_at = time.monotonic()
+
+def count(name, amount=1):
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe(name, ms):
+    """
+    Adds a latency (milliseconds) to the histogram `name`.
+    """
+    with _metrics_lock:
+        histogram = _histograms.setdefault(name, {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)})
+        histogram["count"] += 1
+        histogram["sum_ms"] += ms
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+        histogram["buckets"][index] += 1
+
+def metrics():
+    """
+    Returns the counters and histograms of the instance; histogram buckets are keyed by
+    their upper bound in ms.
+    """
+    bounds = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+    with _metrics_lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {
+                name: {
+                    "count": histogram["count"],
+                    "sum_ms": round(histogram["sum_ms"], 1),
+                    "buckets": {bound: n for bound, n in zip(bounds, histogram["buckets"]) if n},
+                }
+                for name, histogram in _histograms.items()
+            },
+        }
+
+def _log_metrics_if_due():
+    global _metrics_logged_at
+    with _metrics_lock:
+        if time.monotonic() - _metrics_logged_at < METRICS_LOG_INTERVAL:
+            return
+        _metrics_logged_at = time.monotonic()
+    print(json.dumps({"severity": "INFO", "message": "metrics", **metrics()}))
+
+@contextmanager
+def span(stage):
+    """
+    Times a stage of the current request (and the `stage.<stage>` histogram).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, ms)
+        observe(f"stage.{stage}", ms)
+
+def record(provider, operation, ms, error=False):
+    """
+    Records an upstream call made without `upstream` (e.g. one that handles its own errors).
+    """
+    name = f"{provider}.{operation}"
+    count(f"calls.{name}")
+    if error:
+        count(f"errors.{name}")
+    observe(f"latency.{name}", ms)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(provider, ms)
+
+@contextmanager
+def upstream(provider, operation):
+    """
+    Times an upstream call as the `provider` stage of the request and records it in the
+    `calls.`, `errors.` and `latency.<provider>.<operation>` metrics.
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(provider, operation, (time.perf_counter() - start) * 1000, error)
+
+def traced(entry_point):
+    """
+    Decorator of an HTTP entry point: request id, X-Request-Id response header, request
+    metrics and one summary log line per request.
+    """
+    name = entry_point.__name__
+
+    @functools.wraps(entry_point)
+    def wrapper(request):
+        from flask import make_response
+        trace = Trace(request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex)
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = make_response(entry_point(request))
+            status = response.status_code
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+            return response
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            count(f"requests.{name}")
+            if status >= 500:
+                count(f"errors.{name}")
+            observe(f"request.{name}", ms)
+            log(
+                "request", severity="ERROR" if status >= 500 else "INFO", function=name,
+                method=request.method, status=status, latency_ms=round(ms, 1), stages_ms=trace.stages_ms(),
+            )
+            _trace.reset(token)
+            _log_metrics_if_due()
+
+    return wrapper
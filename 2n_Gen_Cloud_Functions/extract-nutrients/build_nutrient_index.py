@@ -0,0 +1,146 @@
+"""
+Builds the offline nutrient index used by extract_nutrients from a USDA FoodData Central
+bulk export (Foundation and SR Legacy foods, CSV or JSON download).
+
+Usage:
+    python build_nutrient_index.py --csv FoodData_Central_foundation_food_csv/ \
+                                   --csv FoodData_Central_sr_legacy_food_csv/ \
+                                   --output nutrient_index
+    python build_nutrient_index.py --json FoodData_Central_foundation_food_json.json \
+                                   --json FoodData_Central_sr_legacy_food_json.json
+"""
+import argparse
+import csv
+import json
+import os
+import numpy as np
+from nutrient_index import name_key
+from nutrients import NUTRIENT_KEYS
+
+# FoodData Central nutrient ids for each column, in order of preference
+NUTRIENT_IDS = {
+    "kcal": (1008, 2048, 2047),
+    "protein_g": (1003,),
+    "fat_g": (1004, 1085),
+    "carbohydrate_g": (1005, 1050),
+    "saturated_fat_g": (1258,),
+    "fiber_g": (1079,),
+    "cholesterol_mg": (1253,),
+    "sugar_g": (2000, 1063),
+}
+
+# Data types kept from the CSV export (the full download also contains branded foods)
+CSV_DATA_TYPES = {"foundation_food", "sr_legacy_food"}
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrient_index")
+
+def nutrient_row(amounts):
+    """
+    Turns a {nutrient_id: amount} dict into a row following NUTRIENT_KEYS.
+    """
+    row = []
+    for key in NUTRIENT_KEYS:
+        value = 0.0
+        for nutrient_id in NUTRIENT_IDS[key]:
+            if nutrient_id in amounts:
+                value = amounts[nutrient_id]
+                break
+        row.append(value)
+    return row
+
+def read_csv_export(directory):
+    """
+    Yields (description, {nutrient_id: amount}) for every food of a CSV export directory.
+    """
+    wanted = {nutrient_id for ids in NUTRIENT_IDS.values() for nutrient_id in ids}
+
+    descriptions = {}
+    with open(os.path.join(directory, "food.csv"), newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            if record["data_type"] in CSV_DATA_TYPES:
+                descriptions[record["fdc_id"]] = record["description"]
+
+    amounts = {fdc_id: {} for fdc_id in descriptions}
+    with open(os.path.join(directory, "food_nutrient.csv"), newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            food_amounts = amounts.get(record["fdc_id"])
+            if food_amounts is None or not record["amount"]:
+                continue
+            nutrient_id = int(record["nutrient_id"])
+            if nutrient_id in wanted:
+                food_amounts[nutrient_id] = float(record["amount"])
+
+    for fdc_id, description in descriptions.items():
+        yield description, amounts[fdc_id]
+
+def read_json_export(path):
+    """
+    Yields (description, {nutrient_id: amount}) for every food of a JSON export file.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    # Foods live under "FoundationFoods" or "SRLegacyFoods" depending on the export
+    foods = []
+    for value in data.values():
+        if isinstance(value, list):
+            foods.extend(value)
+
+    for food in foods:
+        amounts = {}
+        for food_nutrient in food.get("foodNutrients", []):
+            nutrient_id = food_nutrient.get("nutrient", {}).get("id")
+            if nutrient_id is not None and food_nutrient.get("amount") is not None:
+                amounts[nutrient_id] = float(food_nutrient["amount"])
+        yield food["description"], amounts
+
+def build_index(foods, output):
+    """
+    Writes the nutrient matrix (`<output>.npy`) and the name lookup (`<output>.json`).
+    """
+    descriptions = []
+    rows = []
+    keys = {}
+    # Generic name (first part of the description, e.g. "Bananas" in "Bananas, raw") -> candidate rows
+    generic = {}
+
+    for description, amounts in foods:
+        row = len(rows)
+        descriptions.append(description)
+        rows.append(nutrient_row(amounts))
+        keys.setdefault(name_key(description), row)
+        generic.setdefault(name_key(description.split(",")[0]), []).append(row)
+
+    # Generic names point to their most plain variant (fewest qualifiers, then shortest)
+    for key, candidates in generic.items():
+        if key and key not in keys:
+            keys[key] = min(candidates, key=lambda r: (descriptions[r].count(","), len(descriptions[r]), r))
+    keys.pop("", None)
+
+    np.save(f"{output}.npy", np.asarray(rows, dtype=np.float32).reshape(-1, len(NUTRIENT_KEYS)))
+    with open(f"{output}.json", "w", encoding="utf-8") as f:
+        json.dump({"nutrients": list(NUTRIENT_KEYS), "descriptions": descriptions, "keys": keys}, f)
+
+    return len(rows), len(keys)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline USDA nutrient index.")
+    parser.add_argument("--csv", action="append", default=[], help="FoodData Central CSV export directory")
+    parser.add_argument("--json", action="append", default=[], help="FoodData Central JSON export file")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Index path, without extension")
+    args = parser.parse_args()
+
+    if not args.csv and not args.json:
+        parser.error("at least one --csv or --json export is required")
+
+    def all_foods():
+        for directory in args.csv:
+            yield from read_csv_export(directory)
+        for path in args.json:
+            yield from read_json_export(path)
+
+    n_foods, n_keys = build_index(all_foods(), args.output)
+    print(f"Nutrient index written to {args.output}.npy/.json: {n_foods} foods, {n_keys} names")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Image preprocessing before food detection: decode once, apply the EXIF orientation, cap the
+resolution, drop the metadata (EXIF, GPS...) and re-encode as JPEG within a size budget.
+
+Each function is deployed from its own directory, so this module is copied into every
+function that uses it: keep all the copies identical.
+"""
+import base64
+import io
+import os
+from PIL import Image, ImageOps
+
+# Preprocessing budget
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", "1024"))        # Pixels
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", "300000"))    # Encoded JPEG size
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))
+IMAGE_MIN_QUALITY = int(os.environ.get("IMAGE_MIN_QUALITY", "50"))
+
+def decode_image(image):
+    """
+    Returns the raw bytes of an image given as bytes or as a base64 string.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    return base64.b64decode(image)
+
+def read_request_image(request):
+    """
+    Returns the raw bytes of the image of a request, sent either as a multipart file
+    field "image" (no base64 inflation) or as a base64 string in the JSON body.
+    None if the request has no image.
+    """
+    if "image" in request.files:
+        return request.files["image"].read()
+    data = request.get_json(silent=True) or {}
+    if data.get("image"):
+        return decode_image(data["image"])
+    return None
+
+def read_request_images(request):
+    """
+    Returns the raw bytes of every image of a request: multipart files sent as "image" or
+    "images" (the field can repeat), or base64 strings in the JSON body ("images" list or a
+    single "image"). Empty list if the request has no image.
+    """
+    files = request.files.getlist("images") + request.files.getlist("image")
+    if files:
+        return [file.read() for file in files]
+    data = request.get_json(silent=True) or {}
+    images = data.get("images") or ([data["image"]] if data.get("image") else [])
+    if not isinstance(images, list):
+        images = [images]
+    return [decode_image(image) for image in images if image]
+
+def preprocess_image(image_bytes, max_side=IMAGE_MAX_SIDE, max_bytes=IMAGE_MAX_BYTES):
+    """
+    Returns the JPEG to upload for an image: at most `max_side` pixels per side, without
+    metadata and re-encoded with the highest quality that fits in `max_bytes`.
+    Images already within budget and without EXIF are returned untouched.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if (
+            image.format == "JPEG"
+            and max(image.size) <= max_side
+            and len(image_bytes) <= max_bytes
+            and not image.getexif()
+        ):
+            return image_bytes
+
+        # Let the JPEG decoder downscale while decoding (up to 8x cheaper than a full decode)
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    # Step the quality down until the encoded image fits the budget
+    quality = IMAGE_QUALITY
+    while True:
+        output = io.BytesIO()
+        # No exif/icc arguments, so no metadata is written
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        if output.tell() <= max_bytes or quality <= IMAGE_MIN_QUALITY:
+            return output.getvalue()
+        quality = max(IMAGE_MIN_QUALITY, quality - 10)
+
+def perceptual_hash(image_bytes):
+    """
+    Returns the 64-bit difference hash (dHash) of an image as hex, which survives
+    re-encoding and small resizes. None if the image can't be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Let the JPEG decoder downscale while decoding, the hash only needs 9x8 pixels
+            image.draft("L", (72, 64))
+            pixels = list(image.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
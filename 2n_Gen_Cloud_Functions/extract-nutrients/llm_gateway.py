@@ -0,0 +1,134 @@
+"""
+Single entry point for the Gemini calls of the Python functions.
+
+`generate_json` asks for schema-constrained JSON (response_mime_type + response_schema),
+parses it with the standard json parser and an optional validator, and retries a bounded
+number of times with exponential backoff on transient API errors and invalid outputs.
+Calls go through the `gemini` upstream provider (rate limit, single flight on `key`,
+circuit breaker, timeout); calls it rejects raise upstream.UpstreamUnavailable right away,
+without retries. Every attempt logs its call site, latency and token counts, and `stats()`
+aggregates them per call site, so LLM spend is visible in one place.
+
+Each function is deployed from its own directory, so this module is copied into every
+function that calls Gemini: keep all the copies identical.
+"""
+import json
+import os
+import threading
+import time
+import clients
+import instrumentation
+import upstream
+
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Call settings
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "2"))         # Retries after the first attempt
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "0.5"))     # Seconds before the first retry, doubled on each one
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))      # Seconds per attempt
+
+# API errors worth retrying (rate limit, server errors, timeouts)
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    """
+    Raised when the model can't be called (after retries).
+    """
+
+class LLMOutputError(LLMError):
+    """
+    Raised when the model keeps answering with output that doesn't validate.
+    """
+
+_stats = {}
+_lock = threading.Lock()
+
+def _record(call_site, **counters):
+    with _lock:
+        site = _stats.setdefault(call_site, {
+            "calls": 0, "attempts": 0, "failures": 0, "invalid_outputs": 0,
+            "prompt_tokens": 0, "output_tokens": 0, "latency_s": 0.0,
+        })
+        for name, value in counters.items():
+            site[name] += value
+
+def stats():
+    """
+    Returns the counters of every call site: calls, attempts, failures, invalid outputs,
+    token counts and total latency.
+    """
+    with _lock:
+        return {site: {**counters, "latency_s": round(counters["latency_s"], 3)} for site, counters in _stats.items()}
+
+def is_retryable(error):
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)  # grpc status codes are enums
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    return type(error).__name__ in ("DeadlineExceeded", "ServiceUnavailable", "ResourceExhausted",
+                                    "InternalServerError", "TimeoutError", "ConnectionError")
+
+def usage(response):
+    """
+    Returns the (prompt, output) token counts of a response (0 when not reported).
+    """
+    metadata = getattr(response, "usage_metadata", None)
+    return (getattr(metadata, "prompt_token_count", 0) or 0, getattr(metadata, "candidates_token_count", 0) or 0)
+
+def generate_json(call_site, contents, schema, validate=None, model=GEMINI_MODEL, retries=LLM_RETRIES, key=None):
+    """
+    Calls Gemini for a JSON answer following `schema` (an OpenAPI-style dict) and returns
+    it parsed, after `validate(value)` if given (which returns the value to use and raises
+    ValueError/TypeError to reject it). Transient errors and rejected outputs are retried
+    up to `retries` times. Concurrent calls with the same `key` (identifying the contents)
+    share one model call.
+    """
+    generation_config = {"response_mime_type": "application/json", "response_schema": schema}
+    gemini = upstream.provider("gemini", timeout=LLM_TIMEOUT)
+    _record(call_site, calls=1)
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        outcome = "ok"
+        prompt_tokens = output_tokens = 0
+        try:
+            response = gemini.call(call_site, lambda timeout: clients.gemini_model(model).generate_content(
+                contents, generation_config=generation_config, request_options={"timeout": timeout}
+            ), key=key)
+            prompt_tokens, output_tokens = usage(response)
+            try:
+                value = json.loads(response.text)
+                if validate is not None:
+                    value = validate(value)
+            except (ValueError, TypeError) as e:
+                outcome = "invalid"
+                error = LLMOutputError(f"{call_site}: invalid model output {response.text[:200]!r} ({e})")
+        except upstream.UpstreamUnavailable as e:
+            outcome = "unavailable"
+            error = e
+        except Exception as e:
+            outcome = "error"
+            error = e
+        latency = time.perf_counter() - start
+
+        _record(
+            call_site, attempts=1, prompt_tokens=prompt_tokens, output_tokens=output_tokens, latency_s=latency,
+            failures=outcome in ("error", "unavailable"), invalid_outputs=outcome == "invalid",
+        )
+        instrumentation.log(
+            "llm call", severity="INFO" if outcome == "ok" else "WARNING", llm_call=call_site, model=model,
+            attempt=attempt, outcome=outcome, latency_ms=round(latency * 1000),
+            prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+        )
+
+        if outcome == "ok":
+            return value
+        if outcome == "unavailable":
+            raise error
+        if attempt >= retries or (outcome == "error" and not is_retryable(error)):
+            if isinstance(error, LLMError):
+                raise error
+            raise LLMError(f"{call_site}: {error}") from error
+        time.sleep(LLM_BACKOFF * 2 ** attempt)
+        attempt += 1
@@ -1,17 +1,54 @@
 import functions_framework
 from flask import Request, jsonify
 import os
-import requests
-from google.cloud import firestore
-from datetime import datetime
-
-# Initialize Firestore client
-db = firestore.Client()
+from concurrent.futures import ThreadPoolExecutor, wait
+from nutrient_cache import MISSING, create_nutrient_cache, normalize_food_name
+from nutrient_index import load_nutrient_index
+import nutrients as nv
+import daily_tracking
+import food_extraction
+import image_preprocessing
+import instrumentation
+import upstream
+import clients
 
 # Load environment variables
-EXTRACT_FOOD_URL = os.environ.get("EXTRACT_FOOD_FROM_IMAGE_URL")
 USDA_API_KEY = os.environ.get("USDA_API_KEY")
 USDA_SEARCH_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+NUTRIENT_INDEX_PATH = os.environ.get(
+    "NUTRIENT_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrient_index")
+)
+
+# Lookup engine settings (per-item timeout in seconds, max parallel lookups)
+USDA_TIMEOUT = float(os.environ.get("USDA_TIMEOUT", "8"))
+USDA_MAX_WORKERS = int(os.environ.get("USDA_MAX_WORKERS", "8"))
+
+# Images accepted by a single (multi-image) scan
+MAX_SCAN_IMAGES = int(os.environ.get("MAX_SCAN_IMAGES", "8"))
+
+# Worker pool used to run all the lookups of a scan at once
+usda_executor = ThreadPoolExecutor(max_workers=USDA_MAX_WORKERS, thread_name_prefix="usda")
+
+# Worker pool detecting the foods of all the images of a scan at once
+detection_executor = ThreadPoolExecutor(max_workers=MAX_SCAN_IMAGES, thread_name_prefix="detect")
+
+def get_nutrient_cache():
+    """
+    Returns the two-tier cache of USDA results (in-process LRU + shared store).
+    """
+    return clients.get("nutrient_cache", lambda: create_nutrient_cache(clients.firestore_client()))
+
+def get_nutrient_index():
+    """
+    Returns the offline index of common foods built by build_nutrient_index.py (None if not built).
+    """
+    return clients.get("nutrient_index", lambda: load_nutrient_index(NUTRIENT_INDEX_PATH))
+
+def get_usda():
+    """
+    Returns the admission control of the USDA API (see upstream).
+    """
+    return upstream.provider("usda", timeout=USDA_TIMEOUT, concurrency=USDA_MAX_WORKERS)
 
 def query_usda(food_name):
     """
@@ -23,7 +60,15 @@ def query_usda(food_name):
         "pageSize": 1,
         "dataType": ["Foundation", "SR Legacy", "Branded"],
     }
-    response = requests.get(USDA_SEARCH_URL, params=params)
+    # Keep-alive session shared by every lookup and reused across warm invocations
+    usda_session = clients.http_session("usda", pool_size=USDA_MAX_WORKERS)
+    # (rate limited, and concurrent lookups of the same food share one call)
+    response = get_usda().call(
+        "search", lambda timeout: usda_session.get(USDA_SEARCH_URL, params=params, timeout=timeout),
+        key=normalize_food_name(food_name),
+    )
+    if upstream.failed_status(response.status_code):
+        raise upstream.UpstreamUnavailable("usda", f"status {response.status_code}")
     if response.status_code != 200:
         raise Exception(f"USDA API error: {response.status_code} - {response.text}")
     
@@ -34,16 +79,7 @@ def query_usda(food_name):
     food = data["foods"][0] # Use the first result
 
     # Initialize nutrient structure with default values
-    nutrients = {
-        "kcal": 0,
-        "protein_g": 0,
-        "fat_g": 0,
-        "carbohydrate_g": 0,
-        "saturated_fat_g": 0,
-        "fiber_g": 0,
-        "cholesterol_mg": 0,
-        "sugar_g": 0
-    }
+    nutrients = nv.empty_nutrients()
 
     # Parse each nutrient
     for nutrient in food.get("foodNutrients", []):
@@ -71,93 +107,166 @@ def query_usda(food_name):
 
     return nutrients
 
+def fetch_nutrients(food_name, nutrient_cache):
+    """
+    Resolves a food missing from the in-process cache: reads the shared store, then
+    looks it up in USDA on a miss and stores the result back.
+    """
+    nutrients = nutrient_cache.get_shared(food_name)
+    if nutrients is MISSING:
+        nutrients = query_usda(food_name)
+        nutrient_cache.set(food_name, nutrients)
+    return nutrients
+
+def lookup_nutrients(food_names):
+    """
+    Returns the nutrients of every food in the same order as `food_names`.
+    Foods are resolved from the offline index first, then from the in-process cache,
+    and the remaining ones are fetched concurrently (shared store read, USDA lookup and
+    store write in each task), so the scan only takes as long as the slowest food.
+    """
+    nutrient_index = get_nutrient_index()
+    nutrient_cache = get_nutrient_cache()
+
+    results = {}
+    futures = {}
+    for food in food_names:
+        if food in results or food in futures:
+            continue
+        if nutrient_index is not None:
+            nutrients = nutrient_index.lookup(food)
+            if nutrients is not None:
+                results[food] = nutrients
+                continue
+        # Serve from the local cache when possible, each distinct missing food is only fetched once
+        cached = nutrient_cache.get_local(food)
+        if cached is not MISSING:
+            results[food] = cached
+        else:
+            futures[food] = instrumentation.submit(usda_executor, fetch_nutrients, food, nutrient_cache)
+
+    if futures:
+        # All lookups share the same time budget since they run in parallel
+        usda = get_usda()
+        _, not_done = wait(futures.values(), timeout=usda.max_wait + usda.timeout)
+        for future in not_done:
+            future.cancel()
+
+        for food, future in futures.items():
+            if future in not_done:
+                raise upstream.UpstreamUnavailable("usda", f"lookup for '{food}' timed out")
+            results[food] = future.result()
+
+    return [results[food] for food in food_names]
+
+def detect_foods(images):
+    """
+    Detects the foods of every image concurrently. Returns one food list per image.
+    """
+    if len(images) == 1:
+        return [food_extraction.extract_food_items(images[0])]
+    futures = [instrumentation.submit(detection_executor, food_extraction.extract_food_items, image) for image in images]
+    return [future.result() for future in futures]
+
+def merge_foods(food_lists):
+    """
+    Deduplicates the foods of all the images (the same food seen in several photos of a
+    meal counts once). Returns the unique foods, named as first detected, and for each
+    image the indexes of its foods in that list.
+    """
+    foods = []
+    index = {}
+    image_foods = []
+    for food_items in food_lists:
+        rows = []
+        for food in food_items:
+            key = normalize_food_name(food)
+            if key not in index:
+                index[key] = len(foods)
+                foods.append(food)
+            if index[key] not in rows:
+                rows.append(index[key])
+        image_foods.append(rows)
+    return foods, image_foods
+
 @functions_framework.http
+@instrumentation.traced
 def extract_nutrients(request: Request):
     """
-    Cloud Function entry point. Extracts foods from a base64-encoded image,
-    queries nutrient info from the USDA API, and stores the totals in Firestore.
+    Cloud Function entry point. Extracts foods from one or several images of a meal (base64
+    JSON or multipart), queries nutrient info from the USDA API, and stores the totals in
+    Firestore. Foods seen in several images are looked up and counted once, and the whole
+    scan is a single write.
     """
     try:
-        # Parse the request
-        data = request.get_json()
-        if not data or 'image' not in data:
+        # Parse the request (JSON with base64 images, or multipart form with image files)
+        data = request.get_json(silent=True) or request.form.to_dict()
+        images = image_preprocessing.read_request_images(request)
+        if not images:
             return jsonify({"error": "Missing 'image' in request"}), 400
+        if len(images) > MAX_SCAN_IMAGES:
+            return jsonify({"error": f"At most {MAX_SCAN_IMAGES} images per scan"}), 400
             
         user_id = data.get("user_id")
         if not user_id:
             return jsonify({"error": "Missing 'user_id' in request"}), 400
 
-        image_base64 = data['image']
+        # Optional portion of each detected food in grams (USDA values are per 100 g)
+        portions = data.get("portions") if isinstance(data.get("portions"), dict) else {}
+        invalid = nv.invalid_portions(portions)
+        if invalid:
+            return jsonify({"error": "Portions must be non-negative numbers of grams", "foods": invalid}), 400
 
-        # 1. Calls extract_food_from_image
-        resp = requests.post(EXTRACT_FOOD_URL, json={"image": image_base64})
-        if resp.status_code != 200:
-            return jsonify({"error": "Error calling extract_food_from_image cloud function", "details": resp.text}), 500
-        food_items = resp.json().get("food_items", [])
+        # 1. Detects the foods in the images (in-process or via extract_food_from_image, see FOOD_EXTRACTION_MODE)
+        try:
+            food_lists = detect_foods(images)
+        except food_extraction.FoodExtractionError as e:
+            return jsonify({"error": "Error extracting food from image", "details": str(e)}), 500
+        food_items, image_foods = merge_foods(food_lists)
         
-        # Initialize totals
-        total_nutrients = {"kcal":0,"protein_g":0,"fat_g":0,"carbohydrate_g":0,"saturated_fat_g":0,"fiber_g":0,"cholesterol_mg":0,"sugar_g":0}
-
         if not food_items:
-            return jsonify({
-                "total_nutrients": total_nutrients,
+            response = {
+                "total_nutrients": nv.empty_nutrients(),
                 "breakdown": {},
                 "message": "No foods detected"
-            })
+            }
+            if len(images) > 1:
+                response["images"] = [{"food_items": [], "total_nutrients": nv.empty_nutrients()} for _ in images]
+            return jsonify(response)
 
-        breakdown = {}
+        # 2. Consult USDA once for each unique food and scale them by their portions
+        food_matrix = nv.scale(nv.to_matrix(lookup_nutrients(food_items)), nv.portion_scales(food_items, portions))
+        breakdown = {food: nv.to_dict(row) for food, row in zip(food_items, food_matrix)}
+        scan_total = nv.total(food_matrix)
+        scanned_food_nutrients = nv.to_dict(scan_total)
 
-        # 2. For each food, consult USDA and acumulate
-        for food in food_items:
-            nutrients = query_usda(food)
-            if nutrients is None:
-                # Default if no nutrient data is found
-                nutrients = {"kcal":0,"protein_g":0,"fat_g":0,"carbohydrate_g":0,"saturated_fat_g":0,"fiber_g":0,"cholesterol_mg":0,"sugar_g":0}
-
-            breakdown[food] = nutrients
-
-            for key in total_nutrients:
-                total_nutrients[key] += nutrients.get(key, 0)
-            scanned_food_nutrients = {k: round(v, 1) for k, v in total_nutrients.items()}
-
-        # 3. Store in Firestore
-        user_ref = db.collection("users").document(user_id)
-        existing_collections = list(user_ref.collections())
-        today_date = datetime.now().date()
-
-        updated = False
-
-        # Check if a collection for today already exists
-        for col in existing_collections:
-            try:
-                col_date = datetime.strptime(col.id, "%Y-%m-%dT%H:%M:%S").date()
-                if col_date == today_date:
-                    doc_ref = col.document("nutrients")
-                    existing_data = doc_ref.get().to_dict()
-                    if existing_data:
-                        # If already exists, add today’s nutrients to existing values
-                        for key in total_nutrients:
-                            total_nutrients[key] += existing_data.get(key, 0)
-                    rounded_total_nutrients = {k: round(v, 1) for k, v in total_nutrients.items()}
-                    doc_ref.set(rounded_total_nutrients)
-                    updated = True
-                    break
-            except ValueError:
-                continue
-        
-        # If today's collection doesn't exist, create new one
-        if not updated:
-            timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-            doc_ref = user_ref.collection(timestamp).document("nutrients")
-            rounded_total_nutrients = {k: round(v, 1) for k, v in total_nutrients.items()}
-            doc_ref.set(rounded_total_nutrients)   
+        instrumentation.log("nutrient cache", stats=get_nutrient_cache().stats())
+
+        # 3. Add the scan to today's totals in Firestore
+        daily_tracking.increment_day(clients.firestore_client(), user_id, nv.to_dict(scan_total))
 
         # Return result to client
-        return jsonify({
+        response = {
             "total_nutrients": scanned_food_nutrients,
             "breakdown": breakdown
-        })
+        }
+        if len(images) > 1:
+            # What each image shows on its own (a food in several images is in each of them)
+            rows = [row for foods in image_foods for row in foods]
+            scan_ids = [i for i, foods in enumerate(image_foods) for _ in foods]
+            image_totals = nv.totals_by_scan(food_matrix[rows], scan_ids, len(images))
+            response["images"] = [
+                {"food_items": [food_items[row] for row in foods], "total_nutrients": nv.to_dict(image_total)}
+                for foods, image_total in zip(image_foods, image_totals)
+            ]
+        return jsonify(response)
+
+    except upstream.UpstreamUnavailable as e:
+        # Overloaded or failing upstream: ask the client to retry later
+        instrumentation.log("extract_nutrients rejected", severity="WARNING", error=str(e))
+        return upstream.unavailable_response(e)
 
     except Exception as e:
-        # Catch and return any server-side error
+        # Catch, log and return any server-side error
+        instrumentation.log("extract_nutrients failed", severity="ERROR", error=str(e))
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import instrumentation
+from ttl_cache import TTLCache
+
+# Cache settings
+NUTRIENT_CACHE_BACKEND = os.environ.get("NUTRIENT_CACHE_BACKEND", "firestore")  # firestore | sqlite | none
+NUTRIENT_CACHE_COLLECTION = os.environ.get("NUTRIENT_CACHE_COLLECTION", "usda_cache")
+NUTRIENT_CACHE_PATH = os.environ.get("NUTRIENT_CACHE_PATH", "/tmp/usda_cache.sqlite3")
+NUTRIENT_CACHE_SIZE = int(os.environ.get("NUTRIENT_CACHE_SIZE", "2048"))
+NUTRIENT_CACHE_TTL = int(os.environ.get("NUTRIENT_CACHE_TTL", str(30 * 86400)))
+
+# Returned by lookups that hit neither tier
+MISSING = object()
+
+def normalize_food_name(food_name):
+    """
+    Builds the cache key of a food: lowercase, no punctuation, single spaces.
+    """
+    name = re.sub(r"[^\w\s]", " ", str(food_name).lower())
+    return " ".join(name.split())
+
+class FirestoreStore:
+    """
+    Shared tier backed by a Firestore collection (one document per food).
+    """
+
+    def __init__(self, db, collection=NUTRIENT_CACHE_COLLECTION):
+        self.collection = db.collection(collection)
+
+    def get(self, key):
+        doc = self.collection.document(key).get()
+        if not doc.exists:
+            return MISSING
+        data = doc.to_dict()
+        if data.get("expires_at", 0) < time.time():
+            return MISSING
+        return data.get("nutrients")
+
+    def set(self, key, nutrients, ttl):
+        self.collection.document(key).set({"nutrients": nutrients, "expires_at": time.time() + ttl})
+
+class SqliteStore:
+    """
+    Shared tier backed by a local SQLite file, used as a stand-in for Firestore in tests.
+    """
+
+    def __init__(self, path=NUTRIENT_CACHE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usda_cache (key TEXT PRIMARY KEY, nutrients TEXT, expires_at REAL)"
+            )
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT nutrients, expires_at FROM usda_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0])
+
+    def set(self, key, nutrients, ttl):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO usda_cache (key, nutrients, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(nutrients), time.time() + ttl),
+            )
+            self._conn.commit()
+
+class NutrientCache:
+    """
+    Two-tier cache for USDA lookups: an in-process LRU with TTL in front of a shared store.
+    Foods without USDA results are cached too (as None), so they don't hit the API again.
+    """
+
+    def __init__(self, store=None, maxsize=NUTRIENT_CACHE_SIZE, ttl=NUTRIENT_CACHE_TTL):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.store = store
+        self.ttl = ttl
+        self.store_hits = 0
+        self.store_misses = 0
+        self._lock = threading.Lock()  # Store reads run on the lookup workers
+
+    def get(self, food_name):
+        """
+        Returns the cached nutrients of a food (possibly None), or MISSING.
+        """
+        value = self.get_local(food_name)
+        if value is MISSING:
+            value = self.get_shared(food_name)
+        return value
+
+    def get_local(self, food_name):
+        """
+        Returns the nutrients of a food from the in-process tier only (no round trip), or MISSING.
+        """
+        key = normalize_food_name(food_name)
+        if not key:
+            return MISSING
+        return self.local.get(key, MISSING)
+
+    def get_shared(self, food_name):
+        """
+        Returns the nutrients of a food from the shared store (a hit is kept locally), or MISSING.
+        """
+        key = normalize_food_name(food_name)
+        if not key or self.store is None:
+            return MISSING
+
+        try:
+            with instrumentation.upstream("nutrient_store", "get"):
+                value = self.store.get(key)
+        except Exception as e:
+            # The shared tier is best effort, a failure is just a miss
+            instrumentation.log("Nutrient cache store read failed", severity="WARNING", key=key, error=str(e))
+            value = MISSING
+
+        with self._lock:
+            if value is MISSING:
+                self.store_misses += 1
+            else:
+                self.store_hits += 1
+        if value is not MISSING:
+            self.local.set(key, value)
+        return value
+
+    def set(self, food_name, nutrients):
+        """
+        Stores the nutrients of a food in both tiers.
+        """
+        key = normalize_food_name(food_name)
+        if not key:
+            return
+        self.local.set(key, nutrients)
+        if self.store is None:
+            return
+        try:
+            with instrumentation.upstream("nutrient_store", "set"):
+                self.store.set(key, nutrients, self.ttl)
+        except Exception as e:
+            instrumentation.log("Nutrient cache store write failed", severity="WARNING", key=key, error=str(e))
+
+    def stats(self):
+        """
+        Returns hit/miss counters of both tiers.
+        """
+        return {
+            "local": self.local.stats(),
+            "store": {"hits": self.store_hits, "misses": self.store_misses},
+        }
+
+def create_nutrient_cache(db=None):
+    """
+    Builds the cache configured by NUTRIENT_CACHE_BACKEND.
+    """
+    if NUTRIENT_CACHE_BACKEND == "firestore" and db is not None:
+        return NutrientCache(FirestoreStore(db))
+    if NUTRIENT_CACHE_BACKEND == "sqlite":
+        return NutrientCache(SqliteStore())
+    return NutrientCache()
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import numpy as np
+import instrumentation
+from nutrients import NUTRIENT_KEYS
+
+def tokenize(name):
+    """
+    Splits a food name into normalized tokens: lowercase, no punctuation, naive singular.
+    """
+    tokens = []
+    for token in re.sub(r"[^a-z0-9\s]", " ", str(name).lower()).split():
+        if len(token) > 3 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def name_key(name):
+    """
+    Builds the lookup key of a food name, independent of word order.
+    """
+    return " ".join(sorted(set(tokenize(name))))
+
+class NutrientIndex:
+    """
+    Read-only nutrient index built by build_nutrient_index.py.
+
+    `<path>.npy` holds the float32 nutrient matrix (one row per food, NUTRIENT_KEYS columns),
+    memory-mapped so only the rows actually used are paged in. `<path>.json` holds the
+    food descriptions and the name key -> row mapping.
+    """
+
+    def __init__(self, matrix, descriptions, keys):
+        self.matrix = matrix
+        self.descriptions = descriptions
+        self.keys = keys
+
+        # Inverted index token -> rows, used by the fuzzy fallback
+        self._tokens = {}
+        self._row_tokens = {}
+        for key, row in keys.items():
+            tokens = set(key.split())
+            self._row_tokens.setdefault(row, set()).update(tokens)
+            for token in tokens:
+                self._tokens.setdefault(token, set()).add(row)
+
+        # Tokens of each description's head, the food itself in USDA's "Food, qualifiers"
+        # naming ("Sauce" in "Sauce, pasta")
+        self._row_heads = {row: set(tokenize(descriptions[row].split(",")[0])) for row in self._row_tokens}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens the index at `path` (without extension).
+        """
+        matrix = np.load(f"{path}.npy", mmap_mode="r")
+        with open(f"{path}.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if tuple(meta["nutrients"]) != NUTRIENT_KEYS:
+            raise ValueError(f"Nutrient index {path} has unexpected columns: {meta['nutrients']}")
+        return cls(matrix, meta["descriptions"], meta["keys"])
+
+    def find_row(self, food_name):
+        """
+        Returns the matrix row of a food, or None if there is no good enough match.
+        """
+        key = name_key(food_name)
+        if not key:
+            return None
+
+        row = self.keys.get(key)
+        if row is not None:
+            return row
+
+        # Fuzzy fallback: a food whose description has every query token and whose head is
+        # part of the query ("Pasta" matches "Pasta, cooked" but not "Sauce, pasta"), the
+        # most generic (fewest tokens) first. Anything looser is left to USDA.
+        query = set(key.split())
+        if not all(t in self._tokens for t in query):
+            return None
+        candidates = set.intersection(*(self._tokens[t] for t in query))
+        candidates = [row for row in candidates if self._row_heads[row] <= query]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda row: (len(self._row_tokens[row]), row))
+
+    def lookup(self, food_name):
+        """
+        Returns the nutrients of a food with the same shape as query_usda, or None on a miss.
+        """
+        row = self.find_row(food_name)
+        if row is None:
+            return None
+        values = self.matrix[row]
+        return {key: round(float(value), 1) for key, value in zip(NUTRIENT_KEYS, values)}
+
+def load_nutrient_index(path):
+    """
+    Loads the index at `path`, or returns None if it hasn't been built.
+    """
+    if not os.path.exists(f"{path}.npy") or not os.path.exists(f"{path}.json"):
+        return None
+    try:
+        return NutrientIndex.load(path)
+    except Exception as e:
+        instrumentation.log("Could not load nutrient index", severity="WARNING", path=path, error=str(e))
+        return None
@@ -0,0 +1,94 @@
+import numpy as np
+
+# Fixed order of the nutrient vector (values per 100 g, as returned by USDA)
+NUTRIENT_KEYS = (
+    "kcal",
+    "protein_g",
+    "fat_g",
+    "carbohydrate_g",
+    "saturated_fat_g",
+    "fiber_g",
+    "cholesterol_mg",
+    "sugar_g",
+)
+
+# Grams the USDA nutrient values refer to
+REFERENCE_GRAMS = 100.0
+
+def empty_nutrients():
+    """
+    Returns a nutrient dict with every value set to 0.
+    """
+    return {key: 0 for key in NUTRIENT_KEYS}
+
+def to_vector(nutrients):
+    """
+    Converts a nutrient dict (or None) into a vector following NUTRIENT_KEYS.
+    """
+    if not nutrients:
+        return np.zeros(len(NUTRIENT_KEYS))
+    return np.array([nutrients.get(key, 0) for key in NUTRIENT_KEYS], dtype=float)
+
+def to_matrix(nutrients_list):
+    """
+    Stacks nutrient dicts into a (n_foods, n_nutrients) matrix.
+    """
+    if not nutrients_list:
+        return np.zeros((0, len(NUTRIENT_KEYS)))
+    return np.vstack([to_vector(nutrients) for nutrients in nutrients_list])
+
+def to_dict(vector):
+    """
+    Converts a nutrient vector back into a dict rounded to one decimal.
+    """
+    return {key: round(float(value), 1) for key, value in zip(NUTRIENT_KEYS, vector)}
+
+def invalid_portions(portions):
+    """
+    Returns the foods whose portion is not a finite, non-negative number of grams
+    (numeric strings are accepted).
+    """
+    invalid = []
+    for food, grams in portions.items():
+        try:
+            if isinstance(grams, bool) or not 0 <= float(grams) < float("inf"):
+                invalid.append(food)
+        except (TypeError, ValueError):
+            invalid.append(food)
+    return invalid
+
+def portion_scales(food_items, portions=None):
+    """
+    Returns the scale factor of each food given its portion in grams.
+    Foods without a portion keep the USDA reference amount (scale 1). Portions must have
+    passed `invalid_portions`.
+    """
+    portions = portions or {}
+    grams = np.array([float(portions.get(food, REFERENCE_GRAMS)) for food in food_items])
+    return grams / REFERENCE_GRAMS
+
+def scale(matrix, scales):
+    """
+    Scales each food row of `matrix` by its portion factor.
+    """
+    return matrix * np.asarray(scales, dtype=float)[:, None]
+
+def total(matrix, scales=None):
+    """
+    Sums the (optionally scaled) food rows of `matrix` into a single nutrient vector.
+    """
+    if scales is None:
+        return matrix.sum(axis=0)
+    return np.asarray(scales, dtype=float) @ matrix
+
+def totals_by_scan(matrix, scan_ids, n_scans, scales=None):
+    """
+    Sums the food rows of many scans in one pass, e.g. for backfills or multi-image meals.
+    `scan_ids[i]` is the scan (0..n_scans-1) food row `i` belongs to.
+    Returns a (n_scans, n_nutrients) matrix of per-scan totals.
+    """
+    if scales is not None:
+        matrix = scale(matrix, scales)
+    totals = np.zeros((n_scans, matrix.shape[1]))
+    np.add.at(totals, np.asarray(scan_ids, dtype=int), matrix)
+    return totals
@@ -1,58 +1,136 @@
 import functions_framework
 from flask import Request, jsonify
 import os
-import requests
+import re
+import food_extraction
+import image_preprocessing
+import instrumentation
+import upstream
+import clients
+from ttl_cache import TTLCache
 
 # Load environment variables
-EXTRACT_FOOD_URL = os.environ.get("EXTRACT_FOOD_FROM_IMAGE_URL")
 SPOONACULAR_API_KEY = os.environ["SPOONACULAR_API_KEY"]
-SPOONACULAR_SEARCH_URL = "https://api.spoonacular.com/recipes/complexSearch"
+SPOONACULAR_URL = os.environ.get("SPOONACULAR_URL", "https://api.spoonacular.com")  # Fake server in load tests
+SPOONACULAR_SEARCH_URL = f"{SPOONACULAR_URL}/recipes/complexSearch"
+SPOONACULAR_TIMEOUT = float(os.environ.get("SPOONACULAR_TIMEOUT", "10"))
 
-@functions_framework.http
-def get_recipe(request: Request):
-    try:
-        # Parse and validate request body
-        data = request.get_json()
-        if not data or 'image' not in data:
-            return jsonify({"error": "Missing 'image' in request"}), 400
-
-        image_base64 = data['image']
-
-        # 1. Calls extract_food_from_image cloud function
-        resp = requests.post(EXTRACT_FOOD_URL, json={"image": image_base64})
-        if resp.status_code != 200:
-            return jsonify({"error": "Error calling extract_food_from_image cloud function", "details": resp.text}), 500
-        food_items = resp.json().get("food_items", [])
-
-        # Spoonacular API setup
-        params = {
-            "includeIngredients": food_items,
-            "number": 1,
-            "addRecipeInformation": True,
-            "apiKey": SPOONACULAR_API_KEY
-        }
-        
-        # 2. Consults spoonacular
-        response = requests.get(SPOONACULAR_SEARCH_URL, params=params)
-        if response.status_code != 200:
-            return jsonify({"error": f"Spoonacular API error: {response.text}"}), 500
-
-        # Return first recipe or fallback
-        data = response.json()
-        results = data.get("results", [])
-        if not results:
-            return jsonify({"recipe": None, "message": "No recipes found"}), 200
-
-        recipe = results[0] # Get the top match
-        result = {
+# Recipes fetched per search, served one by one as "next recipe" pages
+RECIPE_PREFETCH = int(os.environ.get("RECIPE_PREFETCH", "5"))
+
+# Search result cache settings
+RECIPE_CACHE_SIZE = int(os.environ.get("RECIPE_CACHE_SIZE", "1024"))
+RECIPE_CACHE_TTL = int(os.environ.get("RECIPE_CACHE_TTL", str(6 * 3600)))
+
+# Top recipes by ingredient set, shared by every request of the instance
+recipe_cache = TTLCache(maxsize=RECIPE_CACHE_SIZE, ttl=RECIPE_CACHE_TTL)
+
+class SpoonacularError(Exception):
+    """
+    Raised when Spoonacular answers with an error.
+    """
+
+def normalize_ingredients(food_items):
+    """
+    Returns the ingredient set of a scan: lowercase, no punctuation, unique and sorted,
+    so the same foods detected in any order or casing share a cache entry.
+    """
+    names = {" ".join(re.sub(r"[^\w\s]", " ", str(item).lower()).split()) for item in food_items}
+    return sorted(name for name in names if name)
+
+def search_recipes(ingredients):
+    """
+    Returns the top RECIPE_PREFETCH recipes for a normalized ingredient set, from the
+    cache when the same set was searched before.
+    """
+    key = ",".join(ingredients)
+    recipes = recipe_cache.get(key)
+    if recipes is not None:
+        return recipes
+
+    # Spoonacular API setup
+    params = {
+        "includeIngredients": key,
+        "number": RECIPE_PREFETCH,
+        "addRecipeInformation": True,
+        "apiKey": SPOONACULAR_API_KEY
+    }
+
+    # Consults spoonacular (rate limited, concurrent searches of the same set share one call)
+    session = clients.http_session("spoonacular")
+    response = upstream.provider("spoonacular", timeout=SPOONACULAR_TIMEOUT).call(
+        "search", lambda timeout: session.get(SPOONACULAR_SEARCH_URL, params=params, timeout=timeout), key=key
+    )
+    if upstream.failed_status(response.status_code):
+        raise upstream.UpstreamUnavailable("spoonacular", f"status {response.status_code}")
+    if response.status_code != 200:
+        raise SpoonacularError(f"Spoonacular API error: {response.text}")
+
+    # Keep only the fields returned to the app
+    recipes = [
+        {
             "id": recipe.get("id"),
             "title": recipe.get("title"),
             "image": recipe.get("image"),
             "summary": recipe.get("summary")
         }
+        for recipe in response.json().get("results", [])
+    ]
+    recipe_cache.set(key, recipes)
+    return recipes
+
+@functions_framework.http
+@instrumentation.traced
+def get_recipe(request: Request):
+    try:
+        data = request.get_json(silent=True) or request.form.to_dict()
+
+        # "Next recipe" requests send back the ingredients of the first answer and the page
+        try:
+            page = int(data.get("page", 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'page' must be an integer"}), 400
+        food_items = data.get("ingredients")
+
+        if not food_items:
+            # Parse and validate request (JSON with a base64 image, or multipart form with an image file)
+            image_bytes = image_preprocessing.read_request_image(request)
+            if image_bytes is None:
+                return jsonify({"error": "Missing 'image' in request"}), 400
+
+            # 1. Detects the foods in the image (in-process or via extract_food_from_image, see FOOD_EXTRACTION_MODE)
+            try:
+                food_items = food_extraction.extract_food_items(image_bytes)
+            except food_extraction.FoodExtractionError as e:
+                return jsonify({"error": "Error extracting food from image", "details": str(e)}), 500
+        elif isinstance(food_items, str):
+            food_items = food_items.split(",")
+
+        # 2. Consults spoonacular (or the cache) for the top recipes of these ingredients
+        ingredients = normalize_ingredients(food_items)
+        try:
+            recipes = search_recipes(ingredients)
+        except SpoonacularError as e:
+            return jsonify({"error": str(e)}), 500
+
+        # Return the requested recipe or fallback
+        if not 0 <= page < len(recipes):
+            message = "No recipes found" if not recipes else "No more recipes"
+            return jsonify({"recipe": None, "message": message, "ingredients": ingredients}), 200
+
+        return jsonify({
+            "recipe": recipes[page],
+            "ingredients": ingredients,
+            "page": page,
+            "has_more": page + 1 < len(recipes)
+        }), 200
 
-        return jsonify({"recipe": result}), 200
+    except upstream.UpstreamUnavailable as e:
+        # Overloaded or failing upstream: ask the client to retry later
+        instrumentation.log("get_recipe rejected", severity="WARNING", error=str(e))
+        return upstream.unavailable_response(e)
 
     except Exception as e:
-        # # Catch and return any server-side error
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        # Catch, log and return any server-side error
+        instrumentation.log("get_recipe failed", severity="ERROR", error=str(e))
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import instrumentation
+
+# Cache settings
+TTS_CACHE_BACKEND = os.environ.get("TTS_CACHE_BACKEND", "disk")  # disk | gcs | none
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "/tmp/tts_cache")
+TTS_CACHE_MAX_MB = float(os.environ.get("TTS_CACHE_MAX_MB", "64"))  # Disk cache size cap
+TTS_CACHE_BUCKET = os.environ.get("TTS_CACHE_BUCKET")
+TTS_CACHE_PREFIX = os.environ.get("TTS_CACHE_PREFIX", "tts_cache/")
+
+def audio_key(text, voice):
+    """
+    Builds the cache key of a synthesized text: hash of the voice settings and the text.
+    """
+    return hashlib.sha256(f"{voice}\n{text}".encode("utf-8")).hexdigest()
+
+class DiskStore:
+    """
+    Blob store backed by a local directory, used as a stand-in for Cloud Storage in
+    local runs. On Cloud Functions /tmp is in memory and private to the instance, so the
+    files are capped at `max_bytes`, evicting the least recently used ones.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=int(TTS_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+        # key -> size, least recently used first (files left by an earlier run by mtime)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".mp3"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len(".mp3")], stat.st_size))
+        self._sizes = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self._sizes.values())
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return audio
+
+    def set(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        # Write to a temporary file and rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self.size += len(audio) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(audio)
+            self._evict()
+
+class GcsStore:
+    """
+    Blob store backed by a Cloud Storage bucket, shared by every instance.
+    """
+
+    def __init__(self, bucket=TTS_CACHE_BUCKET, prefix=TTS_CACHE_PREFIX):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket)
+        self.prefix = prefix
+
+    def get(self, key):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self.bucket.blob(f"{self.prefix}{key}.mp3").download_as_bytes()
+        except NotFound:
+            return None
+
+    def set(self, key, audio):
+        self.bucket.blob(f"{self.prefix}{key}.mp3").upload_from_string(audio, content_type="audio/mpeg")
+
+class AudioCache:
+    """
+    Content-addressed cache of synthesized audio in front of a blob store.
+    The store is best effort: any failure is treated as a miss.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached audio of a key, or None.
+        """
+        audio = None
+        if self.store is not None:
+            try:
+                with instrumentation.upstream("audio_store", "get"):
+                    audio = self.store.get(key)
+            except Exception as e:
+                instrumentation.log("Audio cache read failed", severity="WARNING", key=key, error=str(e))
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return audio
+
+    def set(self, key, audio):
+        if self.store is None:
+            return
+        try:
+            with instrumentation.upstream("audio_store", "set"):
+                self.store.set(key, audio)
+        except Exception as e:
+            instrumentation.log("Audio cache write failed", severity="WARNING", key=key, error=str(e))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def create_audio_cache():
+    """
+    Builds the cache configured by TTS_CACHE_BACKEND.
+    """
+    if TTS_CACHE_BACKEND == "gcs" and TTS_CACHE_BUCKET:
+        return AudioCache(GcsStore())
+    if TTS_CACHE_BACKEND == "disk":
+        return AudioCache(DiskStore())
+    return AudioCache()
@@ -1,25 +1,73 @@
 import functions_framework
-from google.cloud import texttospeech
+from flask import Response
 import base64
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import clients
+import instrumentation
+import upstream
+from audio_cache import audio_key, create_audio_cache
 
-@functions_framework.http
-def text_to_speech(request):
-    # Parse JSON body from the request
-    request_json = request.get_json()
-    if not request_json or 'text' not in request_json:
-        return 'No text provided', 400
+# Synthesis settings (characters per segment, parallel synthesis requests)
+TTS_SEGMENT_CHARS = int(os.environ.get("TTS_SEGMENT_CHARS", "1000"))
+TTS_MAX_WORKERS = int(os.environ.get("TTS_MAX_WORKERS", "4"))
+TTS_LANGUAGE_CODE = "en-US"
 
-    text_input = request_json['text']
+# Worker pool synthesizing the segments of a text at once
+tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
+def get_audio_cache():
+    """
+    Returns the cache of synthesized segments (see TTS_CACHE_BACKEND).
+    """
+    return clients.get("audio_cache", create_audio_cache)
 
-    # Initialize Google Text-to-Speech client
-    client = texttospeech.TextToSpeechClient()
+def split_segments(text, max_chars=TTS_SEGMENT_CHARS):
+    """
+    Splits a text into sentence-aligned segments of at most `max_chars` characters.
+    The first sentence gets a segment of its own, so the first audio is ready sooner.
+    """
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text.strip()) if s]
+
+    # Sentences longer than a segment are cut at the last space that fits
+    pieces = []
+    for sentence in sentences:
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+
+    segments = pieces[:1]
+    for piece in pieces[1:]:
+        if len(segments) > 1 and len(segments[-1]) + 1 + len(piece) <= max_chars:
+            segments[-1] += " " + piece
+        else:
+            segments.append(piece)
+    return segments
+
+def synthesize_segment(segment):
+    """
+    Returns the MP3 audio of a segment, from the cache when it was synthesized before.
+    """
+    from google.cloud import texttospeech
+
+    # Same text with the same voice always gives the same audio
+    key = audio_key(segment, f"{TTS_LANGUAGE_CODE}/NEUTRAL/MP3")
+    audio_cache = get_audio_cache()
+    audio = audio_cache.get(key)
+    if audio is not None:
+        return audio
 
     # Set the text input for synthesis
-    synthesis_input = texttospeech.SynthesisInput(text=text_input)
+    synthesis_input = texttospeech.SynthesisInput(text=segment)
 
     # Configure voice parameters: language and gender
     voice = texttospeech.VoiceSelectionParams(
-        language_code="en-US",
+        language_code=TTS_LANGUAGE_CODE,
         ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL
     )
 
@@ -28,13 +76,60 @@ def text_to_speech(request):
         audio_encoding=texttospeech.AudioEncoding.MP3
     )
 
-    # Perform the text-to-speech request
-    response = client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
-    )
+    # Perform the text-to-speech request (client created once per instance, the same
+    # segment requested concurrently is synthesized once)
+    response = upstream.provider("tts").call("synthesize", lambda timeout: clients.tts_client().synthesize_speech(
+        input=synthesis_input, voice=voice, audio_config=audio_config, timeout=timeout
+    ), key=key)
+
+    audio_cache.set(key, response.audio_content)
+    return response.audio_content
+
+def wants_stream(request, request_json):
+    """
+    Whether the client asked for the binary MP3 instead of base64 JSON: `?format=mp3`,
+    `"stream": true` in the body or an `Accept: audio/mpeg` header.
+    """
+    if request.args.get("format") == "mp3" or request_json.get("stream") is True:
+        return True
+    return request.accept_mimetypes.best_match(["application/json", "audio/mpeg"]) == "audio/mpeg"
+
+@functions_framework.http
+@instrumentation.traced
+def text_to_speech(request):
+    # Parse JSON body from the request
+    request_json = request.get_json(silent=True)
+    if not request_json or 'text' not in request_json:
+        return 'No text provided', 400
+
+    text_input = request_json['text']
+
+    # Synthesize all the segments in parallel (MP3 segments can simply be concatenated)
+    segments = split_segments(text_input)
+    if not segments:
+        return 'No text provided', 400
+    futures = [instrumentation.submit(tts_executor, synthesize_segment, segment) for segment in segments]
+
+    # Overload is reported before any audio is sent (a later segment failing cuts the stream)
+    try:
+        first = futures[0].result()
+        if wants_stream(request, request_json):
+            # Send each segment as soon as it (and the ones before it) is ready
+            def generate():
+                yield first
+                for future in futures[1:]:
+                    yield future.result()
+            return Response(generate(), mimetype="audio/mpeg")
+
+        audio = b"".join([first] + [future.result() for future in futures[1:]])
+    except upstream.UpstreamUnavailable as e:
+        for future in futures:
+            future.cancel()
+        instrumentation.log("text_to_speech rejected", severity="WARNING", error=str(e))
+        return upstream.unavailable_response(e)
 
     # Encode the resulting audio content as base64 string
-    audio_content = base64.b64encode(response.audio_content).decode('utf-8')
+    audio_content = base64.b64encode(audio).decode('utf-8')
 
      # Return the audio content in JSON response
-    return {'audio_base64': audio_content}
\ No newline at end of file
+    return {'audio_base64': audio_content}
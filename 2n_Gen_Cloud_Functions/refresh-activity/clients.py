@@ -0,0 +1,144 @@
+"""
+Memoized, thread-safe clients shared by the Python Cloud Functions.
+
+Clients are created on first use and then reused by every request of the instance, and
+heavy SDKs are only imported when their client is first needed, which keeps them out of
+the cold start of the functions that don't use them. Benchmarks and local runs can swap
+any client for a fake with `override`.
+
+Each function is deployed from its own directory, so this module is copied into every
+function: keep all the copies identical.
+"""
+import os
+import threading
+
+_instances = {}
+_lock = threading.Lock()
+_creation_locks = {}
+_MISSING = object()
+
+def _creation_lock(name):
+    with _lock:
+        return _creation_locks.setdefault(name, threading.Lock())
+
+def get(name, factory):
+    """
+    Returns the client registered as `name`, creating it with `factory()` on first use.
+    Each name is created under its own lock, so factories can get other clients (e.g. the
+    nutrient cache gets the Firestore client) and a slow client doesn't hold up the others.
+    """
+    instance = _instances.get(name, _MISSING)
+    if instance is _MISSING:
+        with _creation_lock(name):
+            instance = _instances.get(name, _MISSING)
+            if instance is _MISSING:
+                instance = factory()
+                with _lock:
+                    _instances[name] = instance
+    return instance
+
+def override(name, instance):
+    """
+    Replaces the client registered as `name` (e.g. with a fake).
+    """
+    with _lock:
+        _instances[name] = instance
+
+def reset(name=None):
+    """
+    Forgets one client (or all of them), so it is created again on next use.
+    """
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+def firestore_client():
+    """
+    Returns the Firestore client.
+    """
+    def create():
+        from google.cloud import firestore
+        return firestore.Client()
+    return get("firestore", create)
+
+def http_session(name="default", pool_size=10):
+    """
+    Returns a keep-alive requests session whose connection pool is reused across requests.
+    """
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return get(f"http_session:{name}", create)
+
+def gemini_model(model_name="gemini-1.5-flash"):
+    """
+    Returns a Gemini model, configuring the SDK with GOOGLE_API_KEY on first use.
+    """
+    def create():
+        import google.generativeai as genai
+        if os.environ.get("GOOGLE_API_KEY"):
+            genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        return genai.GenerativeModel(model_name)
+    return get(f"gemini:{model_name}", create)
+
+def tts_client():
+    """
+    Returns the Cloud Text-to-Speech client.
+    """
+    def create():
+        from google.cloud import texttospeech
+        return texttospeech.TextToSpeechClient()
+    return get("tts", create)
+
+def storage_client():
+    """
+    Returns the Cloud Storage client.
+    """
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return get("storage", create)
+
+def assemblyai():
+    """
+    Returns the AssemblyAI SDK module, configured with ASSEMBLYAI_API_KEY.
+    """
+    def create():
+        import assemblyai as aai
+        aai.settings.api_key = os.environ["ASSEMBLYAI_API_KEY"]
+        return aai
+    return get("assemblyai", create)
+
+def fitness_discovery_document():
+    """
+    Returns the Fitness API v1 discovery document bundled with google-api-python-client,
+    so building the service never fetches it over the network.
+    """
+    def create():
+        from googleapiclient import discovery_cache
+        return discovery_cache.get_static_doc("fitness", "v1")
+    return get("fitness_discovery", create)
+
+def fitness_service(credentials, timeout=None):
+    """
+    Returns a Fitness API client for the given user credentials, whose requests time out
+    after `timeout` seconds. Only the (cheap) per-user objects are built on each call.
+    """
+    factory = get("fitness_factory", _fitness_factory)
+    return factory(credentials, timeout)
+
+def _fitness_factory():
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    document = fitness_discovery_document()
+    return lambda credentials, timeout: build_from_document(
+        document, http=google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
+    )
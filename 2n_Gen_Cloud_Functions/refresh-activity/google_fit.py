@@ -0,0 +1,143 @@
+"""
+Incremental sync of a user's Google Fit activity into today's day document.
+
+Each sync only aggregates the window since the user's watermark (`fit_synced_until`,
+stored in the day document, so it starts again at midnight every day) and adds the
+deltas to the day totals with one increment write.
+
+Fit data can arrive late (the phone syncs in batches), so the last FIT_SETTLE_MINUTES are
+not final yet: one aggregate call returns two buckets, the settled one (added for good and
+moving the watermark) and the recent tail, which is re-read on every sync and kept in
+`fit_pending` so only its change is added.
+
+The deltas depend on the watermark read, so the write is conditional on the day document
+not having changed since (`increment_day(read=)`): when two syncs of a user overlap, the
+later write fails and that sync starts over from the new watermark instead of adding the
+same activity twice (up to FIT_SYNC_ATTEMPTS times).
+
+Each function is deployed from its own directory, so this module is copied into every
+function that uses it: keep all the copies identical.
+"""
+import os
+import time
+from datetime import datetime, timezone
+import daily_tracking
+import instrumentation
+import upstream
+
+FIT_SETTLE_MINUTES = int(os.environ.get("FIT_SETTLE_MINUTES", "15"))
+FIT_SYNC_ATTEMPTS = int(os.environ.get("FIT_SYNC_ATTEMPTS", "5"))
+
+# Totals kept in the day document -> aggregated Fit data type
+FIT_DATA_TYPES = {
+    "steps": "com.google.step_count.delta",
+    "distance_m": "com.google.distance.delta",
+    "kcal": "com.google.calories.expended",
+}
+
+# Total -> day document field
+FIT_FIELDS = {"steps": "fit_steps", "distance_m": "fit_distance_m", "kcal": "fit_kcal"}
+
+WATERMARK_FIELD = "fit_synced_until"
+PENDING_FIELD = "fit_pending"
+
+def day_start_millis(day):
+    """
+    Milliseconds since epoch of the (UTC) midnight starting `day`.
+    """
+    midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return int(midnight.timestamp() * 1000)
+
+def empty_totals():
+    return {total: 0 for total in FIT_DATA_TYPES}
+
+def aggregate_body(start_ms, settle_ms, end_ms):
+    """
+    Aggregate request of the window [start_ms, end_ms): a first bucket up to settle_ms
+    and a second one with the tail (a single bucket if nothing has settled). Buckets have a
+    fixed size, so the settled part must not be shorter than the tail.
+    """
+    duration = settle_ms - start_ms if settle_ms > start_ms else end_ms - start_ms
+    return {
+        "aggregateBy": [{"dataTypeName": data_type} for data_type in FIT_DATA_TYPES.values()],
+        "bucketByTime": {"durationMillis": max(duration, 1)},
+        "startTimeMillis": start_ms,
+        "endTimeMillis": end_ms,
+    }
+
+def bucket_totals(bucket):
+    """
+    Sums the points of a bucket into {total: amount}.
+    """
+    totals = empty_totals()
+    for dataset in bucket.get("dataset", []):
+        source = dataset.get("dataSourceId", "")
+        for total, data_type in FIT_DATA_TYPES.items():
+            if data_type.split(".", 2)[2] in source:
+                for point in dataset.get("point", []):
+                    for value in point.get("value", [])[:1]:
+                        totals[total] += value.get("fpVal", value.get("intVal", 0))
+    return totals
+
+def split_buckets(response, settle_ms):
+    """
+    Returns the (settled, pending) totals of an aggregate response.
+    """
+    settled, pending = empty_totals(), empty_totals()
+    for bucket in response.get("bucket", []):
+        target = settled if int(bucket.get("startTimeMillis", 0)) < settle_ms else pending
+        for total, amount in bucket_totals(bucket).items():
+            target[total] += amount
+    return settled, pending
+
+def sync_user(db, fitness_service, user_id, now_ms=None):
+    """
+    Adds the Fit activity since the user's watermark to today's day document and returns
+    a compact summary of the day. `burnt_kcal` grows by the same kcal delta.
+    """
+    for attempt in range(FIT_SYNC_ATTEMPTS):
+        try:
+            return sync_once(db, fitness_service, user_id, now_ms)
+        except daily_tracking.DayChanged:
+            # Another write landed between the read and the write: read again
+            instrumentation.count("fit_sync.conflicts")
+            if attempt == FIT_SYNC_ATTEMPTS - 1:
+                raise
+
+def sync_once(db, fitness_service, user_id, now_ms=None):
+    """
+    One read, aggregate and write of `sync_user`; raises DayChanged if the day document
+    changed before the write.
+    """
+    today = daily_tracking.today()
+    now_ms = now_ms or int(time.time() * 1000)
+    snapshot = daily_tracking.get_day_snapshot(db, user_id, today)
+    day = snapshot.to_dict() or {}
+
+    start_ms = max(day.get(WATERMARK_FIELD) or 0, day_start_millis(today))
+    settle_ms = now_ms - FIT_SETTLE_MINUTES * 60 * 1000
+    if settle_ms - start_ms < now_ms - settle_ms:
+        # The settled part must be at least as long as the tail, so the two fixed-size
+        # buckets cover the window; until then everything stays provisional
+        settle_ms = start_ms
+    old_pending = {**empty_totals(), **(day.get(PENDING_FIELD) or {})}
+
+    settled, pending = empty_totals(), empty_totals()
+    if now_ms > start_ms:
+        # (rate limited and behind the Fit circuit breaker; the timeout is the service's)
+        request = fitness_service.users().dataset().aggregate(userId="me", body=aggregate_body(start_ms, settle_ms, now_ms))
+        response = upstream.provider("fit").call("aggregate", lambda timeout: request.execute())
+        settled, pending = split_buckets(response, settle_ms)
+
+    deltas = {total: settled[total] + pending[total] - old_pending[total] for total in FIT_DATA_TYPES}
+    increments = {FIT_FIELDS[total]: amount for total, amount in deltas.items()}
+    increments["burnt_kcal"] = deltas["kcal"]
+    daily_tracking.increment_day(
+        db, user_id, increments, day=today, read=snapshot,
+        fields={WATERMARK_FIELD: settle_ms, PENDING_FIELD: pending},
+    )
+
+    summary = {"date": daily_tracking.day_id(today), "synced_until": now_ms, "window_ms": now_ms - start_ms}
+    for total, amount in deltas.items():
+        summary[total] = round((day.get(FIT_FIELDS[total]) or 0) + amount, 1)
+    return summary
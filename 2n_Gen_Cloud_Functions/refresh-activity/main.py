@@ -0,0 +1,23 @@
+import functions_framework
+import os
+from refresher import Refresher, REFRESH_WORKERS
+import instrumentation
+import clients
+
+# Seconds after which a run stops (must be below the function timeout)
+REFRESH_TIME_BUDGET = float(os.environ.get("REFRESH_TIME_BUDGET", "480"))
+
+@functions_framework.http
+@instrumentation.traced
+def refresh_activity(request):
+    # Options can be passed as query parameters or in a JSON body
+    options = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    workers = int(options.get("workers", REFRESH_WORKERS))
+
+    # Sync today's Google Fit activity of every user with a stored refresh token
+    refresher = Refresher(clients.firestore_client(), workers=workers, time_budget=REFRESH_TIME_BUDGET)
+    report = refresher.run()
+    instrumentation.log("Refresh report", report=report)
+
+    # Return the counts and throughput of the run
+    return report, 200
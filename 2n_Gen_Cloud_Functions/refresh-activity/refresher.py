@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import clients
+import google_fit
+import instrumentation
+import upstream
+
+# Refresher settings
+REFRESH_PAGE_SIZE = 300     # Users fetched per page (each page is split into worker shards)
+REFRESH_WORKERS = 16        # Parallel user shards (bounds the concurrent Fitness API calls)
+REFRESH_RETRIES = 3         # Retries per user after the first attempt
+REFRESH_BACKOFF = 0.5       # Seconds before the first retry, doubled on each one
+
+# One document per user holding the Google Fit refresh token ({"refresh_token": ...})
+FIT_TOKENS_COLLECTION = "fit_tokens"
+
+# OAuth client the refresh tokens were issued to
+FIT_CLIENT_ID = os.environ.get("FIT_CLIENT_ID")
+FIT_CLIENT_SECRET = os.environ.get("FIT_CLIENT_SECRET")
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+# HTTP statuses worth retrying
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def is_retryable(error):
+    """
+    Rate limits, server errors and network errors are retried; revoked or invalid
+    tokens (RefreshError) and other API errors are not.
+    """
+    if type(error).__name__ == "RefreshError":
+        return False
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        return int(status) in RETRYABLE_STATUSES
+    return True
+
+def user_credentials(refresh_token):
+    """
+    Credentials of a user from their refresh token; the access token is fetched on first use.
+    """
+    from google.oauth2.credentials import Credentials
+    return Credentials(
+        token=None,
+        refresh_token=refresh_token,
+        client_id=FIT_CLIENT_ID,
+        client_secret=FIT_CLIENT_SECRET,
+        token_uri=TOKEN_URI,
+    )
+
+class Refresher:
+    """
+    Syncs the Google Fit activity of every user with a stored refresh token into their
+    day document (see google_fit.sync_user).
+
+    Users are read in pages ordered by id and each page is split into shards processed
+    by a bounded worker pool. Failed users are retried with exponential backoff and
+    jitter. Each user's day document is written on its own, conditionally on the read
+    its deltas come from (see google_fit), so a sync from the app at the same time can't
+    add the same activity twice.
+    A run stops after `time_budget` seconds (the next run starts over, syncs are
+    incremental so already refreshed users cost one small query).
+    """
+
+    def __init__(self, db, workers=REFRESH_WORKERS, page_size=REFRESH_PAGE_SIZE,
+                 retries=REFRESH_RETRIES, backoff=REFRESH_BACKOFF, time_budget=None):
+        self.db = db
+        self.workers = workers
+        self.page_size = page_size
+        self.retries = retries
+        self.backoff = backoff
+        self.time_budget = time_budget
+
+        self._lock = threading.Lock()
+        self.users = 0
+        self.refreshed = 0
+        self.failed = {}
+        self.retried = 0
+
+    def token_pages(self):
+        """
+        Yields the (user id, refresh token) pairs in pages of `page_size`, ordered by id.
+        """
+        tokens_ref = self.db.collection(FIT_TOKENS_COLLECTION)
+        start_after = None
+        while True:
+            query = tokens_ref.order_by("__name__").limit(self.page_size)
+            if start_after is not None:
+                query = query.start_after({"__name__": start_after})
+            page = [(doc.id, (doc.to_dict() or {}).get("refresh_token")) for doc in query.stream()]
+            if not page:
+                return
+            yield page
+            if len(page) < self.page_size:
+                return
+            start_after = page[-1][0]
+
+    def refresh_user(self, user_id, refresh_token):
+        """
+        Syncs one user, retrying transient failures. Returns None or the failure reason.
+        """
+        if not refresh_token:
+            return "no_token"
+        retried = 0
+        reason = None
+        while True:
+            try:
+                fitness_service = clients.fitness_service(
+                    user_credentials(refresh_token), timeout=upstream.provider("fit").timeout
+                )
+                google_fit.sync_user(self.db, fitness_service, user_id)
+                break
+            except Exception as e:
+                if retried >= self.retries or not is_retryable(e):
+                    instrumentation.log("Refresh failed", severity="WARNING", user_id=user_id, error=str(e))
+                    reason = type(e).__name__
+                    break
+                if isinstance(e, upstream.UpstreamUnavailable):
+                    # Rejected by the Fit admission control: wait as long as it asks
+                    time.sleep(e.retry_after)
+                else:
+                    # Exponential backoff with full jitter
+                    time.sleep(random.uniform(0, self.backoff * 2 ** retried))
+                retried += 1
+
+        with self._lock:
+            self.retried += retried
+        return reason
+
+    def refresh_shard(self, page):
+        """
+        Refreshes a shard of users.
+        """
+        refreshed = 0
+        failed = {}
+        for user_id, refresh_token in page:
+            reason = self.refresh_user(user_id, refresh_token)
+            if reason is None:
+                refreshed += 1
+            else:
+                failed[reason] = failed.get(reason, 0) + 1
+
+        with self._lock:
+            self.users += len(page)
+            self.refreshed += refreshed
+            for reason, count in failed.items():
+                self.failed[reason] = self.failed.get(reason, 0) + count
+
+    def run(self):
+        """
+        Refreshes all the users and returns a report.
+        """
+        start = time.monotonic()
+        completed = True
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="refresher") as executor:
+            for page in self.token_pages():
+                # Split the page into one shard per worker
+                shards = [page[i::self.workers] for i in range(self.workers) if page[i::self.workers]]
+                for future in [instrumentation.submit(executor, self.refresh_shard, shard) for shard in shards]:
+                    future.result()
+
+                if self.time_budget is not None and time.monotonic() - start > self.time_budget:
+                    completed = False
+                    break
+
+        elapsed = time.monotonic() - start
+        return {
+            "completed": completed,
+            "users": self.users,
+            "refreshed": self.refreshed,
+            "failed": sum(self.failed.values()),
+            "failures": dict(self.failed),
+            "retries": self.retried,
+            "elapsed_s": round(elapsed, 3),
+            "users_per_s": round(self.users / elapsed, 1) if elapsed else None,
+        }
@@ -0,0 +1,278 @@
+"""
+Admission control for the third-party APIs (Gemini, USDA, Spoonacular, AssemblyAI,
+Text-to-Speech, Google Fit): every call goes through the `Provider` of its API, which
+
+- rate limits the calls of the instance with a token bucket and caps the calls in flight,
+  waiting at most `max_wait` seconds for a slot (then the call is rejected, not queued),
+- coalesces identical calls in flight (`key=`): concurrent requests for the same food,
+  image or ingredients share one upstream call and its result (single flight),
+- fails fast while the API is failing: after `failures` consecutive errors the circuit
+  opens for `reset_after` seconds, then a single probe call decides whether it closes,
+- always passes a `timeout` to the call (a call that times out raises UpstreamUnavailable).
+
+Rejected calls raise `UpstreamUnavailable`, which the entry points turn into a 503 with a
+Retry-After header (see `unavailable_response`) instead of a 500, so clients back off.
+
+Limits are per instance: set them to the provider quota divided by the maximum number of
+instances. Settings come from PROVIDER_DEFAULTS and can be overridden with environment
+variables, e.g. UPSTREAM_USDA_RATE=2 or UPSTREAM_GEMINI_TIMEOUT=20.
+
+Each function is deployed from its own directory, so this module is copied into every
+function that calls a third-party API: keep all the copies identical.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+import clients
+import instrumentation
+
+# Per provider: calls per second and burst (rate 0 = unlimited), calls in flight, seconds
+# per call, seconds a call may wait for admission, consecutive failures opening the
+# circuit and seconds before a probe call
+PROVIDER_DEFAULTS = {
+    "gemini": {"rate": 10, "burst": 20, "concurrency": 16, "timeout": 30, "max_wait": 5},
+    "usda": {"rate": 0.5, "burst": 20, "concurrency": 8, "timeout": 8, "max_wait": 2},
+    "spoonacular": {"rate": 1, "burst": 5, "concurrency": 4, "timeout": 10, "max_wait": 2},
+    "assemblyai": {"rate": 5, "burst": 5, "concurrency": 5, "timeout": 60, "max_wait": 5},
+    "tts": {"rate": 15, "burst": 30, "concurrency": 8, "timeout": 15, "max_wait": 2},
+    "fit": {"rate": 20, "burst": 40, "concurrency": 16, "timeout": 20, "max_wait": 10},
+}
+BREAKER_DEFAULTS = {"failures": 5, "reset_after": 30}
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised when a call is rejected (circuit open, rate or concurrency limit) or times out.
+    `retry_after` is the number of seconds the client should wait.
+    """
+
+    def __init__(self, provider, reason, retry_after=1):
+        super().__init__(f"{provider} unavailable: {reason}")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = max(1, int(round(retry_after)))
+
+class TokenBucket:
+    """
+    `rate` tokens per second, up to `burst` saved. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Takes a token and returns the seconds to wait before using it, or None (taking
+        nothing) if that would be more than `max_wait`.
+        """
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures; after `reset_after` seconds one probe
+    call is let through, and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failures, reset_after):
+        self.threshold = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """
+        Seconds before the circuit lets a call through (0 when closed).
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(0.0, self.reset_after - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class SingleFlight:
+    """
+    Runs one call per key at a time; callers arriving meanwhile get its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Returns (result, shared): whether the result came from another caller's call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = function()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+def failed_status(status):
+    """
+    Rate limits and server errors count against the circuit; other client errors don't.
+    """
+    return status == 429 or status >= 500
+
+def is_failure(error):
+    """
+    Whether an exception from a call means the API is failing (as opposed to a bad request
+    or a revoked user token).
+    """
+    if type(error).__name__ == "RefreshError":
+        return False
+    for status in (
+        getattr(error, "code", None),
+        getattr(getattr(error, "resp", None), "status", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        status = getattr(status, "value", status)  # grpc status codes are enums
+        if isinstance(status, int) and status >= 400:
+            return failed_status(status)
+    return True
+
+def is_timeout(error):
+    return "Timeout" in type(error).__name__ or type(error).__name__ == "DeadlineExceeded"
+
+class Provider:
+    """
+    Admission control of one third-party API (see the module docstring).
+    """
+
+    def __init__(self, name, rate, burst, concurrency, timeout, max_wait, failures, reset_after):
+        self.name = name
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.breaker = CircuitBreaker(failures, reset_after)
+        self.flights = SingleFlight()
+
+    def call(self, operation, function, key=None):
+        """
+        Returns `function(timeout=...)` once admitted. Calls with the same `key` in flight
+        are made once. Raises UpstreamUnavailable when the call is rejected.
+        """
+        if key is None:
+            return self._call(operation, function)
+        result, shared = self.flights.do(f"{operation}:{key}", lambda: self._call(operation, function))
+        if shared:
+            instrumentation.count(f"coalesced.{self.name}.{operation}")
+        return result
+
+    def _reject(self, operation, reason, retry_after):
+        instrumentation.count(f"rejected.{self.name}.{operation}")
+        raise UpstreamUnavailable(self.name, reason, retry_after)
+
+    def _call(self, operation, function):
+        # Fail fast while the circuit is open, before waiting for anything
+        retry_after = self.breaker.retry_after()
+        if retry_after:
+            self._reject(operation, "circuit open", retry_after)
+
+        start = time.monotonic()
+        wait = self.bucket.reserve(self.max_wait)
+        if wait is None:
+            self._reject(operation, "rate limited", 1)
+        time.sleep(wait)
+        if not self.slots.acquire(timeout=max(0.0, self.max_wait - (time.monotonic() - start))):
+            self._reject(operation, "too many calls in flight", 1)
+        try:
+            if not self.breaker.allow():
+                self._reject(operation, "circuit open", self.breaker.retry_after())
+            try:
+                with instrumentation.upstream(self.name, operation):
+                    result = function(timeout=self.timeout)
+            except Exception as e:
+                if is_failure(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if is_timeout(e):
+                    instrumentation.count(f"timeouts.{self.name}.{operation}")
+                    raise UpstreamUnavailable(self.name, "timed out") from e
+                raise
+            status = getattr(result, "status_code", None)
+            if isinstance(status, int) and failed_status(status):
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            return result
+        finally:
+            self.slots.release()
+
+def settings(name, **overrides):
+    """
+    Settings of a provider: defaults, then `overrides`, then UPSTREAM_<NAME>_<SETTING>.
+    """
+    values = {**BREAKER_DEFAULTS, **PROVIDER_DEFAULTS.get(name, {}), **overrides}
+    for setting, value in values.items():
+        env = os.environ.get(f"UPSTREAM_{name.upper()}_{setting.upper()}")
+        if env is not None:
+            values[setting] = int(env) if setting in ("concurrency", "failures") else float(env)
+    return values
+
+def provider(name, **overrides):
+    """
+    Returns the provider `name` of the instance, created on first use.
+    """
+    return clients.get(f"upstream:{name}", lambda: Provider(name, **settings(name, **overrides)))
+
+def unavailable_response(error):
+    """
+    503 answer of a rejected upstream call, telling the client when to retry.
+    """
+    return (
+        {"error": f"{error.provider} is busy, please retry", "retry_after": error.retry_after},
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
@@ -0,0 +1,34 @@
+"""
+Exports the tracking history of every user (day documents and legacy collections) as
+newline-delimited JSON or Parquet, without deleting anything. Users are read page by page
+and each record is streamed to the output, so memory stays bounded.
+
+Usage:
+    python export_history.py --output gs://bucket/exports [--format ndjson|parquet] [--before YYYY-MM-DD]
+"""
+import argparse
+import time
+from datetime import date
+from google.cloud import firestore
+import daily_tracking
+import history
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the daily tracking history.")
+    parser.add_argument("--output", default=history.HISTORY_EXPORT_URI, help="gs://bucket/prefix or directory")
+    parser.add_argument("--format", default=history.HISTORY_EXPORT_FORMAT, choices=sorted(history.WRITERS))
+    parser.add_argument("--before", type=date.fromisoformat, default=None, help="Only days before this date (default: today)")
+    parser.add_argument("--page-size", type=int, default=300)
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("--output (or HISTORY_EXPORT_URI) is required")
+
+    db = firestore.Client()
+    before = args.before or daily_tracking.today()
+    name = f"history-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+    with history.Exporter(name, args.output, args.format) as exporter:
+        records = history.export_all(db, exporter, before, args.page_size)
+    print(f"Exported {records} day(s) before {before} to {exporter.path}")
+
+if __name__ == "__main__":
+    main()
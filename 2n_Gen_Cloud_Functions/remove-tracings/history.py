@@ -0,0 +1,234 @@
+"""
+Keeps the history of the tracking data the sweeper deletes: exports and rollups.
+
+Everything is a generator pipeline over paginated queries (users page by page, then each
+user's old day documents and legacy collections), so memory stays bounded by one page of
+users whatever their number.
+
+- Export: one record per user and day, written as newline-delimited JSON or Parquet
+  (columnar, needs pyarrow) to HISTORY_EXPORT_URI, a `gs://bucket/prefix` or a local
+  directory. Blobs are written as a stream (resumable upload), never held in memory.
+- Rollups: the additive fields of the days are summed into one document per user and
+  week / month, `users/{uid}/rollups/{YYYY-Www | YYYY-MM}`. The sweeper writes them in the
+  same batch as the deletes of the days they contain, so a day is counted exactly once
+  even when a run is interrupted (exports are at least once: dedupe on user_id + date).
+"""
+import json
+import os
+import threading
+from datetime import date, datetime
+import clients
+import daily_tracking
+import instrumentation
+
+HISTORY_EXPORT_URI = os.environ.get("HISTORY_EXPORT_URI")                  # gs://bucket/prefix or directory
+HISTORY_EXPORT_FORMAT = os.environ.get("HISTORY_EXPORT_FORMAT", "ndjson")  # ndjson | parquet
+HISTORY_ROW_GROUP = int(os.environ.get("HISTORY_ROW_GROUP", "5000"))       # Records per Parquet row group
+
+ROLLUPS_COLLECTION = "rollups"
+
+# Numeric fields of a day record (the Parquet columns, after user_id, date and source)
+HISTORY_FIELDS = (
+    "kcal", "protein_g", "fat_g", "carbohydrate_g", "saturated_fat_g", "fiber_g", "cholesterol_mg", "sugar_g",
+    "burnt_kcal", daily_tracking.KCAL_TARGET_FIELD, "fit_steps", "fit_distance_m", "fit_kcal",
+)
+
+# Fields summed by the rollups (a target is not a total)
+ROLLUP_FIELDS = tuple(field for field in HISTORY_FIELDS if field != daily_tracking.KCAL_TARGET_FIELD)
+
+def user_pages(db, page_size, start_after=None):
+    """
+    Yields the user ids in pages of `page_size`, ordered by id.
+    """
+    users_ref = db.collection(daily_tracking.USERS_COLLECTION)
+    while True:
+        query = users_ref.order_by("__name__").limit(page_size)
+        if start_after is not None:
+            query = query.start_after({"__name__": start_after})
+        page = [user.id for user in query.stream()]
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        start_after = page[-1]
+
+def day_record(user_id, day_id, data, source="days"):
+    """
+    Flat record of a user's day: ids, then the scalar fields (timestamps as ISO strings,
+    maps such as fit_pending left out).
+    """
+    record = {"user_id": user_id, "date": day_id, "source": source}
+    for key, value in data.items():
+        if key in record:
+            continue
+        if isinstance(value, (datetime, date)):
+            record[key] = value.isoformat()
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            record[key] = value
+    return record
+
+def old_days(db, user_id, before):
+    """
+    Yields (reference, record) for each day of a user before `before`: its day documents
+    and the documents of its legacy timestamp-named collections.
+    """
+    query = daily_tracking.days_collection(db, user_id).where(
+        daily_tracking.DATE_FIELD, "<", daily_tracking.day_id(before)
+    )
+    for doc in query.stream():
+        yield doc.reference, day_record(user_id, doc.id, doc.to_dict() or {})
+
+    user_ref = db.collection(daily_tracking.USERS_COLLECTION).document(user_id)
+    for col in user_ref.collections():
+        col_date = daily_tracking.parse_legacy_collection_date(col.id)
+        if col_date is not None and col_date < before:
+            for doc in col.stream():
+                yield doc.reference, day_record(user_id, daily_tracking.day_id(col_date), doc.to_dict() or {}, "legacy")
+
+def period_ids(day_id):
+    """
+    Returns the (week, month) rollup ids of a day: "YYYY-Www" (ISO week) and "YYYY-MM".
+    """
+    day = date.fromisoformat(day_id)
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}", day_id[:7]
+
+def rollups(records):
+    """
+    Sums the records of a user into {period id: {"period", "days", "totals"}}. "days" counts
+    distinct dates: a date with both a day document and legacy documents is one day.
+    """
+    periods = {}
+    dates = {}
+    for record in records:
+        for period, period_id in zip(("week", "month"), period_ids(record["date"])):
+            rollup = periods.setdefault(period_id, {"period": period, "days": 0, "totals": {}})
+            dates.setdefault(period_id, set()).add(record["date"])
+            rollup["days"] = len(dates[period_id])
+            for field in ROLLUP_FIELDS:
+                value = record.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    rollup["totals"][field] = rollup["totals"].get(field, 0) + value
+    return periods
+
+def rollup_writes(db, user_id, records):
+    """
+    Returns the (reference, fields) merge writes adding the records to the user's rollups.
+    """
+    from google.cloud import firestore
+
+    rollups_ref = db.collection(daily_tracking.USERS_COLLECTION).document(user_id).collection(ROLLUPS_COLLECTION)
+    writes = []
+    for period_id, rollup in rollups(records).items():
+        fields = {
+            "period": rollup["period"],
+            "days": firestore.Increment(rollup["days"]),
+            daily_tracking.UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+        }
+        for field, total in rollup["totals"].items():
+            fields[field] = firestore.Increment(round(total, 1))
+        writes.append((rollups_ref.document(period_id), fields))
+    return writes
+
+def open_output(uri, name):
+    """
+    Opens a binary stream to `name` under `uri`: a blob upload for gs:// URIs, else a
+    local file.
+    """
+    if uri.startswith("gs://"):
+        bucket, _, prefix = uri[len("gs://"):].partition("/")
+        path = f"{prefix.rstrip('/')}/{name}" if prefix else name
+        return clients.storage_client().bucket(bucket).blob(path).open("wb")
+    os.makedirs(uri, exist_ok=True)
+    return open(os.path.join(uri, name), "wb")
+
+class NdjsonWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, records):
+        for record in records:
+            self.stream.write(json.dumps(record).encode("utf-8") + b"\n")
+
+    def close(self):
+        self.stream.close()
+
+class ParquetWriter:
+    """
+    Writes the records as Parquet row groups of `row_group` records (fixed columns:
+    user_id, date, source and HISTORY_FIELDS).
+    """
+
+    def __init__(self, stream, row_group=HISTORY_ROW_GROUP):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema(
+            [("user_id", pa.string()), ("date", pa.string()), ("source", pa.string())]
+            + [(field, pa.float64()) for field in HISTORY_FIELDS]
+        )
+        self.stream = stream
+        self.writer = pq.ParquetWriter(stream, self.schema)
+        self.row_group = row_group
+        self.rows = []
+
+    def write(self, records):
+        self.rows.extend(records)
+        if len(self.rows) >= self.row_group:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = {name: [row.get(name) for row in self.rows] for name in self.schema.names}
+        for field in HISTORY_FIELDS:
+            columns[field] = [float(value) if isinstance(value, (int, float)) else None for value in columns[field]]
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.stream.close()
+
+WRITERS = {"ndjson": (NdjsonWriter, "ndjson"), "parquet": (ParquetWriter, "parquet")}
+
+class Exporter:
+    """
+    Thread-safe export of day records to a single output (one per run).
+    """
+
+    def __init__(self, name, uri=HISTORY_EXPORT_URI, fmt=HISTORY_EXPORT_FORMAT):
+        if fmt not in WRITERS:
+            raise ValueError(f"Unknown HISTORY_EXPORT_FORMAT: {fmt}")
+        writer_class, extension = WRITERS[fmt]
+        self.path = f"{uri.rstrip('/')}/{name}.{extension}"
+        self.writer = writer_class(open_output(uri, f"{name}.{extension}"))
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def write(self, records):
+        with self._lock, instrumentation.span("export"):
+            self.writer.write(records)
+            self.records += len(records)
+
+    def close(self):
+        with self._lock:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def export_all(db, exporter, before, page_size=300):
+    """
+    Exports the days before `before` of every user, without deleting anything.
+    Returns the number of records written.
+    """
+    for page in user_pages(db, page_size):
+        for user_id in page:
+            exporter.write([record for _, record in old_days(db, user_id, before)])
+    return exporter.records
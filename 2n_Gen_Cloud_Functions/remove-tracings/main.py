@@ -1,47 +1,48 @@
 import functions_framework
-from google.cloud import firestore
-from datetime import datetime
+import os
+import time
+from contextlib import nullcontext
+from sweeper import Sweeper, SWEEP_WORKERS
+import history
+import instrumentation
+import clients
 
-# Initialize Firestore client
-db = firestore.Client()
+# Seconds after which a run stops and leaves a checkpoint (must be below the function timeout)
+SWEEP_TIME_BUDGET = float(os.environ.get("SWEEP_TIME_BUDGET", "480"))
 
-@functions_framework.http
-def delete_daily_tracing(request):
-    # Get today's date
-    today = datetime.now().date()
-
-    # Get reference to the 'users' collection
-    users_ref = db.collection('users')
-    users = users_ref.stream()
-
-    # Iterate through all user documents
-    for user in users:
-        print(f"Looking for {user.to_dict().get('name', user.id)}'s collections to be removed.")
-        user_ref = users_ref.document(user.id)
-        collections = user_ref.collections()
-
-        # Iterate through each user's subcollections
-        for col in collections:
-            col_name = col.id
-            print(f"Collection found: {col_name}.")
-            col_date = None
+# Keep weekly/monthly rollups of the deleted days (export needs HISTORY_EXPORT_URI)
+SWEEP_ROLLUPS = os.environ.get("SWEEP_ROLLUPS", "true")
 
-            # Try to parse collection name as a date in accepted formats
-            for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
-                try:
-                    col_date = datetime.strptime(col_name, fmt).date()
-                    break
-                except ValueError:
-                    continue
+def enabled(value):
+    return str(value).lower() in ("1", "true", "yes")
 
-            # Skip collections with non-date names
-            if not col_date:
-                continue
-
-             # If the collection's date is before today, delete all its documents
-            if col_date < today:
-                for doc in col.stream():
-                    col.document(doc.id).delete()
-
-    # Return confirmation response
-    return ('Old tracing documents deleted', 200)
\ No newline at end of file
+@functions_framework.http
+@instrumentation.traced
+def delete_daily_tracing(request):
+    # Options can be passed as query parameters or in a JSON body
+    options = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    dry_run = enabled(options.get("dry_run", "false"))
+    workers = int(options.get("workers", SWEEP_WORKERS))
+    rollups = enabled(options.get("rollups", SWEEP_ROLLUPS))
+    export = enabled(options.get("export", bool(history.HISTORY_EXPORT_URI)))
+    if export and not history.HISTORY_EXPORT_URI:
+        return {"error": "HISTORY_EXPORT_URI is not set"}, 400
+
+    # One export file per run (a resumed run writes its own)
+    exporter = None
+    if export and not dry_run:
+        exporter = history.Exporter(f"tracking-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}")
+
+    # Delete every user's tracking data older than today (keeping its history), resuming an unfinished run if any
+    with exporter or nullcontext():
+        sweeper = Sweeper(
+            clients.firestore_client(), dry_run=dry_run, workers=workers, time_budget=SWEEP_TIME_BUDGET,
+            rollups=rollups, exporter=exporter,
+        )
+        report = sweeper.run()
+    if exporter is not None:
+        report["export"] = exporter.path
+    instrumentation.log("Sweep report", report=report)
+
+    # Return the counts and throughput of the run
+    return report, 200
@@ -0,0 +1,93 @@
+"""
+Migrates the daily tracking data from the legacy layout (one timestamp-named subcollection
+per day, `users/{uid}/{YYYY-MM-DDTHH:MM:SS}/nutrients`) to the day documents
+`users/{uid}/days/{YYYY-MM-DD}` used by daily_tracking.py.
+
+Numeric fields of every legacy collection of the same day are added together, into the
+day document (incremented if it already exists). Migrated days are marked with
+`legacy_migrated`, so the script can be run several times without adding a day twice, and
+with --delete-legacy the legacy documents of a day are deleted in the same batch that
+merges them: legacy data is never deleted before it is in the day document.
+
+Usage:
+    python migrate_daily_tracking.py [--user UID] [--dry-run] [--delete-legacy]
+"""
+import argparse
+from google.cloud import firestore
+import daily_tracking
+
+LEGACY_MIGRATED_FIELD = "legacy_migrated"
+
+def legacy_days(user_ref):
+    """
+    Groups the legacy collections of a user by day: {date: [collection, ...]}.
+    """
+    days = {}
+    for col in user_ref.collections():
+        col_date = daily_tracking.parse_legacy_collection_date(col.id)
+        if col_date is not None:
+            days.setdefault(col_date, []).append(col)
+    return days
+
+def merge_legacy_collections(collections):
+    """
+    Adds up the numeric fields of the "nutrients" documents of a day's legacy collections.
+    """
+    totals = {}
+    for col in collections:
+        data = col.document(daily_tracking.LEGACY_NUTRIENTS_DOCUMENT).get().to_dict() or {}
+        for key, value in data.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals[key] = round(totals.get(key, 0) + value, 1)
+    return totals
+
+def migrate_user(db, user_id, dry_run=False, delete_legacy=False):
+    """
+    Migrates the legacy collections of one user. Returns the number of days migrated.
+    """
+    user_ref = db.collection(daily_tracking.USERS_COLLECTION).document(user_id)
+    migrated = 0
+
+    for day, collections in sorted(legacy_days(user_ref).items()):
+        day_doc = daily_tracking.get_day(db, user_id, day)
+        merge = not day_doc.get(LEGACY_MIGRATED_FIELD)
+        if merge:
+            totals = merge_legacy_collections(collections)
+            target = "added to the existing day" if day_doc else "new day"
+            print(f"{user_id} {daily_tracking.day_id(day)}: {len(collections)} collection(s) -> {totals} ({target})")
+            migrated += 1
+        if dry_run or not (merge or delete_legacy):
+            continue
+
+        # The merge and the deletes of the merged documents are committed together
+        batch = db.batch()
+        if merge:
+            daily_tracking.increment_day(db, user_id, totals, day=day, batch=batch, fields={LEGACY_MIGRATED_FIELD: True})
+        if delete_legacy:
+            for col in collections:
+                for doc in col.stream():
+                    batch.delete(doc.reference)
+        batch.commit()
+
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate legacy daily tracking collections to day documents.")
+    parser.add_argument("--user", help="Only migrate this user id")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    parser.add_argument("--delete-legacy", action="store_true", help="Delete the legacy collections once migrated")
+    args = parser.parse_args()
+
+    db = firestore.Client()
+    if args.user:
+        user_ids = [args.user]
+    else:
+        user_ids = [user.id for user in db.collection(daily_tracking.USERS_COLLECTION).stream()]
+
+    total = 0
+    for user_id in user_ids:
+        total += migrate_user(db, user_id, dry_run=args.dry_run, delete_legacy=args.delete_legacy)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {total} day(s) for {len(user_ids)} user(s)")
+
+if __name__ == "__main__":
+    main()
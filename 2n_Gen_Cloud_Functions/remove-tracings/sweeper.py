@@ -0,0 +1,212 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import daily_tracking
+import history
+import instrumentation
+
+# Sweeper settings
+SWEEP_PAGE_SIZE = 300       # Users fetched per page (each page is split into worker shards)
+SWEEP_WORKERS = 8           # Parallel user shards
+SWEEP_BATCH_SIZE = 500      # Deletes per batched write (Firestore's maximum)
+
+CHECKPOINTS_COLLECTION = "sweeper_checkpoints"
+
+class BatchDeleter:
+    """
+    Groups deletes (and the rollup writes that go with them) into batched writes of up to
+    `batch_size` operations. In dry-run mode nothing is written, operations are only counted.
+    """
+
+    def __init__(self, db, batch_size=SWEEP_BATCH_SIZE, dry_run=False):
+        self.db = db
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.deleted = 0
+        self.written = 0
+        self.commits = 0
+        self._batch = None
+        self._pending = 0
+
+    def reserve(self, operations):
+        """
+        Commits the current batch first if `operations` more wouldn't fit in it, so they
+        are committed together (e.g. a user's rollups and the deletes of its days).
+        """
+        if self._pending and self._pending + operations > self.batch_size:
+            self.flush()
+
+    def delete(self, reference):
+        self.deleted += 1
+        self._add(lambda batch: batch.delete(reference))
+
+    def write(self, reference, fields):
+        """
+        Merges `fields` into a document.
+        """
+        self.written += 1
+        self._add(lambda batch: batch.set(reference, fields, merge=True))
+
+    def _add(self, operation):
+        if self.dry_run:
+            return
+        if self._batch is None:
+            self._batch = self.db.batch()
+        operation(self._batch)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch is not None and self._pending:
+            self._batch.commit()
+            self.commits += 1
+        self._batch = None
+        self._pending = 0
+
+class Sweeper:
+    """
+    Deletes the tracking data older than `today` for every user.
+
+    Users are read in pages ordered by id; each page is split into shards processed by a
+    worker pool, and every worker groups its deletes into batched writes. After each page
+    the last user id is saved as a checkpoint, so a run stopped by `time_budget` (seconds)
+    continues where it stopped the next time it is triggered on the same day.
+
+    Before being deleted, the days can be kept (see history): written to `exporter` and,
+    with `rollups`, added to the user's weekly and monthly rollups in the same batch as
+    their deletes.
+    """
+
+    def __init__(self, db, today=None, dry_run=False, workers=SWEEP_WORKERS, page_size=SWEEP_PAGE_SIZE,
+                 batch_size=SWEEP_BATCH_SIZE, time_budget=None, checkpoint_id="delete_daily_tracing",
+                 rollups=False, exporter=None):
+        self.db = db
+        self.today = today or daily_tracking.today()
+        self.dry_run = dry_run
+        self.workers = workers
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.rollups = rollups
+        self.exporter = exporter
+        self.checkpoint_ref = db.collection(CHECKPOINTS_COLLECTION).document(checkpoint_id)
+
+        self._lock = threading.Lock()
+        self.users = 0
+        self.days_deleted = 0
+        self.legacy_docs_deleted = 0
+        self.days_exported = 0
+        self.rollup_writes = 0
+        self.commits = 0
+
+    def load_checkpoint(self):
+        """
+        Returns the last user id swept by an unfinished run of today, or None.
+        """
+        checkpoint = self.checkpoint_ref.get().to_dict() or {}
+        if checkpoint.get("date") != daily_tracking.day_id(self.today):
+            return None
+        return checkpoint.get("last_user_id")
+
+    def save_checkpoint(self, last_user_id):
+        if not self.dry_run:
+            self.checkpoint_ref.set({"date": daily_tracking.day_id(self.today), "last_user_id": last_user_id})
+
+    def clear_checkpoint(self):
+        if not self.dry_run:
+            self.checkpoint_ref.delete()
+
+    def user_pages(self, start_after=None):
+        """
+        Yields the user ids in pages of `page_size`, ordered by id.
+        """
+        return history.user_pages(self.db, self.page_size, start_after)
+
+    def sweep_user(self, user_id, deleter):
+        """
+        Deletes the old day documents and legacy collections of one user, keeping their
+        history first if asked to. Returns (days, legacy docs, rollup writes).
+        """
+        # One user's old days (a few documents, the sweep runs daily)
+        days = list(history.old_days(self.db, user_id, self.today))
+        if not days:
+            return 0, 0, 0
+        records = [record for _, record in days]
+
+        if self.exporter is not None and not self.dry_run:
+            self.exporter.write(records)
+
+        writes = history.rollup_writes(self.db, user_id, records) if self.rollups else []
+        deleter.reserve(len(writes) + len(days))
+        for reference, fields in writes:
+            deleter.write(reference, fields)
+        for reference, _ in days:
+            deleter.delete(reference)
+
+        legacy_docs = sum(1 for record in records if record["source"] == "legacy")
+        return len(days) - legacy_docs, legacy_docs, len(writes)
+
+    def sweep_shard(self, user_ids):
+        """
+        Sweeps a shard of users with its own batched deleter.
+        """
+        deleter = BatchDeleter(self.db, self.batch_size, self.dry_run)
+        days_deleted = 0
+        legacy_docs_deleted = 0
+        rollup_writes = 0
+        for user_id in user_ids:
+            days, legacy_docs, writes = self.sweep_user(user_id, deleter)
+            days_deleted += days
+            legacy_docs_deleted += legacy_docs
+            rollup_writes += writes
+        deleter.flush()
+
+        with self._lock:
+            self.users += len(user_ids)
+            self.days_deleted += days_deleted
+            self.legacy_docs_deleted += legacy_docs_deleted
+            self.rollup_writes += rollup_writes
+            if self.exporter is not None and not self.dry_run:
+                self.days_exported += days_deleted + legacy_docs_deleted
+            self.commits += deleter.commits
+
+    def run(self):
+        """
+        Sweeps all the users (resuming from the checkpoint) and returns a report.
+        """
+        start = time.monotonic()
+        resumed_from = self.load_checkpoint()
+        completed = True
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sweeper") as executor:
+            for page in self.user_pages(resumed_from):
+                # Split the page into one shard per worker
+                shards = [page[i::self.workers] for i in range(self.workers) if page[i::self.workers]]
+                for future in [instrumentation.submit(executor, self.sweep_shard, shard) for shard in shards]:
+                    future.result()
+                self.save_checkpoint(page[-1])
+
+                if self.time_budget is not None and time.monotonic() - start > self.time_budget:
+                    completed = False
+                    break
+
+        if completed:
+            self.clear_checkpoint()
+
+        elapsed = time.monotonic() - start
+        deleted = self.days_deleted + self.legacy_docs_deleted
+        return {
+            "dry_run": self.dry_run,
+            "completed": completed,
+            "resumed_from": resumed_from,
+            "users": self.users,
+            "days_deleted": self.days_deleted,
+            "legacy_docs_deleted": self.legacy_docs_deleted,
+            "days_exported": self.days_exported,
+            "rollup_writes": self.rollup_writes,
+            "batch_commits": self.commits,
+            "elapsed_s": round(elapsed, 3),
+            "users_per_s": round(self.users / elapsed, 1) if elapsed else None,
+            "deletes_per_s": round(deleted / elapsed, 1) if elapsed else None,
+        }
@@ -0,0 +1,67 @@
+"""
+Concurrency harness for daily_tracking.increment_day.
+
+Fires many parallel "scans" for the same user against the in-memory Firestore stand-in
+(with per-operation latency, so requests interleave like they do in production) and
+checks that no update is lost. The previous read-modify-write approach can be run with
+--mode read-modify-write to compare.
+
+Usage:
+    python accumulator_stress.py [--workers 16] [--writes 200] [--latency 0.002]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extract-nutrients"))
+
+import daily_tracking
+from fake_firestore import FakeFirestore
+
+USER_ID = "stress-user"
+
+# Deltas applied by every simulated scan
+SCAN_DELTAS = {"kcal": 250.5, "protein_g": 12.3, "fat_g": 8.1, "burnt_kcal": 40}
+
+def increment(db):
+    daily_tracking.increment_day(db, USER_ID, SCAN_DELTAS)
+
+def read_modify_write(db):
+    current = daily_tracking.get_day(db, USER_ID)
+    daily_tracking.set_day_fields(db, USER_ID, {
+        key: round(current.get(key, 0) + delta, 1) for key, delta in SCAN_DELTAS.items()
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent day updates are not lost.")
+    parser.add_argument("--mode", choices=["increment", "read-modify-write"], default="increment")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.002, help="Seconds per Firestore operation")
+    args = parser.parse_args()
+
+    db = FakeFirestore(latency=args.latency)
+    update = increment if args.mode == "increment" else read_modify_write
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for future in [executor.submit(update, db) for _ in range(args.writes)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    totals = daily_tracking.get_day(db, USER_ID)
+    lost = 0
+    for key, delta in SCAN_DELTAS.items():
+        expected = round(delta * args.writes, 1)
+        actual = round(totals.get(key, 0), 1)
+        lost = max(lost, round((expected - actual) / delta))
+        print(f"{key:>12}: expected {expected:>10} got {actual:>10}")
+
+    print(f"{args.mode}: {args.writes} updates from {args.workers} workers in {elapsed:.2f}s, "
+          f"{dict(db.ops)} Firestore ops, {lost} lost update(s)")
+    sys.exit(1 if lost else 0)
+
+if __name__ == "__main__":
+    main()
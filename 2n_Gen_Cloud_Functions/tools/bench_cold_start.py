@@ -0,0 +1,161 @@
+"""
+Measures the cold start of each Python function: time to import its module, latency of
+its first request (which creates the shared clients) and of the following warm requests.
+
+Every function runs in a fresh interpreter, like a new instance. Network clients (Gemini,
+USDA, Spoonacular, AssemblyAI, Fitness, Text-to-Speech, Firestore) are replaced with local
+fakes through `clients.override`, so only the SDK imports and our own code are measured;
+`--real-clients` keeps the real factories and reports how long each client takes to create
+(it needs credentials, failures are reported).
+
+Usage:
+    python bench_cold_start.py [--functions extract-nutrients get-recipe ...] [--warm 5] [--real-clients]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.join(TOOLS_DIR, "..")
+
+# Function directory -> entry point
+FUNCTIONS = {
+    "extract-food-from-image": "extract_food",
+    "extract-nutrients": "extract_nutrients",
+    "get-recipe": "get_recipe",
+    "read-recipe": "text_to_speech",
+    "add-activity": "add_activity",
+    "activity-tracker": "activity_tracker",
+    "remove-tracings": "delete_daily_tracing",
+}
+
+# Placeholder settings so the modules can be imported without a deployment
+PLACEHOLDER_ENV = {
+    "GOOGLE_CLOUD_PROJECT": "bench-project",
+    "ASSEMBLYAI_API_KEY": "bench",
+    "SPOONACULAR_API_KEY": "bench",
+    "USDA_API_KEY": "bench",
+    "FOOD_EXTRACTION_MODE": "local",
+    "NUTRIENT_CACHE_BACKEND": "none",
+}
+
+def install_fakes(clients):
+    import fakes
+    return fakes.install(clients, {provider: 0 for provider in fakes.DEFAULT_LATENCIES})
+
+def request_kwargs(function, image):
+    """
+    Returns the Flask test request of a function.
+    """
+    if function in ("extract-food-from-image", "extract-nutrients", "get-recipe"):
+        return {"method": "POST", "data": {"image": (io.BytesIO(image), "meal.jpg"), "user_id": "bench-user"}}
+    if function == "read-recipe":
+        return {"method": "POST", "json": {"text": "Preheat the oven. Bake for twenty minutes."}}
+    if function == "add-activity":
+        return {"method": "POST", "data": {"userId": "bench-user", "file": (io.BytesIO(b"RIFF" + b"\0" * 64), "a.wav")}}
+    if function == "activity-tracker":
+        return {"method": "POST", "json": {"access_token": "bench", "user_id": "bench-user"}}
+    return {"method": "POST", "json": {"dry_run": True}}
+
+def time_client_factories(clients):
+    """
+    Creates each real client and returns its creation time (or the error).
+    """
+    factories = {
+        "firestore": clients.firestore_client,
+        "gemini": clients.gemini_model,
+        "tts": clients.tts_client,
+        "assemblyai": clients.assemblyai,
+        "fitness_discovery": clients.fitness_discovery_document,
+        "http_session": clients.http_session,
+    }
+    results = {}
+    for name, factory in factories.items():
+        start = time.perf_counter()
+        try:
+            factory()
+            results[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            results[name] = f"error: {type(e).__name__}"
+    return results
+
+def run_child(function, warm, real_clients):
+    """
+    Runs inside a fresh interpreter: imports a function and sends it its requests.
+    """
+    function_dir = os.path.join(FUNCTIONS_DIR, function)
+    sys.path.insert(0, function_dir)
+    sys.path.insert(1, TOOLS_DIR)
+    os.chdir(function_dir)
+
+    start = time.perf_counter()
+    import main
+    import_s = time.perf_counter() - start
+
+    import clients
+    from flask import Flask, make_response
+    result = {"function": function, "import_s": round(import_s, 4)}
+    if real_clients:
+        result["client_init_s"] = time_client_factories(clients)
+        clients.reset()
+    install_fakes(clients)
+
+    handler = getattr(main, FUNCTIONS[function])
+    app = Flask(function)
+    # A different photo each time (not just different bytes: the perceptual hash must
+    # differ too), so the detection cache doesn't hide the work
+    from loadtest import sample_jpegs
+    images = sample_jpegs(1 + warm)
+    latencies = []
+    for i in range(1 + warm):
+        kwargs = request_kwargs(function, images[i])
+        with app.test_request_context("/", **kwargs):
+            from flask import request
+            start = time.perf_counter()
+            response = make_response(handler(request))
+            latencies.append(time.perf_counter() - start)
+        result.setdefault("status", response.status_code)
+
+    result["first_request_s"] = round(latencies[0], 4)
+    if warm:
+        result["warm_request_p50_s"] = round(statistics.median(latencies[1:]), 4)
+    print(json.dumps(result))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the Python Cloud Functions.")
+    parser.add_argument("--functions", nargs="*", default=list(FUNCTIONS))
+    parser.add_argument("--warm", type=int, default=5, help="Warm requests after the first one")
+    parser.add_argument("--real-clients", action="store_true", help="Also time the creation of the real clients")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.warm, args.real_clients)
+        return
+
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    print(f"{'function':26} {'import':>9} {'first req':>10} {'warm p50':>9}  status")
+    for function in args.functions:
+        command = [sys.executable, os.path.abspath(__file__), "--child", function, "--warm", str(args.warm)]
+        if args.real_clients:
+            command.append("--real-clients")
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        lines = [line for line in child.stdout.splitlines() if line.startswith("{")]
+        if child.returncode != 0 or not lines:
+            print(f"{function:26} failed: {child.stderr.strip().splitlines()[-1:] or child.returncode}")
+            continue
+        result = json.loads(lines[-1])
+        print(
+            f"{function:26} {result['import_s'] * 1000:7.0f}ms {result['first_request_s'] * 1000:8.0f}ms"
+            f" {result.get('warm_request_p50_s', 0) * 1000:7.1f}ms  {result['status']}"
+        )
+        if "client_init_s" in result:
+            print(f"{'':26} clients: {result['client_init_s']}")
+
+if __name__ == "__main__":
+    main()
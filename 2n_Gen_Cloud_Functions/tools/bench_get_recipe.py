@@ -0,0 +1,85 @@
+"""
+Load test of get-recipe against the fake Spoonacular server: concurrent scans of a few
+distinct meals (ingredients detected in varying order and casing), each followed by
+"next recipe" pages. Reports latencies and how many upstream calls were made.
+
+Requests send the ingredients directly (no image), so only the recipe lookup is measured.
+The Spoonacular rate limit of the admission control (upstream.py) is lifted unless
+`--limits` is given; shed requests (503) are counted, and end their scan.
+
+Usage:
+    python bench_get_recipe.py [--requests 200] [--meals 10] [--pages 3] [--concurrency 16] [--latency 0.3] [--limits]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "get-recipe"))
+os.environ.setdefault("SPOONACULAR_API_KEY", "bench")
+
+from flask import Flask, make_response
+from fake_spoonacular import FakeSpoonacular
+
+INGREDIENTS = ["Tomato", "Pasta", "Chicken", "Rice", "Broccoli", "Cheese", "Egg", "Salmon", "Potato", "Onion"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test get-recipe against a fake Spoonacular.")
+    parser.add_argument("--requests", type=int, default=200, help="Scans")
+    parser.add_argument("--meals", type=int, default=10, help="Distinct ingredient sets")
+    parser.add_argument("--pages", type=int, default=3, help="Recipes viewed per scan")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake Spoonacular seconds per search")
+    parser.add_argument("--limits", action="store_true", help="Keep the Spoonacular rate limit")
+    args = parser.parse_args()
+
+    server = FakeSpoonacular(latency=args.latency).start()
+    os.environ["SPOONACULAR_URL"] = server.url
+    if not args.limits:
+        os.environ["UPSTREAM_SPOONACULAR_RATE"] = "0"
+    import main as get_recipe
+
+    rng = random.Random(0)
+    meals = [rng.sample(INGREDIENTS, 3) for _ in range(args.meals)]
+    app = Flask("bench")
+
+    def scan(i):
+        # Same meal, detected in another order and casing
+        meal = meals[i % len(meals)][:]
+        rng_i = random.Random(i)
+        rng_i.shuffle(meal)
+        meal = [name.upper() if rng_i.random() < 0.5 else name for name in meal]
+
+        latencies, shed = [], 0
+        body = {"ingredients": meal}
+        for page in range(args.pages):
+            start = time.perf_counter()
+            with app.test_request_context("/", method="POST", json={**body, "page": page}):
+                from flask import request
+                response = make_response(get_recipe.get_recipe(request))
+            latencies.append(time.perf_counter() - start)
+            if response.status_code == 503:
+                shed += 1
+                break
+            body = {"ingredients": response.get_json()["ingredients"]}
+        return latencies, shed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        scans = list(executor.map(scan, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for scan_latencies, _ in scans for latency in scan_latencies)
+    shed = sum(scan_shed for _, scan_shed in scans)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"requests: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s)")
+    print(f"shed (503): {shed}")
+    print(f"latency p50 {statistics.median(latencies) * 1000:.1f}ms  p95 {p95 * 1000:.1f}ms")
+    print(f"spoonacular: {server.stats()}  cache: {get_recipe.recipe_cache.stats()}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
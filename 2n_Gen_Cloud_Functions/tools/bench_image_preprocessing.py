@@ -0,0 +1,124 @@
+"""
+Measures what the image preprocessing stage saves: payload size (base64 JSON as uploaded
+today vs. preprocessed multipart) and preprocessing time, and optionally the end-to-end
+latency of a function (e.g. a local functions-framework instance of extract_food) before
+and after.
+
+End-to-end, every request sends a different variant of the photo (a few shapes drawn on
+it), so the detection cache never answers from an earlier run. "after" posts the
+preprocessed image to `--url`; "before" posts the base64 JSON of the original to
+`--before-url`, which must serve the baseline function (the code before preprocessing,
+e.g. a functions-framework instance run from a checkout of that commit).
+
+Usage:
+    python bench_image_preprocessing.py photo1.jpg photo2.jpg [--url http://localhost:8080]
+                                        [--before-url http://localhost:8081] [--runs 5]
+    python bench_image_preprocessing.py --synthetic
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extract-food-from-image"))
+
+import requests
+from PIL import Image, ImageDraw
+import image_preprocessing
+
+def synthetic_photo(width=4032, height=3024):
+    """
+    Returns a noisy 12 MP JPEG with EXIF, similar in size to a phone photo.
+    """
+    image = Image.effect_noise((width // 4, height // 4), 40).resize((width, height)).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=92, exif=exif)
+    return output.getvalue()
+
+def variants(image_bytes, count, seed):
+    """
+    `count` copies of a JPEG with random shapes drawn on them, so their exact and perceptual
+    hashes differ (same size and encoding as the original, EXIF kept).
+    """
+    rng = random.Random(seed)
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        exif = original.info.get("exif", b"")
+        base = original.convert("RGB")
+    copies = []
+    for _ in range(count):
+        image = base.copy()
+        draw = ImageDraw.Draw(image)
+        for _ in range(4):
+            x, y = rng.randrange(image.width), rng.randrange(image.height)
+            w, h = rng.randrange(image.width // 16, image.width // 6), rng.randrange(image.height // 16, image.height // 6)
+            draw.rectangle((x, y, x + w, y + h), fill=(rng.randrange(256),) * 3)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=92, exif=exif)
+        copies.append(output.getvalue())
+    return copies
+
+def timed_each(function, inputs):
+    """
+    Median milliseconds of `function(input)` over the inputs.
+    """
+    durations = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+def timed(function, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return result, statistics.median(durations) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image preprocessing stage.")
+    parser.add_argument("images", nargs="*", help="JPEG files to benchmark")
+    parser.add_argument("--synthetic", action="store_true", help="Use a generated 12 MP photo")
+    parser.add_argument("--url", help="Function to call with preprocessed images (extract_food, get_recipe...)")
+    parser.add_argument("--before-url", help="Baseline function (without preprocessing) to call with base64 JSON")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    images = [(path, open(path, "rb").read()) for path in args.images]
+    if args.synthetic or not images:
+        images.append(("synthetic 12MP", synthetic_photo()))
+
+    for name, original in images:
+        processed, preprocess_ms = timed(lambda: image_preprocessing.preprocess_image(original), args.runs)
+        before_payload = len(base64.b64encode(original))
+        print(f"{name}: {len(original) / 1024:.0f} KiB raw, {before_payload / 1024:.0f} KiB as base64 JSON "
+              f"-> {len(processed) / 1024:.0f} KiB preprocessed "
+              f"({100 * (1 - len(processed) / before_payload):.0f}% smaller), preprocessing {preprocess_ms:.1f} ms")
+
+        # Distinct images per request and per leg (fresh seeds each run), so no request is a cache hit
+        seed = time.time_ns()
+        if args.before_url:
+            before_ms = timed_each(
+                lambda image: requests.post(args.before_url, json={"image": base64.b64encode(image).decode("utf-8")}, timeout=120),
+                variants(original, args.runs, seed),
+            )
+            print(f"  end-to-end median before: {before_ms:.0f} ms (base64 JSON, baseline function)")
+        if args.url:
+            after_ms = timed_each(
+                lambda image: requests.post(
+                    args.url, files={"image": ("image.jpg", image_preprocessing.preprocess_image(image), "image/jpeg")},
+                    timeout=120,
+                ),
+                variants(original, args.runs, seed + 1),
+            )
+            print(f"  end-to-end median after: {after_ms:.0f} ms (incl. client preprocessing)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures time to first audio byte and total time of read-recipe for a long recipe text,
+with a fake Text-to-Speech client whose latency grows with the text length. Runs the
+legacy behaviour (one synthesis of the whole text, base64 JSON) against the segmented
+streaming mode, cold and with the audio cache warm.
+
+Usage:
+    python bench_tts.py [--sentences 30] [--ms-per-char 0.5] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "read-recipe"))
+os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="tts_cache_"))
+
+from flask import Flask
+import clients
+import main
+from audio_cache import AudioCache
+
+class SlowTTS:
+    def __init__(self, seconds_per_char):
+        self.seconds_per_char = seconds_per_char
+        self.calls = 0
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **kwargs):
+        self.calls += 1
+        time.sleep(len(input.text) * self.seconds_per_char)
+        return type("Response", (), {"audio_content": input.text.encode("utf-8")})()
+
+def run(app, text, stream):
+    """
+    Returns (time to first byte, total time) of one request.
+    """
+    path = "/?format=mp3" if stream else "/"
+    start = time.perf_counter()
+    with app.test_request_context(path, method="POST", json={"text": text}):
+        from flask import make_response, request
+        response = make_response(main.text_to_speech(request))
+        first_byte = None
+        for chunk in response.response:
+            if first_byte is None and chunk:
+                first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+def main_():
+    parser = argparse.ArgumentParser(description="Benchmark read-recipe synthesis.")
+    parser.add_argument("--sentences", type=int, default=30)
+    parser.add_argument("--ms-per-char", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    text = " ".join(f"Step {i}: stir the sauce gently and let it simmer for a few minutes." for i in range(args.sentences))
+    tts = SlowTTS(args.ms_per_char / 1000)
+    clients.override("tts", tts)
+    main.tts_executor = main.ThreadPoolExecutor(max_workers=args.workers)
+    app = Flask("bench")
+
+    # Legacy behaviour: the whole text in one synthesis, no cache
+    clients.override("audio_cache", AudioCache())
+    split_segments, main.split_segments = main.split_segments, lambda text: [text]
+    ttfb, total = run(app, text, stream=False)
+    print(f"single synthesis, JSON     ttfb {ttfb * 1000:7.0f}ms  total {total * 1000:7.0f}ms")
+    main.split_segments = split_segments
+
+    clients.reset("audio_cache")
+    for label in ("segmented stream, cold", "segmented stream, cached"):
+        calls = tts.calls
+        ttfb, total = run(app, text, stream=True)
+        print(f"{label:26} ttfb {ttfb * 1000:7.0f}ms  total {total * 1000:7.0f}ms  tts calls {tts.calls - calls}")
+    print("audio cache:", main.get_audio_cache().stats())
+
+if __name__ == "__main__":
+    main_()
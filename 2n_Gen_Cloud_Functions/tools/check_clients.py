@@ -0,0 +1,97 @@
+"""
+Builds the real memoized clients of each function, with no fakes or overrides, the way
+the first request of a cold instance does, and fails if one hangs or raises.
+
+The benchmarks register fakes ahead of time (`fakes.install`), so they never run the
+factories that get other clients (the Fitness service and its discovery document, the
+nutrient cache and the Firestore client, the activity job queue...): this check does.
+Each function runs in a fresh interpreter with a timeout; a hang dumps the stacks.
+Firestore points at an emulator address, so no credentials or network are needed
+(creating a client doesn't connect).
+
+Usage:
+    python check_clients.py [--functions activity-tracker extract-nutrients ...] [--timeout 30]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from bench_cold_start import PLACEHOLDER_ENV, FUNCTIONS_DIR
+
+CHILD_TIMEOUT = float(os.environ.get("CHECK_CLIENTS_TIMEOUT", "30"))  # Seconds before a function counts as hung
+CHECK_ENV = {**PLACEHOLDER_ENV, "FIRESTORE_EMULATOR_HOST": "localhost:8089", "NUTRIENT_CACHE_BACKEND": "firestore"}
+
+def fitness_service():
+    import clients
+    from google.oauth2.credentials import Credentials
+    return clients.fitness_service(Credentials(token="check"), timeout=5)
+
+def upstream_provider(name):
+    def check():
+        import upstream
+        return upstream.provider(name)
+    return check
+
+def main_getter(getter):
+    def check():
+        import main
+        return getattr(main, getter)()
+    return check
+
+# Function directory -> (client, check) pairs
+CHECKS = {
+    "activity-tracker": [("fitness_service", fitness_service), ("upstream:fit", upstream_provider("fit"))],
+    "refresh-activity": [("fitness_service", fitness_service), ("upstream:fit", upstream_provider("fit"))],
+    "extract-nutrients": [
+        ("nutrient_cache", main_getter("get_nutrient_cache")),
+        ("upstream:usda", main_getter("get_usda")),
+        ("upstream:gemini", upstream_provider("gemini")),
+    ],
+    "add-activity": [("activity_jobs", main_getter("get_job_queue")), ("upstream:assemblyai", upstream_provider("assemblyai"))],
+    "get-recipe": [("upstream:spoonacular", upstream_provider("spoonacular"))],
+    "read-recipe": [("audio_cache", main_getter("get_audio_cache")), ("upstream:tts", upstream_provider("tts"))],
+}
+
+def run_child(function):
+    """
+    Runs inside a fresh interpreter: builds the clients of a function.
+    """
+    import faulthandler
+    function_dir = os.path.join(FUNCTIONS_DIR, function)
+    sys.path.insert(0, function_dir)
+    os.chdir(function_dir)
+    faulthandler.dump_traceback_later(CHILD_TIMEOUT, exit=True)
+    for name, check in CHECKS[function]:
+        check()
+        print(f"  {name}: ok", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the real clients of the functions (no fakes).")
+    parser.add_argument("--functions", nargs="*", default=list(CHECKS))
+    parser.add_argument("--timeout", type=float, default=CHILD_TIMEOUT, help="Seconds before a function counts as hung")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    env = {**os.environ, **CHECK_ENV, "CHECK_CLIENTS_TIMEOUT": str(args.timeout)}
+    failed = []
+    for function in args.functions:
+        print(function, flush=True)
+        command = [sys.executable, os.path.abspath(__file__), "--child", function]
+        try:
+            returncode = subprocess.run(command, env=env, timeout=args.timeout + 10).returncode
+        except subprocess.TimeoutExpired:
+            returncode = "timeout"
+        if returncode != 0:
+            print(f"  failed ({returncode})")
+            failed.append(function)
+    if failed:
+        raise SystemExit(f"Client creation failed for: {', '.join(failed)}")
+    print("all clients created")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+In-memory stand-in for the subset of the google-cloud-firestore client used by the Cloud
+Functions: collections, documents, merge/update writes with Increment and SERVER_TIMESTAMP,
+simple queries (where/order_by/limit/start_after), write batches, subcollection listing and
+create / update preconditions (`write_option(last_update_time=...)`, compared with the
+snapshots' `update_time`).
+
+Every operation can be slowed down with `latency` (seconds) to make races between
+concurrent requests visible, and `ops` counts the operations served by type.
+"""
+import copy
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from google.api_core import exceptions
+
+class _Store:
+    def __init__(self, latency):
+        self.docs = {}  # path tuple -> dict
+        self.update_times = {}  # path tuple -> write counter
+        self.writes = 0
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.ops = Counter()
+
+    def wait(self, op):
+        self.ops[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+def _apply(current, fields):
+    """
+    Applies written fields (and their transforms) on top of `current`.
+    """
+    for key, value in fields.items():
+        if type(value).__name__ == "Increment":
+            current[key] = current.get(key, 0) + value.value
+        elif type(value).__name__ == "Sentinel" and "server timestamp" in repr(value).lower():
+            current[key] = datetime.now(timezone.utc)
+        elif type(value).__name__ == "Sentinel" and "delete" in repr(value).lower():
+            current.pop(key, None)
+        else:
+            current[key] = copy.deepcopy(value)
+    return current
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def path(self):
+        return "/".join(self._path)
+
+    def collection(self, name):
+        return CollectionReference(self._store, self._path + (name,))
+
+    def collections(self):
+        self._store.wait("list_collections")
+        depth = len(self._path)
+        with self._store.lock:
+            names = sorted({
+                path[depth] for path in self._store.docs
+                if len(path) > depth + 1 and path[:depth] == self._path
+            })
+        return [self.collection(name) for name in names]
+
+    def get(self):
+        self._store.wait("read")
+        with self._store.lock:
+            return DocumentSnapshot(
+                self, copy.deepcopy(self._store.docs.get(self._path)), self._store.update_times.get(self._path)
+            )
+
+    def _write(self, fields, merge=False):
+        with self._store.lock:
+            current = self._store.docs.get(self._path) if merge else None
+            self._store.docs[self._path] = _apply(dict(current or {}), fields)
+            self._store.writes += 1
+            self._store.update_times[self._path] = self._store.writes
+
+    def set(self, fields, merge=False):
+        self._store.wait("write")
+        self._write(fields, merge)
+
+    def create(self, fields):
+        self._store.wait("write")
+        with self._store.lock:
+            if self._path in self._store.docs:
+                raise exceptions.AlreadyExists(f"Document already exists: {self.path}")
+            self._write(fields)
+
+    def update(self, fields, option=None):
+        self._store.wait("write")
+        with self._store.lock:
+            if self._path not in self._store.docs:
+                raise exceptions.NotFound(f"No document to update: {self.path}")
+            if option is not None and self._store.update_times.get(self._path) != option.last_update_time:
+                raise exceptions.FailedPrecondition(f"Document changed since it was read: {self.path}")
+            self._write(fields, merge=True)
+
+    def delete(self):
+        self._store.wait("delete")
+        with self._store.lock:
+            self._store.docs.pop(self._path, None)
+            self._store.update_times.pop(self._path, None)
+
+class Query:
+    def __init__(self, collection, filters=(), order=None, limit=None, start_after=None):
+        self._collection = collection
+        self._filters = filters
+        self._order = order
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, order=self._order, limit=self._limit, start_after=self._start_after)
+        args.update(changes)
+        return Query(self._collection, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=field)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot_or_values):
+        return self._copy(start_after=snapshot_or_values)
+
+    def _value(self, snapshot, field):
+        return snapshot.id if field == "__name__" else snapshot.get(field)
+
+    def stream(self):
+        ops = {
+            "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+            "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+            "in": lambda a, b: a in b,
+        }
+        store = self._collection._store
+        store.wait("query")
+        prefix = self._collection._path
+        with store.lock:
+            snapshots = [
+                DocumentSnapshot(DocumentReference(store, path), copy.deepcopy(data), store.update_times.get(path))
+                for path, data in store.docs.items()
+                if len(path) == len(prefix) + 1 and path[:-1] == prefix
+            ]
+
+        for field, op, value in self._filters:
+            snapshots = [
+                s for s in snapshots
+                if self._value(s, field) is not None and ops[op](self._value(s, field), value)
+            ]
+
+        order = self._order or "__name__"
+        snapshots = [s for s in snapshots if self._value(s, order) is not None]
+        snapshots.sort(key=lambda s: self._value(s, order))
+
+        if self._start_after is not None:
+            after = self._start_after
+            if isinstance(after, DocumentSnapshot):
+                after = self._value(after, order)
+            elif isinstance(after, dict):
+                after = after[order]
+            snapshots = [s for s in snapshots if self._value(s, order) > after]
+
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return iter(snapshots)
+
+    def get(self):
+        return list(self.stream())
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+        self.id = path[-1]
+        super().__init__(self)
+
+    def document(self, document_id):
+        return DocumentReference(self._store, self._path + (document_id,))
+
+    def list_documents(self):
+        self._store.wait("list_documents")
+        with self._store.lock:
+            ids = sorted({
+                path[len(self._path)] for path in self._store.docs
+                if len(path) > len(self._path) and path[:len(self._path)] == self._path
+            })
+        return [self.document(document_id) for document_id in ids]
+
+class WriteBatch:
+    """
+    Groups writes and applies them atomically on commit (max 500, like Firestore).
+    """
+
+    MAX_WRITES = 500
+
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def _add(self, write):
+        if len(self._writes) >= self.MAX_WRITES:
+            raise ValueError("A batch can contain at most 500 writes")
+        self._writes.append(write)
+
+    def set(self, reference, fields, merge=False):
+        self._add(lambda: reference._write(fields, merge))
+
+    def update(self, reference, fields):
+        self._add(lambda: reference._write(fields, merge=True))
+
+    def delete(self, reference):
+        self._add(lambda: (self._store.docs.pop(reference._path, None), self._store.update_times.pop(reference._path, None)))
+
+    def commit(self):
+        self._store.wait("commit")
+        with self._store.lock:
+            for write in self._writes:
+                write()
+        self._store.ops["batched_writes"] += len(self._writes)
+        self._writes = []
+
+class FakeFirestore:
+    """
+    Drop-in replacement for `firestore.Client()` backed by a dict.
+    """
+
+    def __init__(self, latency=0.0):
+        self._store = _Store(latency)
+
+    @property
+    def ops(self):
+        return self._store.ops
+
+    @property
+    def latency(self):
+        return self._store.latency
+
+    @latency.setter
+    def latency(self, seconds):
+        self._store.latency = seconds
+
+    def collection(self, name):
+        return CollectionReference(self._store, (name,))
+
+    def batch(self):
+        return WriteBatch(self._store)
+
+    def write_option(self, last_update_time):
+        """
+        Precondition of `update`: the document's update time is still `last_update_time`.
+        """
+        return type("WriteOption", (), {"last_update_time": last_update_time})()
+
+    def dump(self):
+        """
+        Returns a copy of every document, keyed by path.
+        """
+        with self._store.lock:
+            return {"/".join(path): copy.deepcopy(data) for path, data in self._store.docs.items()}
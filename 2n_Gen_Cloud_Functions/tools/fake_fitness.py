@@ -0,0 +1,91 @@
+"""
+In-process stand-in for the Google Fitness API, for tests and benchmarks of the Fit sync.
+
+`FakeFitnessAPI.service(credentials)` returns a client that answers
+`users().dataset().aggregate(userId="me", body=...).execute()` with steps, distance and
+kcal at a constant rate per user (derived from the refresh token), split into the
+requested time buckets. Latency, transient failures (503) and revoked tokens can be
+injected. Install it with `clients.override("fitness_factory", api.service)`.
+"""
+import random
+import threading
+import time
+import zlib
+
+class FakeFitnessAPI:
+    def __init__(self, latency=0.0, error_rate=0.0, revoked_tokens=(), seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.revoked_tokens = set(revoked_tokens)
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def service(self, credentials, timeout=None):
+        return _Service(self, getattr(credentials, "refresh_token", None) or getattr(credentials, "token", None))
+
+    def rates(self, token):
+        """
+        Per-minute (steps, distance in m, kcal) of the user owning `token`.
+        """
+        h = zlib.crc32(str(token).encode("utf-8"))
+        return 50 + h % 50, 40 + h % 30, 1.0 + (h % 100) / 100
+
+    def aggregate(self, token, body):
+        from google.auth.exceptions import RefreshError
+        from googleapiclient.errors import HttpError
+        import httplib2
+
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            failing = self._random.random() < self.error_rate
+            if failing:
+                self.errors += 1
+        if token in self.revoked_tokens:
+            raise RefreshError("invalid_grant: Token has been expired or revoked.")
+        if failing:
+            raise HttpError(httplib2.Response({"status": "503"}), b"Service unavailable")
+
+        steps, distance, kcal = self.rates(token)
+        start, end = int(body["startTimeMillis"]), int(body["endTimeMillis"])
+        duration = int(body["bucketByTime"]["durationMillis"])
+        buckets = []
+        for bucket_start in range(start, end, duration):
+            bucket_end = min(bucket_start + duration, end)
+            minutes = (bucket_end - bucket_start) / 60000
+            buckets.append({
+                "startTimeMillis": str(bucket_start),
+                "endTimeMillis": str(bucket_end),
+                "dataset": [
+                    _dataset("com.google.step_count.delta", {"intVal": int(steps * minutes)}),
+                    _dataset("com.google.distance.delta", {"fpVal": distance * minutes}),
+                    _dataset("com.google.calories.expended", {"fpVal": kcal * minutes}),
+                ],
+            })
+        return {"bucket": buckets}
+
+def _dataset(data_type, value):
+    return {"dataSourceId": f"derived:{data_type}:com.google.android.gms:aggregated", "point": [{"value": [value]}]}
+
+class _Service:
+    def __init__(self, api, token):
+        self._api = api
+        self._token = token
+
+    def users(self):
+        return self
+
+    def dataset(self):
+        return self
+
+    def aggregate(self, userId=None, body=None):
+        return _Request(lambda: self._api.aggregate(self._token, body))
+
+class _Request:
+    def __init__(self, call):
+        self._call = call
+
+    def execute(self):
+        return self._call()
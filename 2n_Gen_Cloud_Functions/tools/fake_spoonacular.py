@@ -0,0 +1,96 @@
+"""
+Local stand-in for the Spoonacular API, for load tests of get-recipe.
+
+Serves /recipes/complexSearch with `number` generated recipes for the requested
+ingredients, after a configurable latency, and counts the calls (and quota points) it
+receives; GET /stats returns the counters. Point get-recipe at it with
+SPOONACULAR_URL=http://localhost:<port>.
+
+Usage:
+    python fake_spoonacular.py [--port 8089] [--latency 0.3]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeSpoonacular(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.calls = 0
+        self.points = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def stats(self):
+        return {"calls": self.calls, "points": round(self.points, 2)}
+
+    def start(self):
+        """
+        Serves in a background thread and returns the server.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/stats":
+            return self._send(200, self.server.stats())
+        if url.path != "/recipes/complexSearch":
+            return self._send(404, {"status": "failure", "message": "Not found"})
+        if not query.get("apiKey"):
+            return self._send(401, {"status": "failure", "message": "Missing apiKey"})
+
+        time.sleep(self.server.latency)
+        number = int(query.get("number", ["10"])[0])
+        ingredients = query.get("includeIngredients", [""])[0]
+        with self.server._lock:
+            self.server.calls += 1
+            # Roughly Spoonacular's pricing: 1 point + 0.01 per result (+ 0.025 with information)
+            self.server.points += 1 + number * (0.035 if query.get("addRecipeInformation") else 0.01)
+
+        title = ingredients.replace(",", " and ") or "Chef's choice"
+        results = [
+            {
+                "id": abs(hash((ingredients, i))) % 10 ** 6,
+                "title": f"{title.title()} #{i + 1}",
+                "image": f"https://img.example.com/{i}.jpg",
+                "summary": f"A recipe with {title}. " * 20,
+            }
+            for i in range(number)
+        ]
+        self._send(200, {"results": results, "offset": 0, "number": number, "totalResults": number})
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Spoonacular API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per search")
+    args = parser.parse_args()
+
+    server = FakeSpoonacular(args.port, args.latency)
+    print(f"Fake Spoonacular listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+In-process fakes of every upstream the Cloud Functions call (Gemini, USDA, Spoonacular,
+AssemblyAI, Google Fit, Text-to-Speech and Firestore), each with a configurable latency
+and a call counter.
+
+`install(clients, latencies)` swaps them in through `clients.override` and returns an
+`Upstreams` object whose `stats()` gives the calls made to each provider.
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future
+from fake_firestore import FakeFirestore
+from fake_fitness import FakeFitnessAPI
+
+# Default latency of each provider (seconds), roughly what production sees
+DEFAULT_LATENCIES = {
+    "gemini": 0.8,
+    "usda": 0.15,
+    "spoonacular": 0.3,
+    "assemblyai": 2.0,
+    "fit": 0.2,
+    "tts": 0.3,
+    "firestore": 0.01,
+}
+
+class _Counter:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self.payload
+
+class FakeUSDASession(_Counter):
+    """
+    Stands in for the USDA session: every food has the same nutrients.
+    """
+
+    def get(self, url, params=None, timeout=None):
+        self.hit()
+        return FakeResponse({"foods": [{"foodNutrients": [
+            {"nutrientName": "Energy", "unitName": "KCAL", "value": 52},
+            {"nutrientName": "Protein", "unitName": "G", "value": 0.3},
+            {"nutrientName": "Carbohydrate, by difference", "unitName": "G", "value": 13.8},
+        ]}]})
+
+class FakeSpoonacularSession(_Counter):
+    """
+    Stands in for the Spoonacular session: `number` recipes named after the ingredients.
+    """
+
+    def get(self, url, params=None, timeout=None):
+        self.hit()
+        params = params or {}
+        ingredients = str(params.get("includeIngredients", ""))
+        return FakeResponse({"results": [
+            {"id": i, "title": f"{ingredients} #{i + 1}", "image": "", "summary": f"A recipe with {ingredients}."}
+            for i in range(int(params.get("number", 1)))
+        ]})
+
+class FakeGemini(_Counter):
+    """
+    Answers the food detection and kcal estimation prompts with valid JSON.
+    """
+
+    class _Part:
+        def __init__(self, text):
+            self.text = text
+
+    def generate_content(self, contents, **kwargs):
+        self.hit()
+        prompt = json.dumps(contents, default=str)
+        text = json.dumps([250] * prompt.count("Activity ")) if "fitness expert" in prompt else '["Apple", "Rice"]'
+        part = self._Part(text)
+        content = type("Content", (), {"parts": [part]})()
+        candidate = type("Candidate", (), {"content": content})()
+        usage = type("Usage", (), {"prompt_token_count": 300, "candidates_token_count": 8})()
+        return type("Response", (), {"text": text, "candidates": [candidate], "usage_metadata": usage})()
+
+class FakeTTS(_Counter):
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **kwargs):
+        self.hit()
+        return type("Response", (), {"audio_content": b"ID3" + b"\0" * 1024})()
+
+class FakeAssemblyAI(_Counter):
+    """
+    Stands in for the assemblyai module.
+    """
+
+    class SpeechModel:
+        best = "best"
+
+    class TranscriptionConfig:
+        def __init__(self, **kwargs):
+            pass
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        fake = self
+
+        class Transcriber:
+            def __init__(self, config=None):
+                pass
+
+            def transcribe(self, data):
+                fake.hit()
+                return type("Transcript", (), {"status": "completed", "error": None, "text": "I ran for 30 minutes"})()
+
+            def transcribe_async(self, data):
+                future = Future()
+                future.set_result(self.transcribe(data))
+                return future
+
+        self.Transcriber = Transcriber
+
+class Upstreams:
+    """
+    The fakes installed for a run.
+    """
+
+    def __init__(self, latencies=None):
+        latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.firestore = FakeFirestore(latency=latencies["firestore"])
+        self.gemini = FakeGemini(latencies["gemini"])
+        self.usda = FakeUSDASession(latencies["usda"])
+        self.spoonacular = FakeSpoonacularSession(latencies["spoonacular"])
+        self.tts = FakeTTS(latencies["tts"])
+        self.assemblyai = FakeAssemblyAI(latencies["assemblyai"])
+        self.fit = FakeFitnessAPI(latency=latencies["fit"])
+
+    def stats(self):
+        """
+        Calls made to each provider so far.
+        """
+        return {
+            "gemini": self.gemini.calls,
+            "usda": self.usda.calls,
+            "spoonacular": self.spoonacular.calls,
+            "assemblyai": self.assemblyai.calls,
+            "fit": self.fit.calls,
+            "tts": self.tts.calls,
+            "firestore": sum(count for op, count in self.firestore.ops.items() if op != "batched_writes"),
+        }
+
+def install(clients, latencies=None):
+    """
+    Replaces every upstream client of a function with a fake and returns them.
+    """
+    upstreams = Upstreams(latencies)
+    clients.override("firestore", upstreams.firestore)
+    clients.override("gemini:gemini-1.5-flash", upstreams.gemini)
+    clients.override("http_session:usda", upstreams.usda)
+    clients.override("http_session:spoonacular", upstreams.spoonacular)
+    clients.override("tts", upstreams.tts)
+    clients.override("assemblyai", upstreams.assemblyai)
+    clients.override("fitness_factory", upstreams.fit.service)
+    return upstreams
@@ -0,0 +1,282 @@
+"""
+Load test of the Python functions on fake upstreams: throughput, tail latency and
+upstream calls per endpoint.
+
+Each function is served locally by functions-framework (threaded) in its own process,
+with Gemini, USDA, Spoonacular, AssemblyAI, Google Fit, Text-to-Speech and Firestore
+replaced by the fakes of `fakes.py`. Their latencies default to `fakes.DEFAULT_LATENCIES`
+times `--latency-scale`, and each provider can be set with `--latency gemini=1.2`.
+The driver sends `--requests` requests with `--concurrency` clients, cycling through
+`--distinct` different payloads (so caches see a realistic mix of hits and misses), and
+reports p50/p95/p99, requests per second, errors and upstream calls per request.
+
+The rate limits of the upstream admission control (see upstream.py) are lifted, since
+they model the quotas of the real APIs, not the fakes: `--limits` keeps them, to see the
+503s they return under load.
+
+Results are saved as JSON in `bench_results/` and compared with the previous run (or
+with `--compare FILE`), so regressions show up as deltas.
+
+Usage:
+    python loadtest.py [--functions get-recipe read-recipe ...] [--requests 200] [--concurrency 8]
+                       [--distinct 20] [--latency-scale 1.0] [--latency gemini=1.2 ...] [--limits]
+                       [--compare FILE]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bench_cold_start import FUNCTIONS, PLACEHOLDER_ENV, TOOLS_DIR, FUNCTIONS_DIR
+
+RESULTS_DIR = os.path.join(TOOLS_DIR, "bench_results")
+STATS_PATH = "/__bench/stats"
+
+# Users seeded for the sweeper, so remove-tracings has something to page through
+SWEEPER_USERS = 200
+
+def serve(function, port, latencies):
+    """
+    Runs inside the server process: installs the fakes and serves the function.
+    """
+    function_dir = os.path.join(FUNCTIONS_DIR, function)
+    sys.path.insert(0, function_dir)
+    sys.path.insert(1, TOOLS_DIR)
+    os.chdir(function_dir)
+
+    import clients
+    import fakes
+    import functions_framework
+    from flask import jsonify
+    from werkzeug.serving import make_server
+
+    upstreams = fakes.install(clients, latencies)
+    if function == "remove-tracings":
+        from sweeper_bench import seed
+        latency, upstreams.firestore.latency = upstreams.firestore.latency, 0
+        seed(upstreams.firestore, SWEEPER_USERS, 1)
+        upstreams.firestore.ops.clear()
+        upstreams.firestore.latency = latency
+
+    app = functions_framework.create_app(FUNCTIONS[function], os.path.join(function_dir, "main.py"))
+    app.add_url_rule(STATS_PATH, "bench_stats", lambda: jsonify(upstreams.stats()))
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+def sample_jpegs(count):
+    """
+    `count` photos with different layouts, so the perceptual hash of the detection cache
+    (FOOD_CACHE_PHASH) doesn't take them for the same meal.
+    """
+    import random
+    from PIL import Image, ImageDraw
+    images = []
+    for i in range(count):
+        rng = random.Random(i)
+        image = Image.new("RGB", (640, 480), (rng.randrange(256),) * 3)
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(560), rng.randrange(400)
+            draw.rectangle((x, y, x + rng.randrange(40, 240), y + rng.randrange(40, 200)), fill=(rng.randrange(256),) * 3)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=85)
+        images.append(output.getvalue())
+    return images
+
+def request_kwargs(function, i, images):
+    """
+    Returns the `requests` arguments of the i-th payload of a function.
+    """
+    if function in ("extract-food-from-image", "extract-nutrients", "get-recipe"):
+        return {"files": {"image": ("meal.jpg", images[i])}, "data": {"user_id": f"user-{i}"}}
+    if function == "read-recipe":
+        return {"json": {"text": f"Preheat the oven to {150 + i} degrees. Bake for twenty minutes, then let it rest."}}
+    if function == "add-activity":
+        return {"files": {"file": ("a.wav", b"RIFF" + i.to_bytes(4, "little") + b"\0" * 64)}, "data": {"userId": f"user-{i}"}}
+    if function == "activity-tracker":
+        return {"json": {"access_token": f"token-{i}", "user_id": f"user-{i}"}}
+    return {"json": {"dry_run": True}}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(function, latencies, env):
+    port = free_port()
+    log = tempfile.TemporaryFile(mode="w+")
+    command = [sys.executable, os.path.abspath(__file__), "--serve", function, "--port", str(port),
+               "--latencies", json.dumps(latencies)]
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, log, f"http://127.0.0.1:{port}"
+
+def wait_ready(session, base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            return session.get(base_url + STATS_PATH, timeout=1).json()
+        except Exception:
+            time.sleep(0.1)
+    return None
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def run_load(base_url, function, requests_count, concurrency, distinct):
+    """
+    Sends the requests and returns their (latency, status) and the elapsed time.
+    """
+    import requests
+
+    images = sample_jpegs(distinct) if function in ("extract-food-from-image", "extract-nutrients", "get-recipe") else []
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            status = local.session.post(base_url + "/", timeout=120, **request_kwargs(function, i % distinct, images)).status_code
+        except requests.RequestException:
+            status = 0
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(send, range(requests_count)))
+    return samples, time.perf_counter() - start
+
+def benchmark(function, args, latencies, env):
+    import requests
+
+    # A fresh audio cache per run, so earlier runs don't turn synthesis into cache hits
+    cache_dir = tempfile.TemporaryDirectory(prefix="loadtest-tts-")
+    process, log, base_url = start_server(function, latencies, {**env, "TTS_CACHE_DIR": cache_dir.name})
+    try:
+        with requests.Session() as session:
+            before = wait_ready(session, base_url, process)
+            if before is None:
+                log.seek(0)
+                return {"function": function, "error": (log.read().strip().splitlines() or ["did not start"])[-1]}
+            samples, elapsed = run_load(base_url, function, args.requests, args.concurrency, args.distinct)
+            after = session.get(base_url + STATS_PATH, timeout=5).json()
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+        cache_dir.cleanup()
+
+    latencies_s = [latency for latency, _ in samples]
+    errors = sum(1 for _, status in samples if status == 0 or status >= 500)
+    return {
+        "function": function,
+        "requests": len(samples),
+        "errors": errors,
+        "statuses": {str(status): sum(1 for _, s in samples if s == status) for status in sorted({s for _, s in samples})},
+        "rps": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentile(latencies_s, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies_s, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies_s, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies_s) * 1000, 1),
+        "upstream_calls": {provider: after[provider] - before.get(provider, 0) for provider in after},
+    }
+
+def parse_latencies(args):
+    import fakes
+    latencies = {provider: latency * args.latency_scale for provider, latency in fakes.DEFAULT_LATENCIES.items()}
+    for setting in args.latency:
+        provider, _, value = setting.partition("=")
+        if provider not in latencies:
+            raise SystemExit(f"Unknown provider {provider!r} (one of {', '.join(latencies)})")
+        latencies[provider] = float(value)
+    return latencies
+
+def previous_results(path=None):
+    if path is None:
+        runs = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+        if not runs:
+            return None
+        path = runs[-1]
+    with open(path) as f:
+        return json.load(f)
+
+def print_results(results, baseline):
+    previous = {result["function"]: result for result in (baseline or {}).get("results", [])}
+
+    def delta(result, key):
+        old = previous.get(result["function"], {}).get(key)
+        if not old:
+            return ""
+        return f" ({(result[key] - old) / old:+.0%})"
+
+    print(f"{'function':26} {'rps':>14} {'p50':>16} {'p95':>16} {'p99':>16} {'errors':>7}  upstream calls / request")
+    for result in results:
+        if "error" in result:
+            print(f"{result['function']:26} failed: {result['error']}")
+            continue
+        per_request = {
+            provider: round(calls / result["requests"], 2)
+            for provider, calls in result["upstream_calls"].items() if calls
+        }
+        print(
+            f"{result['function']:26} {str(result['rps']) + delta(result, 'rps'):>14}"
+            + "".join(f" {str(result[key]) + 'ms' + delta(result, key):>16}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+            + f" {result['errors']:>7}  {per_request}"
+        )
+    if baseline:
+        print(f"compared with the run of {baseline['started_at']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Python Cloud Functions on fake upstreams.")
+    parser.add_argument("--functions", nargs="*", default=list(FUNCTIONS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per function")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--distinct", type=int, default=20, help="Different payloads cycled through")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier of the default upstream latencies")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="PROVIDER=SECONDS", help="Latency of one provider")
+    parser.add_argument("--limits", action="store_true", help="Keep the upstream rate limits")
+    parser.add_argument("--compare", help="Results file to compare with (default: the previous run)")
+    parser.add_argument("--no-save", action="store_true", help="Don't store the results")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--latencies", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, json.loads(args.latencies))
+        return
+
+    latencies = parse_latencies(args)
+    baseline = previous_results(args.compare)
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    if not args.limits:
+        env.update({f"UPSTREAM_{provider.upper()}_RATE": "0" for provider in latencies if provider != "firestore"})
+    run = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            "requests": args.requests, "concurrency": args.concurrency,
+            "distinct": args.distinct, "latencies": latencies, "limits": args.limits,
+        },
+        "results": [benchmark(function, args, latencies, env) for function in args.functions],
+    }
+    print_results(run["results"], baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, run["started_at"].replace(":", "") + ".json")
+        with open(path, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"results saved to {path}")
+
+if __name__ == "__main__":
+    main()
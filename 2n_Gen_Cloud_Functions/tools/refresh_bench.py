@@ -0,0 +1,67 @@
+"""
+Runs the refresh-activity job against the in-memory Firestore and the fake Fitness API.
+
+Seeds `--users` users with stored refresh tokens (some revoked, some missing), runs the
+refresher with injected latency and transient failures, and checks that every user with
+a valid token got today's Fit totals.
+
+Usage:
+    python refresh_bench.py [--users 2000] [--workers 16] [--latency 0.02] [--error-rate 0.05] [--limits]
+
+The Fit rate limit of the admission control (upstream.py) is lifted unless `--limits` is
+given, so the run measures the refresher rather than the quota.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "refresh-activity"))
+
+import clients
+import daily_tracking
+from fake_firestore import FakeFirestore
+from fake_fitness import FakeFitnessAPI
+from refresher import Refresher, FIT_TOKENS_COLLECTION
+
+def seed(db, users):
+    revoked = set()
+    for i in range(users):
+        user_id = f"user-{i:06d}"
+        token = f"token-{i}" if i % 100 else None  # 1% without token
+        if i % 100 == 1:
+            revoked.add(token)  # 1% revoked
+        db.collection(FIT_TOKENS_COLLECTION).document(user_id).set({"refresh_token": token})
+    return revoked
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the activity refresher on fakes.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per Fitness API call")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Share of calls failing with 503")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="Seconds per Firestore operation")
+    parser.add_argument("--limits", action="store_true", help="Keep the Fit rate limit")
+    args = parser.parse_args()
+    if not args.limits:
+        os.environ["UPSTREAM_FIT_RATE"] = "0"
+
+    db = FakeFirestore()
+    revoked = seed(db, args.users)
+    db.latency = args.db_latency
+    api = FakeFitnessAPI(latency=args.latency, error_rate=args.error_rate, revoked_tokens=revoked)
+    clients.override("fitness_factory", api.service)
+
+    report = Refresher(db, workers=args.workers, backoff=0.05).run()
+    print("report:", report)
+    print(f"fitness calls: {api.calls} ({api.errors} injected errors), firestore ops: {dict(db.ops)}")
+
+    db.latency = 0
+    synced = [
+        user_id for user_id in (f"user-{i:06d}" for i in range(args.users))
+        if daily_tracking.get_day(db, user_id).get("fit_steps") is not None
+    ]
+    print(f"users with today's Fit totals: {len(synced)}")
+    sys.exit(0 if len(synced) == report["refreshed"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Runs the remove-tracings sweeper against the in-memory Firestore stand-in.
+
+Seeds `--users` users with old and current day documents (and legacy timestamp-named
+collections), then runs a dry run, an interrupted run and its resumption (both keeping
+rollups and an NDJSON export), and checks that only today's data is left and that every
+deleted day is in the rollups and the export exactly once.
+
+Usage:
+    python sweeper_bench.py [--users 2000] [--days 3] [--workers 8] [--latency 0.001]
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remove-tracings"))
+
+import daily_tracking
+import history
+from fake_firestore import FakeFirestore
+from sweeper import Sweeper
+
+def seed(db, users, days):
+    today = daily_tracking.today()
+    for i in range(users):
+        user_id = f"user-{i:06d}"
+        db.collection("users").document(user_id).set({"name": user_id})
+        for offset in range(days + 1):
+            day = today - timedelta(days=offset)
+            daily_tracking.set_day_fields(db, user_id, {"kcal": 1000, "burnt_kcal": 300}, day)
+        # One legacy collection from yesterday
+        legacy = (today - timedelta(days=1)).strftime("%Y-%m-%dT08:00:00")
+        db.collection("users").document(user_id).collection(legacy).document("nutrients").set({"kcal": 500})
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracing sweeper on an in-memory Firestore.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=3, help="Old days per user")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.001, help="Seconds per Firestore operation")
+    args = parser.parse_args()
+
+    db = FakeFirestore()
+    seed(db, args.users, args.days)
+    db.latency = args.latency
+
+    print("dry run:", Sweeper(db, dry_run=True, workers=args.workers).run())
+
+    # Stop right after the first page, then resume from the checkpoint
+    export_dir = tempfile.mkdtemp(prefix="sweeper-export-")
+    for name, time_budget in (("interrupted", 0), ("resumed", None)):
+        with history.Exporter(name, export_dir, "ndjson") as exporter:
+            report = Sweeper(db, workers=args.workers, time_budget=time_budget, rollups=True, exporter=exporter).run()
+        print(f"{name}:", report)
+
+    left = db.dump()
+    today_id = daily_tracking.day_id()
+    stale = [path for path in left if "/days/" in path and not path.endswith(today_id)]
+    legacy = [path for path in left if path.endswith("/nutrients")]
+    checkpoints = [path for path in left if path.startswith("sweeper_checkpoints/")]
+    print(f"left: {len(stale)} old day docs, {len(legacy)} legacy docs, {len(checkpoints)} checkpoints")
+
+    # Seeded old days: `days` day documents (1000 kcal) and one legacy collection (500 kcal) per user
+    expected_kcal = args.users * (args.days * 1000 + 500)
+    monthly_kcal = sum(doc.get("kcal", 0) for path, doc in left.items() if "/rollups/" in path and "-W" not in path)
+    exported = 0
+    for path in glob.glob(os.path.join(export_dir, "*.ndjson")):
+        with open(path) as f:
+            exported += sum(1 for _ in f)
+    print(f"monthly rollups: {monthly_kcal} kcal (expected {expected_kcal}), exported days: {exported}")
+    sys.exit(1 if stale or legacy or checkpoints or monthly_kcal != expected_kcal or exported != args.users * (args.days + 1) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 // @aandreu7
 
 import * as functions from 'firebase-functions/v1';
+import { FieldValue } from 'firebase-admin/firestore';
 import { db } from './firebase';
 
 /*
@@ -47,27 +48,13 @@ export const onExerciseCompleted = functions.firestore
 
     const userId = context.params.userId;
 
-    const userRef = db.collection('users').doc(userId);
-    const collections = await userRef.listCollections();
+    // Today's tracking document (users/{uid}/days/{YYYY-MM-DD})
+    const todayDate = new Date().toISOString().slice(0, 10);
+    const dayRef = db.collection('users').doc(userId).collection('days').doc(todayDate);
 
-    const timestampRegex = /^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$/;
-    let targetCollection = collections.find(col => timestampRegex.test(col.id));
-
-    // If today's collection does not exist, create a new one with current timestamp
-    if (!targetCollection) {
-      const newTimestamp = new Date().toISOString().slice(0, 19);
-      targetCollection = userRef.collection(newTimestamp);
-    }
-
-    const nutrientsRef = targetCollection.doc('nutrients');
-    const nutrientsSnap = await nutrientsRef.get();
-
-    // Get previous burnt kcal, default to 0 if not found
-    const prevKcal = nutrientsSnap.exists ? nutrientsSnap.data()?.burnt_kcal || 0 : 0;
-
-    // Update the nutrients document, merging the new burnt kcal total
-    await nutrientsRef.set(
-      { burnt_kcal: prevKcal + totalNewKcal },
+    // Atomically add the new burnt kcal to today's document
+    await dayRef.set(
+      { date: todayDate, burnt_kcal: FieldValue.increment(totalNewKcal), updated_at: FieldValue.serverTimestamp() },
       { merge: true }
     );
   });
\ No newline at end of file
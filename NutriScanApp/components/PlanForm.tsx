@@ -3,7 +3,7 @@
 
 import React, { useState, useEffect } from 'react';
 import { View, Text, TextInput, Button, Alert } from 'react-native';
-import { doc, updateDoc } from 'firebase/firestore';
+import { doc, updateDoc, setDoc, serverTimestamp } from 'firebase/firestore';
 import { auth, db } from '@/firebaseConfig';
 
 type Props = {
@@ -109,6 +109,14 @@ export default function PlanForm({ onBack, initialData }: Props) {
         kcal_target: kcalGoal,
       });
 
+      // Keep today's summary document (read by the dashboard) in line with the new target
+      const todayDate = new Date().toISOString().slice(0, 10);
+      await setDoc(
+        doc(db, 'users', user.uid, 'days', todayDate),
+        { date: todayDate, kcal_target: kcalGoal, updated_at: serverTimestamp() },
+        { merge: true }
+      );
+
       Alert.alert('✅ Plan successfully saved.');
       onBack();
     } catch (error) {
@@ -12,6 +12,12 @@ type Props = {
   userId: string;
 };
 
+// Polling of background activity jobs
+const JOB_POLL_INTERVAL_MS = 1500;
+const JOB_POLL_ATTEMPTS = 40;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
 /*
   AddActivity Component
 
@@ -93,13 +99,31 @@ export default function AddActivity({ onBack, userId }: Props) {
                 mimeType: 'audio/m4a',
                 parameters: {
                   userId: userId,
+                  mode: 'async',
                 },
               });
 
               console.log(response);
               if (response.status>199 && response.status<400) {
-                  const data = JSON.parse(response.body);
-                  setAnswer(JSON.stringify(data));
+                  // The audio is processed in the background: poll the job until it is done
+                  const { job_id } = JSON.parse(response.body);
+                  const statusUrl = `${url}?job_id=${job_id}&userId=${encodeURIComponent(userId)}`;
+                  let data = null;
+                  for (let attempt = 0; attempt < JOB_POLL_ATTEMPTS && !data; attempt++) {
+                      await sleep(JOB_POLL_INTERVAL_MS);
+                      const statusResponse = await fetch(statusUrl);
+                      const job = await statusResponse.json();
+                      if (job.status === 'done') {
+                          data = job;
+                      } else if (job.status === 'failed') {
+                          break;
+                      }
+                  }
+                  if (data) {
+                      setAnswer(JSON.stringify(data));
+                  } else {
+                      Alert.alert("Error", "We could not understand you.");
+                  }
               }
               else {
                   Alert.alert("Error", "We could not understand you.");
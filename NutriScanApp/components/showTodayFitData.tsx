@@ -24,21 +24,6 @@ const ANDROID_CLIENT_ID = Constants.expoConfig.extra.ANDROID_CLIENT_ID;
 // Cloud Function endpoint that will handle the fitness data retrieval
 const CLOUD_FUNCTION_URL = 'https://activity-tracker-604265048430.europe-southwest1.run.app';
 
-// Converts milliseconds to a readable date string
-function millisToDate(ms: number): string {
-  return new Date(ms).toLocaleDateString();
-}
-
-// Extracts the numeric value from a Google Fit dataset
-function getValue(dataset: any) {
-  if (!dataset.point || dataset.point.length === 0) return 0;
-
-  const value = dataset.point[0]?.value[0];
-  if (!value) return 0;
-
-  return value.fpVal || value.intVal || 0;
-}
-
 // Hook for Google authentication request
 export default function GoogleAccessTokenButton({ onBack, userId }: Props) {
   const [accessRequest, accessResponse, promptAccessTokenAsync] = Google.useAuthRequest({
@@ -48,7 +33,6 @@ export default function GoogleAccessTokenButton({ onBack, userId }: Props) {
     'https://www.googleapis.com/auth/fitness.activity.read',
     'https://www.googleapis.com/auth/fitness.location.read',
     'https://www.googleapis.com/auth/fitness.body.read',
-    'https://www.googleapis.com/auth/fitness.heart_rate.read',
     'openid',
     'profile',
     'email'
@@ -76,19 +60,14 @@ export default function GoogleAccessTokenButton({ onBack, userId }: Props) {
         return;
       }
 
-      const json = await res.json();
-      const buckets = json.bucket || [];
-
-      // Process each bucket to extract and format fitness data
-      const processed = buckets.map((bucket: any) => {
-        const date = millisToDate(parseInt(bucket.startTimeMillis));
-        const steps = getValue(bucket.dataset.find((d: any) => d.dataSourceId.includes('step_count')));
-        const distance = getValue(bucket.dataset.find((d: any) => d.dataSourceId.includes('distance')));
-        const calories = getValue(bucket.dataset.find((d: any) => d.dataSourceId.includes('calories')));
-        const heartRate = getValue(bucket.dataset.find((d: any) => d.dataSourceId.includes('heart_rate')));
-
-        return { date, steps, distance, calories, heartRate };
-      });
+      // Compact summary of today: { date, steps, distance_m, kcal, synced_until }
+      const summary = await res.json();
+      const processed = [{
+        date: new Date(summary.date).toLocaleDateString(),
+        steps: summary.steps,
+        distance: summary.distance_m,
+        calories: summary.kcal,
+      }];
 
       setDailyData(processed);
       console.log("✅ Activity data received:", processed);
@@ -141,7 +120,6 @@ export default function GoogleAccessTokenButton({ onBack, userId }: Props) {
                         <Text>🚶 Steps: {entry.steps}</Text>
                         <Text>🧭 Distance: {(entry.distance / 1000).toFixed(2)} km</Text>
                         <Text>🔥 Calories: {entry.calories.toFixed(0)} kcal</Text>
-                        <Text>❤️ Heart rate: {entry.heartRate.toFixed(0)} bpm</Text>
                     </View>
                 ))}
         </View>